@@ -0,0 +1,46 @@
+import pkgutil
+import time
+
+from importlib import import_module
+
+
+def measure(func, number=1, repeat=5):
+    """
+    Return the best wall-clock time, in seconds, of calling `func` `number`
+    times in a row, out of `repeat` attempts.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def print_table(title, header, rows):
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [
+        max(len(str(cell)) for cell in column)
+        for column
+        in zip(header, *rows)
+    ]
+    print(title)
+    print('  '.join(str(cell).rjust(width) for cell, width in zip(header, widths)))
+    for row in rows:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+    print()
+
+
+def get_benchmarks(module):
+    for name in sorted(dir(module)):
+        if name.startswith('bench_'):
+            yield getattr(module, name)
+
+
+def run():
+    package = import_module('runners.benchmarks')
+    for _, modname, _ in pkgutil.iter_modules(package.__path__):
+        module = import_module('runners.benchmarks.{}'.format(modname))
+        for benchmark in get_benchmarks(module):
+            benchmark()
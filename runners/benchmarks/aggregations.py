@@ -0,0 +1,101 @@
+from shared.common_query import A
+from shared.common_query.aggregations import Count, Has, Mean, Median, Sum
+from shared.querysets.memory import MemoryQuerySet
+
+from runners.benchmarks import measure, print_table
+from runners.benchmarks.stores import make_users
+
+
+class ListCount(Count):
+    def reducer(self, queryset):
+        return len(list(queryset))
+
+
+class ListHas(Has):
+    def reducer(self, queryset):
+        return any(list(queryset))
+
+
+class TwoPassMean(Mean):
+    def reducer(self, queryset):
+        return Sum(self.field).reducer(queryset) / ListCount(self.field).reducer(queryset)
+
+
+class SortingMedian(Median):
+    def reducer(self, queryset):
+        values = sorted(queryset.compiler.get_value(object, self.field) for object in queryset)
+        length = len(values)
+        if length % 2 == 0:
+            return sum([values[length // 2], values[length // 2 - 1]]) / 2
+        return values[length // 2]
+
+
+def bench_aggregations():
+    results = []
+
+    for size in (10000, 100000):
+        users = make_users(size)
+        queryset = MemoryQuerySet(get_objects=lambda: users).filter(A('points') >= 0)
+
+        for label, old, new in (
+            ('count', ListCount('id'), Count('id')),
+            ('has', ListHas('id'), Has('id')),
+            ('mean', TwoPassMean('points'), Mean('points')),
+            ('median', SortingMedian('points'), Median('points')),
+        ):
+            before = measure(lambda: queryset.aggregate(old), repeat=3)
+            after = measure(lambda: queryset.aggregate(new), repeat=3)
+            results.append((size, label, '{:.2f}'.format(before * 1e3), '{:.2f}'.format(after * 1e3), '{:.1f}x'.format(before / after)))
+
+    print_table(
+        'Aggregations (ms): list-building reducers vs streaming reducers',
+        ('rows', 'aggregation', 'before', 'after', 'speedup'),
+        results,
+    )
+
+
+def bench_multiple_aggregations():
+    results = []
+
+    for size in (10000, 100000):
+        users = make_users(size)
+        queryset = MemoryQuerySet(get_objects=lambda: users).filter(A('points') >= 0)
+        aggregations = {'count': Count('id'), 'sum': Sum('points'), 'mean': Mean('points')}
+
+        separate = measure(lambda: {name: queryset.aggregate(aggregation) for name, aggregation in aggregations.items()}, repeat=3)
+        together = measure(lambda: queryset.aggregate(**aggregations), repeat=3)
+        results.append((size, '{:.2f}'.format(separate * 1e3), '{:.2f}'.format(together * 1e3), '{:.1f}x'.format(separate / together)))
+
+    print_table(
+        'count, sum and mean (ms): one aggregate() call each vs a single pass',
+        ('rows', 'separate', 'single pass', 'speedup'),
+        results,
+    )
+
+
+def bench_group_by():
+    results = []
+
+    for size in (10000, 100000):
+        users = make_users(size)
+        queryset = MemoryQuerySet(get_objects=lambda: users)
+
+        def by_hand():
+            names = sorted({user.name for user in users})
+            return [
+                {'name': name, 'points': queryset.filter(A('name') == name).aggregate(Sum('points'))}
+                for name
+                in names[:50]
+            ]
+
+        # Grouping by hand scans once per group, so time it over 50 of the
+        # 1000 groups and scale up.
+        old = measure(by_hand, repeat=1) * 20
+        new = measure(lambda: list(queryset.group_by('name', points=Sum('points'))), repeat=3)
+        results.append((size, '{:.1f}'.format(old * 1e3), '{:.1f}'.format(new * 1e3), '{:.0f}x'.format(old / new)))
+
+    print_table(
+        'Sum of points per name, 1000 names (ms): a filtered aggregate per name vs group_by',
+        ('rows', 'per name', 'group_by', 'speedup'),
+        results,
+    )
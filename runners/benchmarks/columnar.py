@@ -0,0 +1,34 @@
+from shared.common_query import A
+from shared.common_query.aggregations import Mean, Median, Sum
+from shared.querysets.columnar import ColumnarQuerySet
+from shared.querysets.memory import MemoryQuerySet
+
+from runners.benchmarks import measure, print_table
+from runners.benchmarks.stores import make_users
+
+
+def bench_columnar():
+    results = []
+
+    for size in (10000, 100000):
+        users = make_users(size)
+        rows = MemoryQuerySet(get_objects=lambda: users)
+        columns = ColumnarQuerySet.from_objects(users, fields=['id', 'name', 'points'])
+
+        for label, build in (
+            ('filter points range', lambda queryset: list(queryset.filter(A('points') >= 1000, A('points') < 1100))),
+            ('filter arithmetic', lambda queryset: list(queryset.filter(A('points') * 2 - A('id') > 5000))),
+            ('order_by(name, -points)[:10]', lambda queryset: list(queryset.order_by(A('name'), -A('points'))[:10])),
+            ('sum(points)', lambda queryset: queryset.aggregate(Sum('points'))),
+            ('mean(points) where name', lambda queryset: queryset.filter(A('name') == 'user7').aggregate(Mean('points'))),
+            ('median(points)', lambda queryset: queryset.aggregate(Median('points'))),
+        ):
+            old = measure(lambda: build(rows), repeat=3)
+            new = measure(lambda: build(columns), repeat=3)
+            results.append((size, label, '{:.2f}'.format(old * 1e3), '{:.2f}'.format(new * 1e3), '{:.1f}x'.format(old / new)))
+
+    print_table(
+        'Queries (ms): rows vs NumPy columns',
+        ('rows', 'query', 'rows', 'columns', 'speedup'),
+        results,
+    )
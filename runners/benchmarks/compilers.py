@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+from functools import reduce
+
+from shared.common_query import A, BinaryOperation, LazyObject, Lt, Neg, UnaryOperation
+from shared.common_query.aggregations import Has
+from shared.entities.users import Giftcard, User
+from shared.querysets.codegen import CodegenCompiler
+from shared.querysets.memory import LambdaCompiler, MemoryQuerySet
+
+from runners.benchmarks import measure, print_table
+
+
+@dataclass
+class Row:
+    points: int
+
+
+@dataclass(frozen=True)
+class RecompilingLambdaCompiler:
+    """
+    The previous compilation strategy, kept for comparison: every compiled
+    callable compiles its children again each time it is called.
+    """
+    get_value = getattr
+
+    def compile(self, node):
+        if isinstance(node, A):
+            return lambda item: self.get_value(item, self.compile(node.arguments)(item))
+        elif isinstance(node, BinaryOperation):
+            return lambda item: reduce(
+                node.reducer,
+                [self.compile(operand)(item) for operand in node.operands],
+            )
+        elif isinstance(node, UnaryOperation):
+            return lambda item: node.reducer(self.compile(node.operand)(item))
+        return lambda item: node if not isinstance(node, LazyObject) else self.compile(node)(item)
+
+
+def nested_query(depth):
+    expression = A('points')
+    for _ in range(depth - 1):
+        expression = Neg(Neg(expression))
+    return expression >= 500
+
+
+def bench_compile_once():
+    rows = [Row(points=points) for points in range(1000)]
+    results = []
+
+    for depth in (1, 2, 4, 8, 16):
+        query = nested_query(depth)
+        timings = []
+        for compiler in (RecompilingLambdaCompiler(), LambdaCompiler()):
+            queryset = MemoryQuerySet(get_objects=lambda: rows, compiler=compiler).filter(query)
+            timings.append(measure(lambda: list(queryset), number=20) / (20 * len(rows)) * 1e9)
+        results.append((depth, '{:.0f}'.format(timings[0]), '{:.0f}'.format(timings[1]), '{:.1f}x'.format(timings[0] / timings[1])))
+
+    print_table(
+        'Per-row filter cost (ns) by query depth, 1000 rows',
+        ('depth', 'recompiling', 'compiled once', 'speedup'),
+        results,
+    )
+
+
+def bench_codegen():
+    users = [
+        User(
+            id=idx,
+            name='User {}'.format(idx),
+            points=idx % 2000,
+            giftcards=[Giftcard(value=250, reason='welcome giftcard')] if idx % 3 == 0 else [],
+        )
+        for idx
+        in range(10000)
+    ]
+    queries = [
+        ('A(points) >= 1000', A('points') >= 1000),
+        ('(A(points) + 10) * 2 >= 1000', (A('points') + 10) * 2 >= 1000),
+        ('0 < A(points) < 1500 & A(name) != ""', Lt(0, A('points'), 1500) & (A('name') != '')),
+        ('A(points) >= 1000 & ~Has(giftcards)', (A('points') >= 1000) & ~Has('giftcards')),
+    ]
+    results = []
+
+    for label, query in queries:
+        timings = []
+        for compiler in (LambdaCompiler(), CodegenCompiler()):
+            queryset = MemoryQuerySet(get_objects=lambda: users, compiler=compiler).filter(query)
+            timings.append(measure(lambda: list(queryset), number=3) / (3 * len(users)) * 1e9)
+        results.append((label, '{:.0f}'.format(timings[0]), '{:.0f}'.format(timings[1]), '{:.1f}x'.format(timings[0] / timings[1])))
+
+    print_table(
+        'Per-row filter cost (ns) by compiler, 10000 users',
+        ('query', 'lambda', 'codegen', 'speedup'),
+        results,
+    )
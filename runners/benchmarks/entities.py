@@ -0,0 +1,55 @@
+import gc
+import tracemalloc
+
+from uuid import UUID
+
+from shared.entities.compact import CompactGiftcard, CompactUser
+from shared.entities.users import Giftcard, User
+
+from runners.benchmarks import print_table
+
+
+def make_users(user_class, giftcard_class, size):
+    # Reasons are built at runtime, like values read from a database, so
+    # that equal strings are separate objects unless interned.
+    return [
+        user_class(
+            id=UUID(int=idx),
+            name='user{}'.format(idx % 1000),
+            points=idx % 5000,
+            **({'giftcards': [giftcard_class(value=250, reason=' '.join(['welcome', 'giftcard']))]} if idx % 3 == 0 else {}),
+        )
+        for idx
+        in range(size)
+    ]
+
+
+def traced_size(build):
+    gc.collect()
+    tracemalloc.start()
+    objects = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def bench_entity_memory():
+    results = []
+    size = 200000
+    scale = 1000000 / size
+
+    baseline = None
+    for label, user_class, giftcard_class in (
+        ('dataclass', User, Giftcard),
+        ('compact', CompactUser, CompactGiftcard),
+    ):
+        traced = traced_size(lambda: make_users(user_class, giftcard_class, size)) * scale
+        baseline = baseline or traced
+        results.append((label, '{:.0f}'.format(traced / 2 ** 20), '{:.2f}x'.format(baseline / traced)))
+
+    print_table(
+        'Entity memory per million users (MB), a third with a giftcard',
+        ('entities', 'memory', 'smaller'),
+        results,
+    )
@@ -0,0 +1,63 @@
+import random
+
+from dataclasses import dataclass
+
+from shared.common_query import A
+from shared.querysets.memory import MemoryQuerySet, OrderByPipe, composite_key
+
+from runners.benchmarks import measure, print_table
+
+
+@dataclass
+class Row:
+    name: str
+    points: int
+    level: int
+
+
+@dataclass(frozen=True)
+class CompositeKeyOrderByPipe(OrderByPipe):
+    """
+    The alternative strategy: a single sort on one composite key, with
+    descending fields wrapped in `Descending` when directions are mixed.
+    """
+
+    def __call__(self, objects):
+        key, reverse = composite_key(self.keys)
+        return iter(sorted(objects, key=key, reverse=reverse))
+
+
+def bench_order_by():
+    random.seed(0)
+    orderings = [
+        ('-points', (-A('points'),)),
+        ('level, -points', (A('level'), -A('points'))),
+        ('level, name', (A('level'), A('name'))),
+        ('level, -name, points', (A('level'), -A('name'), A('points'))),
+        ('-level, -name, -points', (-A('level'), -A('name'), -A('points'))),
+    ]
+    results = []
+
+    for size in (1000, 10000, 100000):
+        rows = [
+            Row(name='user{}'.format(random.randrange(size)), points=random.randrange(5000), level=random.randrange(10))
+            for _
+            in range(size)
+        ]
+        queryset = MemoryQuerySet(get_objects=lambda: rows)
+        for label, fields in orderings:
+            multi_pass = queryset.order_by(*fields)
+            pipe = multi_pass.pipeline[-1]
+            composite = queryset.pipe(CompositeKeyOrderByPipe(fields=pipe.fields, keys=pipe.keys))
+            assert list(multi_pass) == list(composite)
+
+            repeat = 3 if size >= 100000 else 5
+            old = measure(lambda: list(composite), repeat=repeat)
+            new = measure(lambda: list(multi_pass), repeat=repeat)
+            results.append((size, len(fields), label, '{:.2f}'.format(old * 1e3), '{:.2f}'.format(new * 1e3), '{:.1f}x'.format(old / new)))
+
+    print_table(
+        'order_by (ms): single composite-key sort vs one stable sort per key',
+        ('rows', 'keys', 'ordering', 'composite', 'per key', 'speedup'),
+        results,
+    )
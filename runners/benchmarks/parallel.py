@@ -0,0 +1,42 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from shared.common_query import A
+from shared.common_query.aggregations import Mean, Variance
+from shared.querysets.memory import MemoryQuerySet
+
+from runners.benchmarks import measure, print_table
+from runners.benchmarks.stores import make_users
+
+
+def bench_parallel():
+    results = []
+    size = 200000
+    users = make_users(size)
+    queryset = MemoryQuerySet(get_objects=lambda: users).filter(
+        A('name').lower().startswith('user') & ((A('points') * 3 + 1) % 7 < 4),
+    )
+
+    def scan(queryset):
+        return queryset.count()
+
+    def aggregate(queryset):
+        return queryset.aggregate(mean=Mean('points', stable=True), variance=Variance('points'))
+
+    baselines = {label: measure(lambda: run(queryset), repeat=3) for label, run in (('filter', scan), ('aggregate', aggregate))}
+    for label, baseline in baselines.items():
+        results.append((label, 'serial', '{:.1f}'.format(baseline * 1e3), '1.0x'))
+
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parallel = queryset.parallel(executor, partition_size=size // (workers * 2))
+            for label, run in (('filter', scan), ('aggregate', aggregate)):
+                timing = measure(lambda: run(parallel), repeat=3)
+                results.append((label, workers, '{:.1f}'.format(timing * 1e3), '{:.1f}x'.format(baselines[label] / timing)))
+
+    print_table(
+        'Parallel scans over {} users (ms) by worker processes, on {} cores'.format(size, os.cpu_count()),
+        ('query', 'workers', 'time', 'speedup'),
+        results,
+    )
@@ -0,0 +1,62 @@
+import random
+
+from shared.common_query import A
+from shared.entities.users import User
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.stores import MemoryStore, SortedIndex
+
+from runners.benchmarks import measure, print_table
+
+
+def make_users(size):
+    random.seed(0)
+    return [
+        User(id=idx, name='user{}'.format(idx % 1000), points=random.randrange(5000))
+        for idx
+        in range(size)
+    ]
+
+
+def bench_equality_lookups():
+    results = []
+
+    for size in (1000, 10000, 100000):
+        users = make_users(size)
+        scan = MemoryQuerySet(get_objects=lambda: users)
+        indexed = MemoryQuerySet(get_objects=MemoryStore(users, indexes=['id', 'name']))
+        ids = [random.randrange(size) for _ in range(20)]
+
+        for label, query in (('id', lambda id: A('id') == id), ('name', lambda id: A('name') == 'user{}'.format(id % 1000))):
+            old = measure(lambda: [list(scan.filter(query(id))) for id in ids], repeat=3) / len(ids)
+            new = measure(lambda: [list(indexed.filter(query(id))) for id in ids], repeat=3) / len(ids)
+            results.append((size, label, '{:.1f}'.format(old * 1e6), '{:.1f}'.format(new * 1e6), '{:.0f}x'.format(old / new)))
+
+    print_table(
+        'Equality lookup (us per query): linear scan vs hash index',
+        ('rows', 'field', 'scan', 'index', 'speedup'),
+        results,
+    )
+
+
+def bench_range_lookups():
+    results = []
+
+    for size in (10000, 100000):
+        users = make_users(size)
+        scan = MemoryQuerySet(get_objects=lambda: users)
+        indexed = MemoryQuerySet(get_objects=MemoryStore(users, indexes=[SortedIndex('points')]))
+
+        for label, build in (
+            ('points >= 4950 (1%)', lambda queryset: queryset.filter(A('points') >= 4950)),
+            ('order_by(-points)[:50]', lambda queryset: queryset.order_by(-A('points'))[:50]),
+            ('order_by(points)', lambda queryset: queryset.order_by(A('points'))),
+        ):
+            old = measure(lambda: list(build(scan)), repeat=3)
+            new = measure(lambda: list(build(indexed)), repeat=3)
+            results.append((size, label, '{:.2f}'.format(old * 1e3), '{:.2f}'.format(new * 1e3), '{:.1f}x'.format(old / new)))
+
+    print_table(
+        'Range and ordering queries (ms): scan vs sorted index',
+        ('rows', 'query', 'scan', 'index', 'speedup'),
+        results,
+    )
@@ -0,0 +1,44 @@
+import random
+from dataclasses import replace
+
+from shared.common_query import A
+from shared.common_query.aggregations import Count, Sum
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.stores import MemoryStore
+from shared.querysets.views import MaterializedView
+
+from runners.benchmarks import measure, print_table
+from runners.benchmarks.stores import make_users
+
+
+def bench_materialized_view():
+    results = []
+
+    for size in (10000, 100000):
+        store = MemoryStore(make_users(size))
+        queryset = MemoryQuerySet(get_objects=store).filter(A('points') >= 4000)
+        view = MaterializedView(queryset, count=Count('id'), points=Sum('points'))
+
+        def change():
+            for _ in range(10):
+                user = store.get(random.randrange(size))
+                store.update(replace(user, points=random.randrange(5000)))
+
+        def recompute():
+            change()
+            return list(queryset), queryset.aggregate(count=Count('id'), points=Sum('points'))
+
+        def maintain():
+            change()
+            return list(view), view.aggregates
+
+        old = measure(recompute, repeat=3)
+        new = measure(maintain, repeat=3)
+        results.append((size, '{:.2f}'.format(old * 1e3), '{:.2f}'.format(new * 1e3), '{:.0f}x'.format(old / new)))
+        view.close()
+
+    print_table(
+        '10 updates, then read the 20% of users with >= 4000 points and their count and sum (ms)',
+        ('rows', 'recompute', 'view', 'speedup'),
+        results,
+    )
@@ -0,0 +1,157 @@
+import random
+import statistics
+import tracemalloc
+import unittest
+
+from dataclasses import dataclass
+from decimal import Decimal
+
+from shared.common_query import A
+from shared.common_query.aggregations import Count, Has, Mean, Median, Sum, Variance, select
+from shared.querysets.memory import MemoryQuerySet
+
+
+@dataclass
+class Reading:
+    value: float
+
+
+class AggregationsTestCase(unittest.TestCase):
+    def queryset(self, values):
+        pulled = self.pulled = []
+
+        def get_objects():
+            for value in values:
+                pulled.append(value)
+                yield Reading(value=value)
+        return MemoryQuerySet(get_objects=get_objects)
+
+    def test_count_and_has(self):
+        queryset = self.queryset(range(100))
+        self.assertEqual(queryset.aggregate(Count('value')), 100)
+        del self.pulled[:]
+        self.assertTrue(queryset.filter(A('value') >= 10).aggregate(Has('value')))
+        self.assertEqual(len(self.pulled), 11)
+        self.assertFalse(queryset.filter(A('value') > 100).aggregate(Has('value')))
+
+    def test_has_truthiness(self):
+        # Like `any`, Has tells whether any of the objects is truthy.
+        falsy = MemoryQuerySet(get_objects=lambda: [0, False, ''])
+        self.assertFalse(falsy.aggregate(Has(None)))
+        self.assertFalse(falsy.aggregate(has=Has(None))['has'])
+        self.assertTrue(MemoryQuerySet(get_objects=lambda: [0, 1]).aggregate(has=Has(None))['has'])
+        flags = self.queryset([[False, False], [False, True]])
+        self.assertEqual([reading.value for reading in flags.filter(Has('value'))], [[False, True]])
+
+    def test_mean(self):
+        queryset = self.queryset([1, 2, 3, 4])
+        self.assertEqual(queryset.aggregate(Mean('value')), 2.5)
+        self.assertEqual(len(self.pulled), 4)
+        self.assertEqual(queryset.aggregate(Mean('value', stable=True)), 2.5)
+        self.assertEqual(self.queryset([Decimal('0.1')] * 3).aggregate(Mean('value', stable=True)), Decimal('0.1'))
+        self.assertEqual(self.queryset([1e9 + 0.1] * 3).aggregate(Mean('value', stable=True)), 1e9 + 0.1)
+        self.assertTrue(Mean('value', stable=True).where(A('value') > 1).stable)
+        for stable in (False, True):
+            self.assertIsNone(self.queryset([]).aggregate(Mean('value', stable=stable)))
+            self.assertIsNone(self.queryset([]).aggregate(mean=Mean('value', stable=stable))['mean'])
+
+    def test_variance(self):
+        values = [1e9 + 4, 1e9 + 7, 1e9 + 13, 1e9 + 16]
+        self.assertAlmostEqual(self.queryset(values).aggregate(Variance('value')), statistics.pvariance(values))
+        self.assertAlmostEqual(self.queryset(values).aggregate(Variance('value', sample=True)), statistics.variance(values))
+        self.assertIsNone(self.queryset([1]).aggregate(Variance('value', sample=True)))
+        self.assertIsNone(self.queryset([]).aggregate(Variance('value')))
+
+    def test_median(self):
+        random.seed(0)
+        for values in ([], [3], [2, 1], [1, 1, 2, 2], [5, 1, 1, 1, 9, 9], [random.randrange(10) for _ in range(101)], list(range(50))):
+            with self.subTest(values=values):
+                self.assertEqual(self.queryset(values).aggregate(Median('value')), statistics.median(values) if values else None)
+        values = [random.random() for _ in range(100)]
+        self.assertEqual([select(values, k) for k in range(100)], sorted(values))
+
+    def test_aggregate_named(self):
+        queryset = self.queryset([4, 1, 3, 2])
+        results = queryset.aggregate(
+            count=Count('value'),
+            has=Has('value'),
+            sum=Sum('value'),
+            mean=Mean('value'),
+            stable_mean=Mean('value', stable=True),
+            median=Median('value'),
+            variance=Variance('value'),
+        )
+        self.assertEqual(len(self.pulled), 4)
+        self.assertEqual(results, {
+            'count': 4, 'has': True, 'sum': 10, 'mean': 2.5, 'stable_mean': 2.5, 'median': 2.5, 'variance': 1.25,
+        })
+        self.assertEqual(queryset.aggregate(Sum('value')), 10)
+        self.assertEqual(queryset.aggregate(Sum('value').where(A('value') > 2)), 7)
+        self.assertEqual(
+            queryset.aggregate(
+                count=Count('value').where(A('value') > 1),
+                has=Has('value').where(A('value') > 4),
+                sum=Sum('value').where(A('value') > 2),
+                stable_mean=Mean('value', stable=True).where(A('value') < 4),
+                median=Median('value').where(A('value') != 4),
+            ),
+            {'count': 3, 'has': False, 'sum': 7, 'stable_mean': 2, 'median': 2},
+        )
+        with self.assertRaises(TypeError):
+            queryset.aggregate(Count('value'), Sum('value'))
+        with self.assertRaises(TypeError):
+            queryset.aggregate()
+
+
+@dataclass
+class Giftcard:
+    value: int
+    reason: str
+
+
+class GroupByTestCase(unittest.TestCase):
+    def setUp(self):
+        self.giftcards = [
+            Giftcard(value=value, reason=reason)
+            for value, reason
+            in [(5, 'birthday'), (3, 'refund'), (2, 'birthday'), (7, 'promo'), (1, 'refund')]
+        ]
+        self.queryset = MemoryQuerySet(get_objects=lambda: self.giftcards)
+
+    def test_group_by(self):
+        self.assertEqual(list(self.queryset.group_by('reason', total=Sum('value'), median=Median('value'))), [
+            {'reason': 'birthday', 'total': 7, 'median': 3.5},
+            {'reason': 'refund', 'total': 4, 'median': 2.0},
+            {'reason': 'promo', 'total': 7, 'median': 7},
+        ])
+        self.assertEqual(
+            [group['reason'] for group in self.queryset.group_by('reason', total=Sum('value')).filter(A('total') > 4).order_by(-A('total'), A('reason'))],
+            ['birthday', 'promo'],
+        )
+        self.assertEqual(list(self.queryset.group_by('reason', large=Count('value').where(A('value') > 2))), [
+            {'reason': 'birthday', 'large': 1}, {'reason': 'refund', 'large': 1}, {'reason': 'promo', 'large': 1},
+        ])
+        self.assertEqual(list(self.queryset.filter(A('value') > 2).group_by('reason', 'value')), [
+            {'reason': 'birthday', 'value': 5}, {'reason': 'refund', 'value': 3}, {'reason': 'promo', 'value': 7},
+        ])
+
+    def test_values(self):
+        values = self.queryset.values('reason', 'value')
+        self.assertEqual(values.first(), {'reason': 'birthday', 'value': 5})
+        self.assertEqual(list(values.filter(A('value') > 4).values('reason')), [{'reason': 'birthday'}, {'reason': 'promo'}])
+        self.assertEqual(list(values.group_by('reason', count=Count('value')))[0], {'reason': 'birthday', 'count': 2})
+        self.assertEqual(values.aggregate(Sum('value')), 18)
+
+    def test_memory_scales_with_groups(self):
+        def get_objects(size):
+            return (Giftcard(value=index, reason=str(index % 3)) for index in range(size))
+
+        peaks = []
+        for size in (10000, 100000):
+            queryset = MemoryQuerySet(get_objects=lambda: get_objects(size))
+            tracemalloc.start()
+            groups = list(queryset.group_by('reason', total=Sum('value'), mean=Mean('value')))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            self.assertEqual(len(groups), 3)
+        self.assertLess(peaks[1], peaks[0] * 2)
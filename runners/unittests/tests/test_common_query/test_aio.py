@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+
+from dataclasses import dataclass
+
+from shared.common_query import A
+from shared.common_query.aggregations import Sum
+from shared.querysets.aio import AsyncQuerySet
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.stores import MemoryStore
+
+
+@dataclass
+class Reading:
+    id: int
+    value: int
+
+
+class AsyncQuerySetTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.readings = [Reading(id=index, value=index % 10) for index in range(2500)]
+        self.queryset = AsyncQuerySet(MemoryQuerySet(get_objects=MemoryStore(self.readings, indexes=['value'])))
+
+    async def test_evaluation(self):
+        large = self.queryset.filter(A('value') >= 5)
+        self.assertEqual([reading.id async for reading in large.order_by(-A('id'))[:3]], [2499, 2498, 2497])
+        self.assertEqual(len(await large.to_list()), 1250)
+        self.assertEqual(await large.count(), 1250)
+        self.assertEqual(await large.first(), self.readings[5])
+        self.assertEqual(await large.last(), self.readings[-1])
+        self.assertEqual(await large.get(A('id') == 7), self.readings[7])
+        self.assertEqual(await large[1], self.readings[6])
+        self.assertTrue(await large.exists())
+        self.assertEqual(await large.aggregate(total=Sum('value')), {'total': 8750})
+        self.assertEqual(
+            await asyncio.gather(large.count(), self.queryset.exclude(A('value') >= 5).count(), self.queryset.values('value').first()),
+            [1250, 1250, {'value': 0}],
+        )
+
+    async def test_cancellation(self):
+        pulled = []
+
+        def get_objects():
+            for index in range(10 ** 8):
+                pulled.append(index)
+                yield Reading(id=index, value=index)
+
+        ticks = 0
+        task = asyncio.ensure_future(AsyncQuerySet(MemoryQuerySet(get_objects=get_objects)).filter(A('value') < 0).count())
+        while len(pulled) < 10000:
+            ticks += 1
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        stopped = len(pulled)
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(pulled), stopped)
+        self.assertLess(stopped, 10 ** 8)
+        self.assertGreater(ticks, 0)
@@ -0,0 +1,94 @@
+import unittest
+
+from dataclasses import replace
+from operator import getitem
+
+from shared.common_query import A, fingerprint
+from shared.common_query.aggregations import Has
+from shared.entities.users import User
+from shared.querysets.cache import LRUCache, ResultCache
+from shared.querysets.codegen import CodegenCompiler
+from shared.querysets.memory import LambdaCompiler, MemoryQuerySet
+from shared.querysets.stores import MemoryStore
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_structural_equality(self):
+        self.assertEqual(
+            fingerprint((A('points') >= 1000) & ~Has('giftcards').where(A('reason') == 'welcome')),
+            fingerprint((A('points') >= 1000) & ~Has('giftcards').where(A('reason') == 'welcome')),
+        )
+        self.assertEqual(fingerprint(A('user').name), fingerprint(A('user').name))
+
+    def test_structural_inequality(self):
+        self.assertNotEqual(fingerprint(A('points') >= 1000), fingerprint(A('points') > 1000))
+        self.assertNotEqual(fingerprint(A('points') >= 1000), fingerprint(A('points') >= 999))
+        self.assertNotEqual(fingerprint(A('points') == 1), fingerprint(A('points') == True))  # noqa: E712
+        self.assertNotEqual(fingerprint(A('user').name), fingerprint(A('user')['name']))
+        self.assertNotEqual(
+            fingerprint(Has('giftcards').where(A('reason') == 'a')),
+            fingerprint(Has('giftcards').where(A('reason') == 'b')),
+        )
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertEqual(cache.info(), (1, 0, 1, 2, 2))
+
+    def test_compiler_cache(self):
+        compiler = LambdaCompiler()
+        for points in (1000, 1000, 1000, 2000):
+            compiler.compile((A('points') >= points) & ~Has('giftcards'))
+        self.assertEqual(compiler.cache.info().misses, 2)
+        self.assertEqual(compiler.cache.info().hits, 2)
+
+    def test_shared_cache(self):
+        compiler = LambdaCompiler()
+        rows = replace(compiler, get_value=getitem)
+        generated = CodegenCompiler(cache=compiler.cache)
+        query = A('points') >= 1000
+        self.assertTrue(compiler.compile(query)(User(id=1, name='a', points=1200)))
+        self.assertTrue(rows.compile(query)({'points': 1200}))
+        self.assertIsNot(generated.compile(query), compiler.compile(query))
+        self.assertEqual(compiler.cache.info().misses, 3)
+
+    def test_unhashable_constants(self):
+        compiler = LambdaCompiler()
+        self.assertTrue(compiler.compile(A('data') == bytearray(b'x'))(type('Row', (), {'data': bytearray(b'x')})))
+        self.assertEqual(len(compiler.cache), 0)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore([User(id=id, name='user{}'.format(id), points=id * 10) for id in range(10)])
+
+    def test_cached_results(self):
+        queryset = MemoryQuerySet(get_objects=self.store).cache(ResultCache(maxsize=2))
+        rich = queryset.filter(A('points') >= 50)
+        self.assertEqual(len(list(rich)), 5)
+        self.assertEqual(len(list(queryset.filter(A('points') >= 50))), 5)
+        self.assertEqual([user.id for user in rich.order_by(-A('points'))[:2]], [9, 8])
+        self.assertEqual(queryset.result_cache.info(), (1, 2, 0, 2, 2, 0))
+
+        self.store.insert(User(id=10, name='user10', points=100))
+        self.assertEqual(len(list(rich)), 6)
+        self.assertEqual(queryset.result_cache.info().invalidations, 1)
+
+        list(queryset.filter(A('points') < 10))
+        self.assertEqual(queryset.result_cache.info().evictions, 1)
+
+    def test_uncacheable(self):
+        cached = MemoryQuerySet(get_objects=lambda: list(self.store)).cache()
+        list(cached)
+        list(cached)
+        self.assertEqual(len(cached.result_cache), 0)
+        cached = MemoryQuerySet(get_objects=self.store).cache().filter(A('name') == bytearray(b'x'))
+        self.assertEqual(list(cached), [])
+        self.assertEqual(len(cached.result_cache), 0)
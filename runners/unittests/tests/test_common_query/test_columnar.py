@@ -0,0 +1,103 @@
+import unittest
+
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import List
+
+from shared.common_query import A
+from shared.common_query.aggregations import Count, Has, Mean, Median, Sum
+from shared.querysets.columnar import ColumnarQuerySet
+from shared.querysets.memory import MemoryQuerySet
+
+
+@dataclass
+class Product:
+    id: int
+    sku: str
+    price: float
+    stock: int
+    discount: Decimal = Decimal('0')
+    tags: List[str] = field(default_factory=list)
+
+
+class ColumnarQuerySetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.products = [
+            Product(id=id, sku=sku, price=price, stock=stock, discount=Decimal(id) / 10, tags=['sale'] if id % 3 == 0 else [])
+            for id, (sku, price, stock)
+            in enumerate([
+                ('b', 0.1, 2), ('a', 0.2, 0), ('c', 0.3, 5), ('a', 1e16, 3),
+                ('b', 1.0, 0), ('a', 0.7, 2), ('d', 2.5, 1),
+            ])
+        ]
+        self.memory = MemoryQuerySet(get_objects=lambda: self.products)
+        self.columnar = ColumnarQuerySet.from_objects(self.products, fields=['id', 'sku', 'price', 'stock', 'discount'])
+
+    def assertSameResults(self, build):
+        self.assertEqual(list(build(self.columnar)), list(build(self.memory)))
+
+    def test_filter(self):
+        self.assertSameResults(lambda queryset: queryset.filter(A('stock') > 0))
+        self.assertSameResults(lambda queryset: queryset.filter((A('sku') == 'a') | (A('price') - A('stock') >= 0)))
+        self.assertSameResults(lambda queryset: queryset.filter(~(A('sku') == 'a'), A('discount') > Decimal('0.2')))
+        self.assertSameResults(lambda queryset: queryset.exclude(A('stock') == 0, A('sku') == 'b'))
+        self.assertSameResults(lambda queryset: queryset.filter(A('stock') > 0, A('stock') // A('stock') == 1))
+        with self.assertRaises(ZeroDivisionError):
+            list(self.columnar.filter(A('stock') // A('stock') == 1))
+        self.assertSameResults(lambda queryset: queryset.filter(Has('tags')).exclude(A('sku') == 'a'))
+
+    def test_short_circuit(self):
+        self.assertSameResults(lambda queryset: queryset.filter((A('stock') > 0) & (A('id') // A('stock') >= 1)))
+        self.assertSameResults(lambda queryset: queryset.filter((A('stock') == 0) | (A('id') // A('stock') >= 1)))
+        self.assertSameResults(lambda queryset: queryset.exclude(A('stock') > 0, A('id') // A('stock') >= 1))
+
+    def test_truthiness(self):
+        self.products[2].sku = ''
+        self.products[4].discount = Decimal('0')
+        columnar = ColumnarQuerySet.from_objects(self.products, fields=['id', 'sku', 'discount'])
+        for query in (A('sku'), A('discount'), ~A('sku'), A('sku') & A('id')):
+            with self.subTest(query=query):
+                self.assertEqual(list(columnar.filter(query)), list(self.memory.filter(query)))
+
+    def test_integer_overflow(self):
+        products = [Product(id=id, sku='a', price=0.0, stock=2 ** 62 + id) for id in range(3)]
+        memory = MemoryQuerySet(get_objects=lambda: products)
+        columnar = ColumnarQuerySet.from_objects(products, fields=['id', 'stock'])
+        for query in (A('stock') * 4 > 0, A('stock') - -A('stock') > 0, -(A('stock') * -2) > 0):
+            with self.subTest(query=query):
+                self.assertEqual(list(columnar.filter(query)), list(memory.filter(query)))
+        for aggregation in (Sum('stock'), Mean('stock')):
+            with self.subTest(aggregation=aggregation):
+                self.assertEqual(columnar.aggregate(aggregation), memory.aggregate(aggregation))
+        self.assertEqual(list(columnar.order_by(-A('stock'))), list(memory.order_by(-A('stock'))))
+
+    def test_order_by_and_slicing(self):
+        self.assertSameResults(lambda queryset: queryset.order_by(A('sku'), -A('stock')))
+        self.assertSameResults(lambda queryset: queryset.order_by(-A('sku'), A('price'))[1:4])
+        self.assertSameResults(lambda queryset: queryset.filter(A('stock') > 0).order_by(-A('price')).offset(1).limit(2))
+        self.assertEqual(self.columnar.order_by(A('price'))[2], self.memory.order_by(A('price'))[2])
+        self.assertEqual(self.columnar.first(), self.memory.first())
+        self.assertEqual(self.columnar.last(), self.memory.last())
+        self.assertEqual(self.columnar.get(A('id') == 3), self.products[3])
+        with self.assertRaises(ColumnarQuerySet.MultipleObjectsReturned):
+            self.columnar.get(A('sku') == 'a')
+        with self.assertRaises(ColumnarQuerySet.ObjectDoesNotExist):
+            self.columnar.get(A('sku') == 'z')
+        self.assertFalse(self.columnar.filter(A('stock') > 5).exists())
+        with self.assertRaises(IndexError):
+            self.columnar[10]
+
+    def test_aggregate(self):
+        for aggregation in (
+            Count('id'), Has('id'), Sum('price'), Sum('stock'), Sum('discount'),
+            Mean('price'), Mean('stock'), Median('price'), Median('stock'), Median('sku'),
+            Count('id').where(A('price') > 2), Sum('stock').where(A('discount') > 0), Mean('price', stable=True).where(A('stock') > 1),
+        ):
+            for build in (lambda queryset: queryset, lambda queryset: queryset.filter(A('stock') > 0)):
+                with self.subTest(aggregation=aggregation):
+                    expected = build(self.memory).aggregate(aggregation)
+                    result = build(self.columnar).aggregate(aggregation)
+                    self.assertEqual(result, expected)
+                    self.assertIs(type(result), type(expected))
+        self.assertIsNone(self.columnar.filter(A('stock') > 5).aggregate(Median('price')))
+        self.assertIsNone(self.columnar.filter(A('stock') > 5).aggregate(Mean('price')))
@@ -0,0 +1,91 @@
+import unittest
+
+from dataclasses import dataclass, field
+
+from shared.common_query import A, And, L, Lt, Not, Or, fingerprint
+from shared.common_query.aggregations import Has
+from shared.common_query.optimizer import optimize
+from shared.querysets.codegen import CodegenCompiler
+from shared.querysets.memory import MemoryQuerySet
+
+
+@dataclass
+class Row:
+    a: bool
+    b: bool
+    c: bool
+    calls: list = field(default_factory=list)
+
+    def expensive(self):
+        self.calls.append(None)
+        return True
+
+
+class OptimizerTestCase(unittest.TestCase):
+    def assertOptimizesTo(self, query, expected):
+        self.assertEqual(fingerprint(optimize(query)), fingerprint(expected))
+
+    def test_constant_folding(self):
+        self.assertIs(optimize(L(2) + 3 > 4), True)
+        self.assertIs(optimize(Lt(1, L(3), 2)), False)
+        self.assertOptimizesTo((A('x') > 1) & (L(1) == 1), A('x') > 1)
+        self.assertIs(optimize((A('x') > 1) & (L(1) == 2)), False)
+        self.assertIs(optimize((A('x') > 1) | (L(1) == 1)), True)
+
+    def test_negation(self):
+        self.assertOptimizesTo(Not(Not(A('x') > 1)), A('x') > 1)
+        self.assertOptimizesTo(Not(A('x') > 1), A('x') <= 1)
+        self.assertOptimizesTo(~((A('x') > 1) | Has('y')), And(A('x') <= 1, Not(Has('y'))))
+        self.assertOptimizesTo(~((A('x') == 1) & (A('y') != 2)), Or(A('x') != 1, A('y') == 2))
+        self.assertOptimizesTo(Not(Lt(0, A('x'), 10)), Not(Lt(0, A('x'), 10)))
+
+    def test_reordering(self):
+        self.assertOptimizesTo(
+            Has('giftcards').where(Not(Not(A('reason') == 'welcome'))) & (A('points') >= 1000),
+            And(A('points') >= 1000, Has('giftcards').where(A('reason') == 'welcome')),
+        )
+        self.assertOptimizesTo(
+            A('expensive')() | A('user').account.name | A('flag'),
+            Or(A('flag'), A('user').account.name, A('expensive')()),
+        )
+
+    def test_guards(self):
+        self.assertOptimizesTo(
+            Has('giftcards') & (A('giftcards')[0].value > 1),
+            And(Has('giftcards'), A('giftcards')[0].value > 1),
+        )
+        self.assertOptimizesTo(
+            (A('expensive')() == 1) & (A('items')[0] == 1) & A('flag'),
+            And(A('flag'), A('expensive')() == 1, A('items')[0] == 1),
+        )
+        self.assertOptimizesTo(
+            (A('count') == 0) | (A('total') / A('count') > 1),
+            Or(A('count') == 0, A('total') / A('count') > 1),
+        )
+
+
+class ShortCircuitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            Row(a=True, b=False, c=False),
+            Row(a=False, b=False, c=True),
+            Row(a=False, b=False, c=False),
+        ]
+
+    def test_or(self):
+        queryset = MemoryQuerySet(get_objects=lambda: self.rows)
+        self.assertEqual(len(list(queryset.filter(Or(A('a'), A('b'), A('c'))))), 2)
+        self.assertEqual(len(list(queryset.exclude(A('a'), A('b')))), 3)
+        self.assertEqual(len(list(queryset.exclude(A('a') | A('c')))), 1)
+
+    def test_short_circuit(self):
+        for queryset in (
+            MemoryQuerySet(get_objects=lambda: self.rows),
+            MemoryQuerySet(get_objects=lambda: self.rows, compiler=CodegenCompiler()),
+        ):
+            list(queryset.filter(A('expensive')() & A('a')))
+            list(queryset.exclude(A('expensive')(), A('c')))
+            self.assertEqual([len(row.calls) for row in self.rows], [1, 1, 0])
+            for row in self.rows:
+                del row.calls[:]
+            self.assertEqual(list(queryset.filter(Has('calls') & (A('calls')[0] == 1))), [])
@@ -0,0 +1,108 @@
+import pickle
+import unittest
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from uuid import uuid4
+
+from shared.common_query import A, fingerprint
+from shared.common_query.aggregations import Collect, Count, Has, Mean, Median, Sum, Variance
+from shared.entities.users import Giftcard, User
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.parallel import WINDOW
+from shared.querysets.stores import MemoryStore
+
+
+class InlineExecutor(Executor):
+    def __init__(self):
+        self.tasks = 0
+
+    def submit(self, function, *args, **kwargs):
+        self.tasks += 1
+        future = Future()
+        future.set_result(function(*args, **kwargs))
+        return future
+
+
+class ParallelQuerySetTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ProcessPoolExecutor(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def setUp(self):
+        self.users = [
+            User(
+                id=uuid4(),
+                name='user {}'.format(index % 7),
+                points=(index * 37) % 1000 + 0.5,
+                giftcards=[Giftcard(value=index % 5, reason='refund' if index % 3 else 'promo')],
+            )
+            for index
+            in range(1000)
+        ]
+        self.serial = MemoryQuerySet(get_objects=MemoryStore(self.users, indexes=['name']))
+        self.parallel = self.serial.parallel(self.executor, partition_size=150)
+
+    def test_queries_pickle(self):
+        query = (A('points') > 5) & ~Has('giftcards').where(A('reason').lower() == 'promo') | (A('name')[0] == 'u')
+        self.assertEqual(fingerprint(pickle.loads(pickle.dumps(query))), fingerprint(query))
+
+    def test_filter(self):
+        for build in (
+            lambda queryset: queryset.filter(A('points') > 500),
+            lambda queryset: queryset.filter(A('name') == 'user 3').exclude(A('points') < 200),
+            lambda queryset: queryset.exclude(Has('giftcards').where(A('reason') == 'promo')).order_by(-A('points'))[5:50],
+            lambda queryset: queryset.filter(),
+            lambda queryset: queryset.exclude(),
+        ):
+            expected = list(build(self.serial))
+            results = list(build(self.parallel))
+            self.assertEqual(len(results), len(expected))
+            self.assertTrue(all(result is object for result, object in zip(results, expected)))
+        self.assertEqual(self.parallel.filter(A('points') > 500).count(), self.serial.filter(A('points') > 500).count())
+
+    def test_rows(self):
+        for build in (
+            lambda queryset: queryset.filter(A('points') > 500).values('name', 'points'),
+            lambda queryset: queryset.exclude(A('points') < 200).group_by('name', total=Sum('points')),
+            lambda queryset: queryset.values('name', 'points').filter(A('points') > 500),
+        ):
+            self.assertEqual(list(build(self.parallel)), list(build(self.serial)))
+
+    def test_aggregate(self):
+        aggregations = {
+            'count': Count('points'),
+            'has': Has('points'),
+            'sum': Sum('points'),
+            'mean': Mean('points'),
+            'stable_mean': Mean('points', stable=True),
+            'variance': Variance('points', sample=True),
+            'median': Median('points'),
+            'collected': Collect('points'),
+            'promo': Sum('points').where(Has('giftcards').where(A('reason') == 'promo')),
+        }
+        for build in (lambda queryset: queryset, lambda queryset: queryset.filter(A('points') > 500).exclude(A('name') == 'user 1')):
+            expected = build(self.serial).aggregate(**aggregations)
+            results = build(self.parallel).aggregate(**aggregations)
+            for name in ('count', 'has', 'median', 'collected', 'sum', 'promo'):
+                self.assertEqual(results[name], expected[name])
+            for name in ('mean', 'stable_mean', 'variance'):
+                self.assertAlmostEqual(results[name], expected[name])
+        self.assertEqual(self.parallel.filter(A('points') > 2000).aggregate(Count('points')), 0)
+        self.assertIsNone(self.parallel.filter(A('points') > 2000).aggregate(Mean('points')))
+
+    def test_stops_early(self):
+        executor = InlineExecutor()
+        size = max(1, len(self.users) // (WINDOW * 4))
+        parallel = self.serial.parallel(executor, partition_size=size)
+        self.assertEqual(parallel.filter(A('points') > 100).first(), self.serial.filter(A('points') > 100).first())
+        self.assertTrue(parallel.filter(A('name') != 'user 0').exists())
+        self.assertEqual(list(parallel.exclude(A('points') > 100)[:3]), list(self.serial.exclude(A('points') > 100)[:3]))
+        self.assertLessEqual(executor.tasks, 3 * (WINDOW + 1))
+
+        executor.tasks = 0
+        self.assertEqual(list(parallel.filter(A('points') > 100)), list(self.serial.filter(A('points') > 100)))
+        self.assertEqual(executor.tasks, -(-len(self.users) // size))
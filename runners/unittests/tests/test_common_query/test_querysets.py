@@ -1,11 +1,15 @@
+import linecache
 import unittest
 
 from dataclasses import dataclass
 from typing import List
 
-from shared.common_query import A
-from shared.common_query.aggregations import Count
-from shared.querysets.memory import MemoryQuerySet
+from shared.common_query import A, L, Lt
+from shared.common_query.aggregations import Count, Has, Sum
+from shared.querysets.base import Annotated
+from shared.querysets.cache import LRUCache
+from shared.querysets.codegen import CodegenCompiler
+from shared.querysets.memory import LambdaCompiler, MemoryQuerySet
 
 
 @dataclass
@@ -40,3 +44,120 @@ class MemoryQuerySetTestCase(unittest.TestCase):
         )
         self.assertEqual(len(list(queryset.filter(Count('items') == 0))), 1)
         self.assertEqual(len(list(queryset.filter(Count('items').where(A('quantity') > 0)))), 2)
+
+    def test_early_termination(self):
+        pulled = []
+
+        def get_objects():
+            for id in range(1000):
+                pulled.append(id)
+                yield Cart(id=id, items=[])
+
+        queryset = MemoryQuerySet(get_objects=get_objects).filter(A('id') >= 10)
+        self.assertEqual(queryset.first().id, 10)
+        self.assertEqual(len(pulled), 11)
+
+        del pulled[:]
+        self.assertTrue(queryset.exists())
+        self.assertEqual(len(pulled), 11)
+
+        del pulled[:]
+        with self.assertRaises(MemoryQuerySet.MultipleObjectsReturned):
+            queryset.get(A('id') < 20)
+        self.assertEqual(len(pulled), 12)
+
+        del pulled[:]
+        self.assertEqual(queryset.get(A('id') == 999).id, 999)
+        self.assertEqual(len(pulled), 1000)
+
+        del pulled[:]
+        self.assertTrue(repr(queryset).endswith(', ...]>'))
+        self.assertEqual(len(pulled), 14)
+
+        self.assertEqual(queryset.last().id, 999)
+        self.assertEqual(queryset.order_by(-A('id')).first().id, 999)
+        self.assertFalse(queryset.filter(A('id') > 1000).exists())
+        self.assertEqual(queryset.count(), 990)
+
+    def test_slicing(self):
+        carts = [
+            Cart(id=id, items=[Item(sku=sku, quantity=quantity)])
+            for id, (sku, quantity)
+            in enumerate([('b', 2), ('a', 1), ('c', 2), ('a', 3), ('b', 1), ('a', 2)])
+        ]
+        queryset = MemoryQuerySet(get_objects=lambda: carts)
+        ordering = (-A('items')[0].quantity, A('items')[0].sku)
+        expected = [cart.id for cart in queryset.order_by(*ordering)]
+        self.assertEqual(expected, [3, 5, 0, 2, 1, 4])
+
+        self.assertEqual([cart.id for cart in queryset.order_by(*ordering)[:3]], expected[:3])
+        self.assertEqual([cart.id for cart in queryset.order_by(*ordering)[2:4]], expected[2:4])
+        self.assertEqual([cart.id for cart in queryset.order_by(*ordering).offset(1).limit(3)], expected[1:4])
+        self.assertEqual([cart.id for cart in queryset.order_by(*ordering)[:4][3:10]], expected[3:4])
+        self.assertEqual([cart.id for cart in queryset.order_by(-A('id'))[:2]], [5, 4])
+        self.assertEqual(queryset.order_by(*ordering)[1].id, expected[1])
+        self.assertEqual(list(queryset[10:]), [])
+        with self.assertRaises(IndexError):
+            queryset[10]
+        with self.assertRaises(ValueError):
+            queryset[-1]
+
+    def test_annotate(self):
+        carts = [
+            Cart(id=1, items=[Item(sku='a', quantity=2), Item(sku='b', quantity=0)]),
+            Cart(id=2, items=[]),
+            Cart(id=3, items=[Item(sku='c', quantity=1)]),
+        ]
+        queryset = MemoryQuerySet(get_objects=lambda: carts).annotate(
+            lines=Count('items'),
+            filled=Count('items').where(A('quantity') > 0),
+        )
+        annotated = list(queryset.filter(A('filled') > 0).order_by(-A('lines')))
+        self.assertEqual([(cart.id, cart.lines, cart.filled) for cart in annotated], [(1, 2, 1), (3, 1, 1)])
+        self.assertEqual(annotated[0]['lines'], 2)
+        self.assertIsInstance(annotated[0], Cart)
+        annotated[0].id = 4
+        annotated[0].lines = 5
+        self.assertEqual((carts[0].id, annotated[0].id, annotated[0].lines), (4, 4, 5))
+        self.assertEqual(hash(Annotated('a', {'lines': 1})), hash('a'))
+        self.assertEqual(queryset.aggregate(lines=Sum('lines'), filled=Sum('filled')), {'lines': 3, 'filled': 2})
+
+
+class LambdaCompilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.compiler = LambdaCompiler()
+        self.cart = Cart(id=1, items=[Item(sku='DX7814-220', quantity=2)])
+
+    def test_accessors(self):
+        self.assertEqual(self.compiler.compile(A('id'))(self.cart), 1)
+        self.assertEqual(self.compiler.compile(A('items')[0].sku)(self.cart), 'DX7814-220')
+        self.assertEqual(self.compiler.compile(A('items')[0].sku.lower())(self.cart), 'dx7814-220')
+        self.assertEqual(self.compiler.compile(L(5))(self.cart), 5)
+
+    def test_operations(self):
+        self.assertTrue(self.compiler.compile(A('id') + 1 == 2)(self.cart))
+        self.assertTrue(self.compiler.compile(Lt(0, A('id'), 2))(self.cart))
+        self.assertFalse(self.compiler.compile(Lt(0, A('id'), 1))(self.cart))
+        self.assertEqual(self.compiler.compile(-A('id'))(self.cart), -1)
+
+    def test_aggregations(self):
+        self.assertFalse(self.compiler.compile(~Has('items'))(self.cart))
+        self.assertTrue(self.compiler.compile((A('id') == 1) & Has('items').where(A('quantity') == 2))(self.cart))
+
+
+class CodegenCompilerTestCase(LambdaCompilerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.compiler = CodegenCompiler()
+
+    def test_source(self):
+        compiled = self.compiler.compile((A('id') >= 1) & ~Has('items'))
+        self.assertIn('(o.id >= 1) and (not _f', compiled.source)
+        self.assertEqual(len(list(MemoryQuerySet(get_objects=lambda: [self.cart], compiler=self.compiler).filter(A('items')[0].quantity > 1))), 1)
+
+    def test_linecache(self):
+        compiler = CodegenCompiler(cache=LRUCache(maxsize=1))
+        filename = compiler.compile(A('id') >= 1).__code__.co_filename
+        self.assertIn(filename, linecache.cache)
+        compiler.compile(A('id') >= 2)
+        self.assertNotIn(filename, linecache.cache)
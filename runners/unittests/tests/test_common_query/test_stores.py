@@ -0,0 +1,193 @@
+import unittest
+
+from uuid import uuid4
+
+from shared.common_query import A, Le, Lt
+from shared.entities.users import Giftcard, User
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.stores import HashIndex, MemoryStore, SortedIndex
+
+
+class CountingHashIndex(HashIndex):
+    def __init__(self, field):
+        super().__init__(field)
+        self.lookups = 0
+
+    def lookup(self, lower, upper):
+        self.lookups += 1
+        return super().lookup(lower, upper)
+
+
+class MemoryStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.users = [
+            User(id=uuid4(), name='Jane Doe', points=1200, giftcards=[Giftcard(value=250, reason='welcome giftcard')]),
+            User(id=uuid4(), name='John Doe', points=600),
+            User(id=uuid4(), name='Jane Doe', points=1000),
+        ]
+        self.name_index = CountingHashIndex('name')
+        self.store = MemoryStore(self.users, indexes=['id', self.name_index])
+        self.queryset = MemoryQuerySet(get_objects=self.store)
+
+    def test_index_lookup(self):
+        self.assertEqual(self.queryset.get(A('id') == self.users[1].id), self.users[1])
+        self.assertEqual(list(self.queryset.filter(A('name') == 'Jane Doe')), [self.users[0], self.users[2]])
+        self.assertEqual(list(self.queryset.filter('Jane Doe' == A('name'), A('points') < 1100)), [self.users[2]])
+        self.assertEqual(list(self.queryset.filter((A('points') < 1100) & (A('name') == 'Jane Doe'))), [self.users[2]])
+        self.assertEqual(list(self.queryset.filter(A('name') == 'Nobody')), [])
+        self.assertEqual(self.name_index.lookups, 4)
+
+    def test_unindexed_scan(self):
+        self.assertEqual(list(self.queryset.filter(A('points') == 600)), [self.users[1]])
+        self.assertEqual(list(self.queryset.exclude(A('name') == 'Jane Doe')), [self.users[1]])
+        self.assertEqual(self.name_index.lookups, 0)
+
+    def test_sync(self):
+        self.users[1].name = 'Jane Doe'
+        self.store.update(self.users[1])
+        self.assertEqual(list(self.queryset.filter(A('name') == 'Jane Doe')), self.users)
+        self.assertEqual(list(self.queryset.filter(A('name') == 'John Doe')), [])
+
+        self.store.delete(self.users[0])
+        self.assertEqual(list(self.queryset.filter(A('name') == 'Jane Doe')), self.users[1:])
+
+        user = User(id=uuid4(), name='John Doe')
+        self.store.insert(user)
+        self.assertEqual(self.queryset.get(A('name') == 'John Doe'), user)
+        self.assertEqual(self.queryset.get(A('id') == user.id), user)
+        with self.assertRaises(ValueError):
+            self.store.insert(user)
+
+
+class SortedIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.users = [
+            User(id=id, name=name, points=points)
+            for id, (name, points)
+            in enumerate([('a', 500), ('b', 1500), ('c', 1000), ('d', 1500), ('e', 200), ('f', 1000)])
+        ]
+        self.store = MemoryStore(self.users, indexes=[SortedIndex('points'), SortedIndex('name')])
+        self.indexed = MemoryQuerySet(get_objects=self.store)
+        self.scan = MemoryQuerySet(get_objects=lambda: self.users)
+
+    def assertSameResults(self, build):
+        self.assertEqual(
+            [user.id for user in build(self.indexed)],
+            [user.id for user in build(self.scan)],
+        )
+
+    def test_ranges(self):
+        self.assertEqual(len(self.store.lookup([A('points') >= 1000])), 4)
+        self.assertEqual(len(self.store.lookup([Lt(500, A('points'), 1500)])), 2)
+        self.assertEqual(len(self.store.lookup([A('points') > 1000, A('points') <= 1500])), 2)
+        self.assertEqual(len(self.store.lookup([Le(1000, A('points'), 1000)])), 2)
+        self.assertEqual(len(self.store.lookup([A('points') < 0])), 0)
+        self.assertIsNone(self.store.lookup([A('id') < 3]))
+
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') >= 1000))
+        self.assertSameResults(lambda queryset: queryset.filter(1000 <= A('points')))
+        self.assertSameResults(lambda queryset: queryset.filter(Lt(200, A('points'), 1500), A('name') != 'c'))
+        self.assertSameResults(lambda queryset: queryset.filter((A('points') < 1500) & (A('name') > 'a')))
+
+    def test_ordering(self):
+        self.assertSameResults(lambda queryset: queryset.order_by(A('points')))
+        self.assertSameResults(lambda queryset: queryset.order_by(-A('points')))
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') >= 1000).order_by(-A('points')))
+        self.assertSameResults(lambda queryset: queryset.exclude(A('name') == 'b').order_by(-A('points'))[:3])
+        self.assertSameResults(lambda queryset: queryset.filter(A('name') > 'b').order_by(A('points')))
+
+        objects, pipeline = self.indexed.filter(A('points') >= 1000).order_by(-A('points'))[:2].plan()
+        self.assertEqual(len(pipeline), 2)
+
+    def test_sync(self):
+        self.users[0].points = 2000
+        self.store.update(self.users[0])
+        self.store.delete(self.users[1])
+        self.users.remove(self.users[1])
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') > 1000))
+        self.assertSameResults(lambda queryset: queryset.order_by(-A('points')))
+
+    def assertUnchanged(self):
+        self.assertEqual(list(self.store), self.users)
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') >= 1000).order_by(-A('points')))
+        self.assertSameResults(lambda queryset: queryset.filter(A('name') > 'b').order_by(A('name')))
+
+    def test_rejected_writes(self):
+        # A value the points index cannot order leaves the store untouched.
+        version = self.store.version
+        with self.assertRaises(TypeError):
+            self.store.insert(User(id=6, name='g', points='many'))
+        with self.assertRaises(TypeError):
+            self.store.insert_many([User(id=6, name='g', points=1), User(id=7, name='h', points='many')])
+        self.assertUnchanged()
+
+        self.users[0].name, self.users[0].points = 'z', 'many'
+        with self.assertRaises(TypeError):
+            self.store.update(self.users[0])
+        with self.assertRaises(TypeError):
+            self.store.update_many([self.users[1], self.users[0]])
+        self.users[0].name, self.users[0].points = 'a', 500
+        self.assertUnchanged()
+        self.assertEqual(self.store.version, version)
+
+        self.store.insert(User(id=6, name='g', points=1))
+        self.store.delete(self.users[0])
+        hashed = MemoryStore(self.users, indexes=['name'])
+        with self.assertRaises(TypeError):
+            hashed.insert(User(id=7, name=['g'], points=1))
+        self.assertNotIn(User(id=7, name='g'), hashed)
+        self.assertEqual(len(hashed.indexes['name'].lookup(('a', True), ('a', True))), 1)
+
+    def test_none(self):
+        self.users[1].points = None
+        self.store.update(self.users[1])
+        self.store.insert_many([User(id=6, name='g', points=None), User(id=7, name='h', points=1200)])
+        self.users.extend(self.store.get(key) for key in (6, 7))
+
+        self.assertEqual(len(self.store.lookup([A('points') >= 1000])), 4)
+        self.assertEqual(len(self.store.lookup([A('points') < 1000])), 2)
+        self.assertEqual({user.id for user in self.indexed.filter(A('points') == None)}, {1, 6})  # noqa: E711
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') != None, A('points') > 500))  # noqa: E711
+        self.assertEqual([user.id for user in self.indexed.order_by(A('points'))], [4, 0, 2, 5, 7, 3, 1, 6])
+        self.assertEqual([user.id for user in self.indexed.order_by(-A('points'))], [1, 6, 3, 7, 2, 5, 0, 4])
+
+        self.store.delete(self.users[1])
+        self.assertEqual([user.id for user in self.indexed.filter(A('points') == None)], [6])  # noqa: E711
+
+    def test_bulk(self):
+        users = [User(id=id, name=name, points=points) for id, name, points in [(6, 'g', 700), (7, 'h', 1500), (8, 'i', 100)]]
+        self.assertEqual(self.indexed.bulk_create(users), 3)
+        self.users.extend(users)
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') >= 700).order_by(-A('points')))
+        with self.assertRaises(ValueError):
+            self.indexed.bulk_create([User(id=9, name='j'), User(id=0, name='a')])
+        with self.assertRaises(ValueError):
+            self.indexed.bulk_create([User(id=9, name='j'), User(id=9, name='k')])
+        self.assertEqual(len(self.store), 9)
+
+        self.assertEqual(self.indexed.filter(A('points') >= 1000).update(points=A('points') - 1000, name='z'), 5)
+        self.assertEqual(self.scan.filter(A('name') == 'z').count(), 5)
+        self.assertSameResults(lambda queryset: queryset.order_by(A('points')))
+        self.assertSameResults(lambda queryset: queryset.filter(A('name') >= 'z'))
+        with self.assertRaises(ValueError):
+            self.indexed.filter(A('id') < 3).update(id=A('id') + 10)
+        with self.assertRaises(ZeroDivisionError):
+            self.indexed.order_by(-A('id')).update(points=1 // A('id'))
+        self.assertEqual(self.indexed.get(A('id') == 8).points, 100)
+        self.assertSameResults(lambda queryset: queryset.filter(A('id') < 3))
+        with self.assertRaises(TypeError):
+            self.indexed.filter(A('id') >= 7).update(points='many', name='y')
+        self.assertEqual([(user.points, user.name) for user in self.users[7:]], [(500, 'z'), (100, 'i')])
+        self.assertSameResults(lambda queryset: queryset.filter(A('points') >= 100).order_by(-A('points')))
+        self.assertSameResults(lambda queryset: queryset.filter(A('name') > 'x'))
+        self.store.delete(self.store.get(8))
+        self.store.insert(self.users[8])
+
+        self.assertEqual(self.indexed.bulk_delete(self.users[::2]), 5)
+        del self.users[::2]
+        self.assertSameResults(lambda queryset: queryset.order_by(-A('points')))
+        self.assertSameResults(lambda queryset: queryset.filter(A('name') < 'z'))
+        with self.assertRaises(KeyError):
+            self.indexed.bulk_update([self.users[0], User(id=0, name='a')])
+        with self.assertRaises(TypeError):
+            self.scan.bulk_create(users)
@@ -0,0 +1,78 @@
+import unittest
+
+from dataclasses import replace
+
+from shared.common_query import A
+from shared.common_query.aggregations import Count, Has, Mean, Median, Sum
+from shared.entities.users import Giftcard, User
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.stores import MemoryStore
+from shared.querysets.views import MaterializedView
+
+
+class MaterializedViewTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore([
+            User(id=1, name='ann', points=1200),
+            User(id=2, name='bob', points=800),
+            User(id=3, name='cid', points=1500, giftcards=[Giftcard(value=250, reason='free giftcard')]),
+        ])
+        self.queryset = MemoryQuerySet(get_objects=self.store).filter(
+            A('points') >= 1000,
+        ).exclude(
+            Has('giftcards').where(A('reason') == 'free giftcard'),
+        )
+        self.view = MaterializedView(self.queryset, count=Count('id'), points=Sum('points'), mean=Mean('points'))
+
+    def assertConsistent(self):
+        self.assertEqual(list(self.view), list(self.queryset))
+        self.assertEqual(self.view.aggregates['count'], self.queryset.aggregate(Count('id')))
+        self.assertEqual(self.view.aggregates['points'], self.queryset.aggregate(Sum('points')))
+
+    def test_changes(self):
+        self.assertEqual([user.id for user in self.view], [1])
+        self.assertEqual(self.view.aggregates, {'count': 1, 'points': 1200, 'mean': 1200})
+
+        self.store.update(replace(self.store.get(2), points=1100))
+        self.assertConsistent()
+        self.assertEqual(self.view.aggregates['mean'], 1150)
+
+        user = self.store.get(1)
+        user.points += 100
+        self.store.update(user)
+        self.assertConsistent()
+        self.assertEqual([user.id for user in self.view], [1, 2])
+
+        self.store.get(1).giftcards.append(Giftcard(value=250, reason='free giftcard'))
+        self.store.update(self.store.get(1))
+        self.store.insert(User(id=4, name='dee', points=5000))
+        self.store.insert(User(id=5, name='eve', points=10))
+        self.assertConsistent()
+
+        self.store.delete(self.store.get(2))
+        self.store.delete(self.store.get(4))
+        self.assertConsistent()
+        self.assertEqual(self.view.aggregates, {'count': 0, 'points': 0, 'mean': None})
+        self.assertFalse(self.view.all().filter(A('points') > 0).exists())
+
+        self.view.close()
+        self.store.insert(User(id=6, name='fay', points=2000))
+        self.assertEqual(len(self.view), 0)
+
+    def test_where(self):
+        view = MaterializedView(self.queryset, rich=Count('id').where(A('points') > 1300), points=Mean('points').where(A('name') != 'ann'))
+        self.assertEqual(view.aggregates, {'rich': 0, 'points': None})
+        self.store.update(replace(self.store.get(2), points=1400))
+        self.assertEqual(view.aggregates, {'rich': 1, 'points': 1400})
+        self.store.insert(User(id=4, name='dee', points=1000))
+        self.assertEqual(view.aggregates, {'rich': 1, 'points': 1200})
+        self.store.delete(self.store.get(2))
+        self.assertEqual(view.aggregates, {'rich': 0, 'points': 1000})
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            MaterializedView(self.queryset.order_by(A('points')))
+        with self.assertRaises(ValueError):
+            MaterializedView(self.queryset, median=Median('points'))
+        with self.assertRaises(TypeError):
+            MaterializedView(MemoryQuerySet(get_objects=lambda: list(self.store)))
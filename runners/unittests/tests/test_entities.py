@@ -0,0 +1,55 @@
+import copy
+import pickle
+import unittest
+import weakref
+
+from uuid import uuid4
+
+from shared.common_query import A
+from shared.common_query.aggregations import Has, Sum
+from shared.entities.compact import NO_GIFTCARDS, CompactGiftcard, CompactUser
+from shared.entities.users import Giftcard, User
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.stores import MemoryStore
+from shared.services import UserService
+
+
+class EntitiesTestCase(unittest.TestCase):
+    def test_slots(self):
+        for user in (User(id=uuid4(), name='Jane Doe'), CompactUser(id=uuid4(), name='Jane Doe')):
+            with self.subTest(type=type(user).__name__):
+                self.assertIs(weakref.ref(user)(), user)
+                self.assertEqual(pickle.loads(pickle.dumps(user)), user)
+                self.assertEqual(copy.deepcopy(user), user)
+        user = CompactUser(id=uuid4(), name='Jane Doe')
+        self.assertFalse(hasattr(user, '__dict__'))
+        with self.assertRaises(AttributeError):
+            user.nickname = 'Jane'
+        self.assertFalse(hasattr(CompactGiftcard(value=1, reason='promo'), '__dict__'))
+
+    def test_sharing(self):
+        reason = ''.join(['welcome ', 'giftcard'])
+        self.assertIs(CompactGiftcard(value=1, reason=reason).reason, CompactGiftcard(value=2, reason='welcome giftcard').reason)
+        self.assertEqual(CompactGiftcard(value=5, reason=reason).subtract(2), CompactGiftcard(value=3, reason='welcome giftcard'))
+        self.assertEqual(Giftcard(value=5, reason=reason).subtract(2), Giftcard(value=3, reason='welcome giftcard'))
+
+        users = [CompactUser(id=uuid4(), name='Jane Doe'), CompactUser(id=uuid4(), name='John Doe', giftcards=[])]
+        self.assertTrue(all(user.giftcards is NO_GIFTCARDS for user in users))
+        users[0].giftcards += (CompactGiftcard(value=250, reason='promo'),)
+        self.assertEqual(users[1].giftcards, ())
+
+    def test_queries(self):
+        users = [
+            CompactUser(id=uuid4(), name='Jane Doe', points=1200, giftcards=[CompactGiftcard(value=250, reason='welcome giftcard')]),
+            CompactUser(id=uuid4(), name='John Doe', points=1000),
+            CompactUser(id=uuid4(), name='Jane Doe', points=600),
+        ]
+        queryset = MemoryQuerySet(get_objects=MemoryStore(users, indexes=['name']))
+        self.assertEqual(list(queryset.filter(A('name') == 'Jane Doe', A('points') > 1000)), users[:1])
+        self.assertEqual(list(queryset.exclude(Has('giftcards'))), users[1:])
+        self.assertEqual(queryset.aggregate(Sum('points')), 2800)
+        self.assertEqual(queryset.filter(A('points') < 1000).update(points=A('points') + 400), 1)
+        self.assertEqual(
+            [user for user, _, _ in UserService(user_queryset=queryset, min_points_giftcard_value=(1000, 250, 'welcome giftcard')).get_users_eligible_for_giftcard()],
+            users[1:],
+        )
@@ -1,3 +1,6 @@
+import asyncio
+import tempfile
+import tracemalloc
 import unittest
 
 from dataclasses import dataclass
@@ -6,13 +9,16 @@ from functools import partial
 from typing import List
 from uuid import uuid4, UUID
 
-from shared.common_query import A
-from shared.common_query.aggregations import Has
+from shared.common_query import A, L, Lt
+from shared.common_query.aggregations import Collect, Count, Has, Mean, Median, Sum
+from shared.mappers import DataEntityMapper, IdentityMap
+from shared.querysets.aio import AsyncQuerySet
 from shared.querysets.memory import MemoryQuerySet
-from shared.querysets.sqlalchemy import SQLAlchemyQuerySet
+from shared.querysets.sqlalchemy import SQLAlchemyQuerySet, capture_statements
 
 from sqlalchemy import (
     create_engine,
+    event,
     Column as NullColumn,
     Integer,
     Numeric,
@@ -44,6 +50,13 @@ class OrderItem(Base):
     line_total = Column(Numeric(precision=2, scale=9))
 
 
+class Customer(Base):
+    __tablename__ = 'customer'
+
+    id = Column(Integer, primary_key=True)
+    name = NullColumn(String, nullable=True)
+
+
 @dataclass
 class OrderAggregate:
     @dataclass
@@ -55,7 +68,12 @@ class OrderAggregate:
     items: List[Item]
 
 
-class OrderAggregateDataEntityMapper:
+class OrderAggregateDataEntityMapper(DataEntityMapper):
+    entity_type = OrderAggregate
+
+    def identify(self, order: Order):
+        return order.uuid
+
     def map(self, order: Order) -> OrderAggregate:
         aggregate = OrderAggregate(
             id=order.uuid,
@@ -78,6 +96,8 @@ class SQLAlchemyQuerySetTestCase(unittest.TestCase):
     def setUp(self):
         engine = create_engine('sqlite:///:memory:', echo=True)
         Base.metadata.create_all(engine)
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: self.statements.append(args[2]))
         session = sessionmaker(bind=engine)()
 
         order = Order(uuid=str(uuid4()), total=Decimal('499.00'))
@@ -181,3 +201,369 @@ class SQLAlchemyQuerySetTestCase(unittest.TestCase):
             ),
             0
         )
+
+    def test_slicing(self):
+        self.assertEqual(len(list(self.queryset[:1])), 1)
+        self.assertEqual(len(list(self.queryset[1:])), 1)
+        self.assertEqual(len(list(self.queryset.offset(1).limit(5))), 1)
+        self.assertEqual(len(list(self.queryset[:1][1:])), 0)
+        self.assertEqual(self.queryset.filter(A('total') >= Decimal('499.00'))[0].total, Decimal('499.00'))
+        with self.assertRaises(IndexError):
+            self.queryset[2]
+        with self.assertRaises(TypeError):
+            self.queryset[:1].filter(A('total') >= Decimal('499.00'))
+
+    def test_aggregate(self):
+        del self.statements[:]
+        self.assertEqual(
+            self.queryset.aggregate(count=Count('id'), has=Has('id'), total=Sum('total'), mean=Mean('total')),
+            {'count': 2, 'has': True, 'total': Decimal('628.00'), 'mean': 314},
+        )
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(self.queryset.filter(A('total') > Decimal('1000.00')).aggregate(Sum('total')), 0)
+        self.assertEqual(self.queryset[1:].aggregate(Count('id')), 1)
+        self.assertEqual(self.queryset.filter(A('total') > Decimal('1000.00')).aggregate(Count('id')), 0)
+        self.assertIsNone(self.queryset.filter(A('total') > Decimal('1000.00')).aggregate(Mean('total')))
+
+        memory = MemoryQuerySet(get_objects=lambda: list(self.queryset))
+        aggregations = {
+            'count': Count('id').where(A('total') > Decimal('200.00')),
+            'has': Has('id').where(A('total') > Decimal('1000.00')),
+            'total': Sum('total').where(A('id') == 1),
+            'mean': Mean('total').where(A('total') < Decimal('200.00')),
+            'median': Median('total').where(A('total') > Decimal('200.00')),
+            'collected': Collect('total').where(A('id') != 1),
+        }
+        self.assertEqual(self.queryset.aggregate(**aggregations), memory.aggregate(**aggregations))
+        self.assertEqual(self.queryset.aggregate(Sum('total').where(A('id') > 1)), memory.aggregate(Sum('total').where(A('id') > 1)))
+
+    def test_median_and_collect(self):
+        memory = MemoryQuerySet(get_objects=lambda: list(self.queryset))
+        for build in (
+            lambda queryset: queryset,
+            lambda queryset: queryset.filter(A('total') > Decimal('1000.00')),
+            lambda queryset: queryset.order_by(-A('total')),
+        ):
+            self.assertEqual(
+                build(self.queryset).aggregate(median=Median('total'), collected=Collect('total'), count=Count('id')),
+                build(memory).aggregate(median=Median('total'), collected=Collect('total'), count=Count('id')),
+            )
+        self.queryset.session.add(Order(uuid=str(uuid4()), total=Decimal('200.00')))
+        self.assertEqual(self.queryset.aggregate(Median('total')), Decimal('200.00'))
+        self.assertEqual(self.queryset.order_by(A('total'))[1:].aggregate(Median('total')), Decimal('349.50'))
+        with self.assertRaises(NotImplementedError):
+            list(self.queryset.group_by('uuid', median=Median('total')))
+
+    def test_joined_query(self):
+        session = self.queryset.session
+        joined = SQLAlchemyQuerySet(session=session, model=Order, query=session.query(Order).join(Order.items))
+        self.assertEqual(joined.count(), len(list(joined)))
+        self.assertEqual(joined.aggregate(count=Count('id'), total=Sum('total')), {'count': 1, 'total': Decimal('499.00')})
+        self.assertEqual(joined.update(total=A('total') + 1), 1)
+        self.assertEqual(sorted(order.total for order in self.queryset), [Decimal('129.00'), Decimal('500.00')])
+
+    def test_annotate(self):
+        del self.statements[:]
+        orders = list(self.queryset.annotate(lines=Count('items'), large=Count('items').where(A('line_total') > Decimal('1000.00'))))
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(sorted((order.lines, order.large) for order in orders), [(0, 0), (1, 0)])
+        self.assertEqual(len(list(self.queryset.filter(Count('items') > 0))), 1)
+
+        annotated = self.queryset.annotate(lines=Count('items'))
+        memory = MemoryQuerySet(get_objects=lambda: list(self.queryset)).annotate(lines=Count('items'))
+        for build in (
+            lambda queryset: queryset.filter(A('lines') > 0),
+            lambda queryset: queryset.exclude(A('lines') + 1 == 1),
+            lambda queryset: queryset.order_by(-A('lines'), A('id')),
+        ):
+            self.assertEqual([order.id for order in build(annotated)], [order.id for order in build(memory)])
+
+    def test_group_by(self):
+        session = self.queryset.session
+        session.add(Order(uuid=str(uuid4()), total=Decimal('129.00')))
+        session.commit()
+
+        del self.statements[:]
+        groups = list(self.queryset.group_by('total', orders=Count('id')))
+        self.assertEqual(len(self.statements), 1)
+        self.assertIn('GROUP BY', self.statements[0])
+        self.assertEqual(
+            sorted(groups, key=lambda group: group['total']),
+            [{'total': Decimal('129.00'), 'orders': 2}, {'total': Decimal('499.00'), 'orders': 1}],
+        )
+        self.assertEqual(list(self.queryset.group_by('total', orders=Count('id')).filter(A('orders') > 1)), [{'total': Decimal('129.00'), 'orders': 2}])
+        self.assertEqual(
+            sorted(self.queryset.group_by('total', first=Count('id').where(A('id') == 1)), key=lambda group: group['total']),
+            [{'total': Decimal('129.00'), 'first': 0}, {'total': Decimal('499.00'), 'first': 1}],
+        )
+        self.assertEqual(
+            sorted(row['total'] for row in self.queryset.values('total').filter(A('total') < Decimal('200.00'))),
+            [Decimal('129.00'), Decimal('129.00')],
+        )
+
+    def test_pushdown(self):
+        session = self.queryset.session
+        session.add(Order(uuid=str(uuid4()), total=Decimal('129.00')))
+        session.commit()
+        by_total = self.queryset.order_by(-A('total'), A('id'))
+
+        del self.statements[:]
+        self.assertEqual([order.id for order in by_total], [1, 2, 3])
+        self.assertEqual([order.id for order in self.queryset.order_by(A('id')).order_by(A('total'))], [2, 3, 1])
+        self.assertEqual([order.id for order in self.queryset.exclude(A('total') > Decimal('200.00'), A('id') == 1)], [2, 3])
+        self.assertEqual(by_total.first().id, 1)
+        self.assertIn('LIMIT', self.statements[-1])
+        self.assertEqual(by_total.last().id, 3)
+        self.assertIn('ORDER BY "order".total ASC, "order".id DESC', self.statements[-1])
+        self.assertEqual(self.queryset.last().id, 3)
+        self.assertEqual(by_total[:2].last().id, 2)
+        self.assertEqual(self.queryset.count(), 3)
+        self.assertIn('count(*)', self.statements[-1])
+        self.assertEqual(self.queryset[1:].count(), 2)
+        self.assertEqual(self.queryset.group_by('total', orders=Count('id')).count(), 2)
+        self.assertTrue(self.queryset.filter(A('total') < Decimal('200.00')).exists())
+        self.assertIn('EXISTS', self.statements[-1])
+        self.assertFalse(self.queryset.filter(A('total') > Decimal('999.00')).exists())
+        self.assertEqual(by_total[1:].aggregate(Sum('total')), Decimal('258.00'))
+
+        self.assertEqual(self.queryset.get(A('total') > Decimal('200.00')).id, 1)
+        with self.assertRaises(SQLAlchemyQuerySet.MultipleObjectsReturned):
+            self.queryset.get(A('total') < Decimal('200.00'))
+        with self.assertRaises(SQLAlchemyQuerySet.ObjectDoesNotExist):
+            self.queryset.get(A('total') > Decimal('999.00'))
+        with self.assertRaises(TypeError):
+            self.queryset[:1].order_by(A('id'))
+
+    def test_exclude_null(self):
+        session = self.queryset.session
+        session.add_all([Customer(id=1, name='x'), Customer(id=2, name=None), Customer(id=3, name='y')])
+        customers = SQLAlchemyQuerySet(session=session, model=Customer)
+        memory = MemoryQuerySet(get_objects=lambda: list(customers))
+        for queries in ([A('name') == 'x'], [A('name') == 'x', A('id') < 3], [A('name') == 'y', A('id') > 1]):
+            self.assertEqual(
+                [customer.id for customer in customers.exclude(*queries).order_by(A('id'))],
+                [customer.id for customer in memory.exclude(*queries).order_by(A('id'))],
+            )
+
+    def test_compiler_coverage(self):
+        session = self.queryset.session
+        order = Order(uuid='ABC-' + str(uuid4()), total=Decimal('300.00'))
+        session.add(order)
+        session.add(OrderItem(order=order, line_total=Decimal('100.00')))
+        session.add(OrderItem(order=order, line_total=Decimal('250.00')))
+        session.commit()
+        memory = MemoryQuerySet(get_objects=lambda: session.query(Order).all())
+
+        for query in (
+            A('total') > 200,
+            Lt(100, A('total'), 400),
+            ~(A('total') > 200),
+            -A('total') < -200,
+            (A('total') + 1) * 2 > 600,
+            A('id') / 2 == 1.5,
+            A('id') // 2 == 1,
+            A('id') % 2 == 1,
+            A('uuid').lower().startswith('abc'),
+            L(1) == 1,
+            Count('items') > 1,
+            Count('items').where(A('line_total') > 200) == 1,
+            Sum('items.line_total') > 300,
+            Sum('items.line_total').where(A('line_total') < 200) == 100,
+            Has('items') & (Mean('items.line_total') < 200),
+            Has('items') & ~Has('items').where(A('line_total') > 400),
+            ~Has('items') | (A('total') > 400),
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    sorted(order.id for order in self.queryset.filter(query)),
+                    sorted(order.id for order in memory.filter(query)),
+                )
+
+        for query in (Median('items.line_total') > 1, A('items').total > 1, A('uuid').split('-')[0] == 'ABC'):
+            with self.subTest(query=query):
+                with self.assertRaises(NotImplementedError):
+                    self.queryset.filter(query)
+
+    def test_iterator(self):
+        session = self.queryset.session
+        session.add_all([Order(uuid=str(uuid4()), total=Decimal(total)) for total in (1, 2, 3)])
+        session.commit()
+
+        self.assertEqual([order.id for order in self.queryset.order_by(-A('id')).iterator(chunk_size=2)], [5, 4, 3, 2, 1])
+        self.assertEqual(sorted(order.lines for order in self.queryset.annotate(lines=Count('items')).iterator(chunk_size=2)), [0, 0, 0, 0, 1])
+        self.assertEqual(sorted(row['id'] for row in self.queryset.values('id').iterator(chunk_size=2)), [1, 2, 3, 4, 5])
+
+        del self.statements[:]
+        self.assertEqual([order.id for order in self.queryset.filter(A('id') > 1).iterator(chunk_size=2, keyset=True)], [2, 3, 4, 5])
+        self.assertEqual(len(self.statements), 3)
+        self.assertIn('"order".id > ?', self.statements[-1])
+
+        seen = []
+        for order in self.queryset.iterator(chunk_size=2, keyset=True):
+            seen.append(order.id)
+            if order.id == 3:
+                session.delete(session.query(Order).get(2))
+                session.add(Order(uuid=str(uuid4()), total=Decimal('4.00')))
+                session.commit()
+        self.assertEqual(seen, [1, 2, 3, 4, 5, 6])
+
+        with self.assertRaises(TypeError):
+            self.queryset.order_by(A('total')).iterator(keyset=True)
+        with self.assertRaises(ValueError):
+            self.queryset.iterator(chunk_size=0)
+
+    def test_prefetch(self):
+        session = self.queryset.session
+        for total in (1, 2, 3):
+            order = Order(uuid=str(uuid4()), total=Decimal(total))
+            session.add_all([OrderItem(order=order, line_total=Decimal(total)) for _ in range(total)])
+        session.commit()
+        session.expire_all()
+
+        def map_orders(queryset):
+            with capture_statements(session) as statements:
+                aggregates = [order_aggregate_mapper.map(order) for order in queryset]
+            session.expire_all()
+            return [len(aggregate.items) for aggregate in aggregates], len(statements)
+
+        self.assertEqual(map_orders(self.queryset), ([1, 0, 1, 2, 3], 6))
+        self.assertEqual(map_orders(self.queryset.prefetch(A('items'))), ([1, 0, 1, 2, 3], 2))
+        self.assertEqual(map_orders(self.queryset.select_related('items')), ([1, 0, 1, 2, 3], 1))
+        self.assertEqual(map_orders(self.queryset.prefetch(A('items').order).filter(Has('items'))[1:]), ([1, 2, 3], 3))
+        self.assertEqual(map_orders(self.queryset.prefetch(A('items')).iterator(chunk_size=2, keyset=True)), ([1, 0, 1, 2, 3], 6))
+
+        with capture_statements(session) as statements:
+            self.assertEqual(self.queryset.prefetch(A('items')).count(), 5)
+            self.assertEqual(self.queryset.select_related(A('items')).order_by(A('id')).values('id').first(), {'id': 1})
+        self.assertEqual(len(statements), 2)
+        with self.assertRaises(ValueError):
+            self.queryset.prefetch(A('total'))
+        with self.assertRaises(ValueError):
+            self.queryset.prefetch(A('items')[0])
+
+    def test_mapped(self):
+        session = self.queryset.session
+        session.add_all([Order(uuid=str(uuid4()), total=Decimal(total)) for total in (1, 2, 3)])
+        session.commit()
+
+        identity_map = IdentityMap()
+        aggregates = self.queryset.mapped(order_aggregate_mapper, identity_map).prefetch(A('items'))
+        with capture_statements(session) as statements:
+            orders = list(aggregates)
+        self.assertEqual(len(statements), 2)
+        self.assertEqual([order.total for order in orders], [Decimal(total) for total in ('499.00', '129.00', 1, 2, 3)])
+        self.assertEqual(orders[0].items, [OrderAggregate.Item(line_total=Decimal('499.00'))])
+        self.assertEqual(len(identity_map), 5)
+
+        self.assertIs(aggregates.get(A('total') > Decimal('200.00')), orders[0])
+        self.assertIs(aggregates.order_by(-A('id')).first(), orders[-1])
+        self.assertEqual(list(aggregates.order_by(-A('total')).iterator(chunk_size=2)), sorted(orders, key=lambda order: -order.total))
+        self.assertTrue(all(
+            streamed is order
+            for streamed, order
+            in zip(aggregates.iterator(chunk_size=2, keyset=True), orders)
+        ))
+        self.assertIsNot(self.queryset.mapped(order_aggregate_mapper).first(), orders[0])
+        self.assertEqual(aggregates.order_by(A('id')).values('uuid').first(), {'uuid': orders[0].id})
+
+    def test_bulk_writes(self):
+        session = self.queryset.session
+        with capture_statements(session) as statements:
+            created = self.queryset.bulk_create(
+                [{'uuid': str(index), 'total': Decimal(index)} for index in range(250)]
+                + [Order(uuid=str(uuid4()), total=Decimal('10.00')) for _ in range(50)],
+                batch_size=100,
+            )
+        self.assertEqual(created, 300)
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(self.queryset.count(), 302)
+
+        order = self.queryset.get(A('uuid') == '5')
+        with capture_statements(session) as statements:
+            updated = self.queryset.filter(A('total') < 100).update(total=A('total') * 2, uuid=A('uuid') + '!')
+        self.assertEqual(updated, 150)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+        self.assertEqual((order.total, order.uuid), (Decimal('10.00'), '5!'))
+
+        orders = list(self.queryset.filter(A('total') == 20))
+        ids = [order.id for order in orders]
+        for order in orders:
+            order.total = Decimal('1.00')
+        with capture_statements(session) as statements:
+            self.assertEqual(self.queryset.bulk_update(orders, fields=['total'], batch_size=30), 51)
+        self.assertEqual(len(statements), 2)
+        session.expire_all()
+        self.assertEqual(self.queryset.filter(A('total') == 1).count(), 51)
+
+        with capture_statements(session) as statements:
+            self.assertEqual(self.queryset.bulk_delete(orders[:30] + ids[30:], batch_size=40), 51)
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(self.queryset.count(), 251)
+        self.assertNotIn(orders[0], session)
+        with self.assertRaises(TypeError):
+            self.queryset[:10].update(total=0)
+
+
+class SQLAlchemyStreamingTestCase(unittest.TestCase):
+    def queryset(self, size):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        engine.execute(Order.__table__.insert(), [
+            {'uuid': str(index), 'total': Decimal(index % 100)}
+            for index
+            in range(size)
+        ])
+        return SQLAlchemyQuerySet(session=sessionmaker(bind=engine)(), model=Order)
+
+    def test_memory_is_flat(self):
+        for keyset in (False, True):
+            peaks = []
+            for size in (2000, 8000):
+                queryset = self.queryset(size)
+                tracemalloc.start()
+                total = sum(order.total for order in queryset.iterator(chunk_size=200, keyset=keyset))
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                self.assertEqual(total, sum(Decimal(index % 100) for index in range(size)))
+            with self.subTest(keyset=keyset):
+                self.assertLess(peaks[1], peaks[0] * 1.5)
+
+
+class SQLAlchemyAsyncTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        engine = create_engine('sqlite:///{}/orders.db'.format(directory.name), connect_args={'check_same_thread': False})
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(engine)
+        engine.execute(Order.__table__.insert(), [
+            {'uuid': str(index), 'total': Decimal(index % 100)}
+            for index
+            in range(3000)
+        ])
+        self.sessions = sessionmaker(bind=engine)
+
+    async def test_gather(self):
+        orders, other_orders = [
+            AsyncQuerySet(SQLAlchemyQuerySet(session=self.sessions(), model=Order), chunk_size=500)
+            for _ in range(2)
+        ]
+        large = orders.filter(A('total') >= 50)
+        count, total, other_count, last = await asyncio.gather(
+            large.count(),
+            orders.aggregate(Sum('total')),
+            other_orders.exclude(A('total') >= 50).count(),
+            other_orders.order_by(-A('id')).first(),
+        )
+        self.assertEqual((count, total, other_count, last.id), (1500, Decimal(4950 * 30), 1500, 3000))
+        self.assertEqual(len([order async for order in large]), 1500)
+        self.assertEqual([order.id async for order in orders.order_by(-A('id'))[:2]], [3000, 2999])
+        self.assertEqual(await orders[2], await orders.get(A('id') == 3))
+
+    async def test_nested_query(self):
+        orders = AsyncQuerySet(SQLAlchemyQuerySet(session=self.sessions(), model=Order), chunk_size=2)
+        counts = []
+        async for order in orders.filter(A('id') <= 5):
+            counts.append(await asyncio.wait_for(orders.filter(A('total') == order.total).count(), timeout=5))
+        self.assertEqual(counts, [30] * 5)
@@ -0,0 +1,66 @@
+import gc
+import unittest
+
+from dataclasses import dataclass
+from uuid import uuid4
+
+from shared.entities.users import User
+from shared.mappers import DataEntityMapper, IdentityMap
+
+
+@dataclass
+class UserRow:
+    id: int
+    uuid: str
+    name: str
+
+
+class UserRowMapper(DataEntityMapper):
+    entity_type = User
+
+    def __init__(self):
+        self.batches = []
+
+    def identify(self, row):
+        return row.uuid
+
+    def map(self, row):
+        return User(id=row.uuid, name=row.name)
+
+    def map_batch(self, rows):
+        self.batches.append(len(rows))
+        return super().map_batch(rows)
+
+
+class MapperTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rows = [UserRow(id=index, uuid=str(uuid4()), name='user {}'.format(index)) for index in range(5)]
+        self.mapper = UserRowMapper()
+
+    def test_map_all(self):
+        users = list(self.mapper.map_all(self.rows, chunk_size=2))
+        self.assertEqual([user.name for user in users], [row.name for row in self.rows])
+        self.assertEqual(self.mapper.batches, [2, 2, 1])
+
+    def test_identity_map(self):
+        identity_map = IdentityMap()
+        users = list(self.mapper.map_all(self.rows[:3], identity_map))
+        again = list(self.mapper.map_all(self.rows[::-1], identity_map))
+        self.assertEqual(self.mapper.batches, [3, 2])
+        self.assertEqual(len(identity_map), 5)
+        for user in users:
+            self.assertIs(again[4 - users.index(user)], user)
+        self.assertIs(identity_map.get(User, self.rows[0].uuid), users[0])
+        self.assertIn((User, self.rows[0].uuid), identity_map)
+
+        del users, again, user
+        gc.collect()
+        self.assertEqual(len(identity_map), 0)
+
+    def test_repeated_rows(self):
+        identity_map = IdentityMap()
+        first, second, third = self.mapper.map_all([self.rows[0], self.rows[1], self.rows[0]], identity_map)
+        self.assertIs(third, first)
+        self.assertIsNot(second, first)
+        self.assertEqual(self.mapper.batches, [2])
+        self.assertIs(identity_map.get(User, self.rows[0].uuid), first)
@@ -0,0 +1,137 @@
+import unittest
+
+from uuid import uuid4
+
+from shared.common_query import A
+from shared.entities.users import Giftcard, User
+from shared.mappers import DataEntityMapper
+from shared.querysets.memory import MemoryQuerySet
+from shared.querysets.sqlalchemy import SQLAlchemyQuerySet, capture_statements
+from shared.querysets.stores import MemoryStore, SortedIndex
+from shared.unit_of_work import UnitOfWork
+
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+Base = declarative_base()
+
+
+class UserRow(Base):
+    __tablename__ = 'user'
+
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    points = Column(Integer, nullable=False)
+
+
+class UserRowMapper(DataEntityMapper):
+    entity_type = User
+
+    def map(self, row):
+        return User(id=row.id, name=row.name, points=row.points)
+
+    def unmap(self, user):
+        return {'id': user.id, 'name': user.name, 'points': user.points}
+
+
+class RecordingStore(MemoryStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = []
+
+    def insert_many(self, objects):
+        self.writes.append(('insert', len(objects)))
+        return super().insert_many(objects)
+
+    def update_many(self, objects):
+        objects = list(objects)
+        self.writes.append(('update', len(objects)))
+        return super().update_many(objects)
+
+    def delete_many(self, objects):
+        self.writes.append(('delete', len(objects)))
+        return super().delete_many(objects)
+
+
+class MemoryUnitOfWorkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.users = [User(id=uuid4(), name='user {}'.format(index), points=index * 100) for index in range(10)]
+        self.store = RecordingStore(self.users, indexes=[SortedIndex('points')])
+        self.queryset = MemoryQuerySet(get_objects=self.store)
+        self.unit_of_work = UnitOfWork({User: self.queryset})
+
+    def test_commit(self):
+        self.unit_of_work.register_clean(*self.queryset)
+        for user in self.queryset.filter(A('points') >= 500):
+            user.points += 1000
+        self.users[0].giftcards.append(Giftcard(value=250, reason='welcome giftcard'))
+        self.users[1].points = self.users[1].points
+        self.unit_of_work.register_dirty(self.users[2])
+        new = [User(id=uuid4(), name='new', points=50) for _ in range(3)]
+        self.unit_of_work.register_new(*new)
+        self.unit_of_work.register_deleted(self.users[3], self.users[4], new[0])
+        self.unit_of_work.commit()
+
+        self.assertEqual(self.store.writes, [('insert', 2), ('update', 6), ('delete', 2)])
+        self.assertEqual(len(self.store), 10)
+        self.assertEqual(self.queryset.filter(A('points') > 1000).count(), 5)
+        self.assertEqual([user.points for user in self.queryset.order_by(A('points'))][:3], [0, 50, 50])
+
+        del self.store.writes[:]
+        new[1].points = 60
+        self.unit_of_work.commit()
+        self.assertEqual(self.store.writes, [('update', 1)])
+        self.unit_of_work.commit()
+        self.assertEqual(self.store.writes, [('update', 1)])
+
+    def test_context_manager(self):
+        with self.assertRaises(RuntimeError):
+            with self.unit_of_work as unit_of_work:
+                unit_of_work.register_new(User(id=uuid4(), name='new'))
+                raise RuntimeError
+        self.assertEqual(self.store.writes, [])
+
+        with self.unit_of_work as unit_of_work:
+            unit_of_work.register_deleted(self.users[0])
+        self.assertEqual(self.store.writes, [('delete', 1)])
+        with self.assertRaises(TypeError):
+            self.unit_of_work.register_new(Giftcard(value=1, reason='loose'))
+
+
+class SQLAlchemyUnitOfWorkTestCase(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all([UserRow(id=str(index), name='user {}'.format(index), points=index * 100) for index in range(10)])
+        self.session.commit()
+        self.mapper = UserRowMapper()
+        self.queryset = SQLAlchemyQuerySet(session=self.session, model=UserRow)
+        self.unit_of_work = UnitOfWork({User: self.queryset}, mappers={User: self.mapper})
+
+    def test_commit(self):
+        users = list(self.queryset.mapped(self.mapper, self.unit_of_work.identity_map))
+        self.unit_of_work.register_clean(*users)
+        for user in users[5:]:
+            user.points += 1000
+        self.unit_of_work.register_new(*[User(id='new {}'.format(index), name='new') for index in range(20)])
+        self.unit_of_work.register_deleted(*users[:3])
+
+        with capture_statements(self.session) as statements:
+            self.unit_of_work.commit()
+        self.assertEqual([statement.split()[0] for statement in statements], ['INSERT', 'UPDATE', 'DELETE'])
+        self.assertEqual(self.queryset.count(), 27)
+        self.assertEqual(self.queryset.filter(A('points') > 1000).count(), 5)
+        self.assertIs(self.queryset.mapped(self.mapper, self.unit_of_work.identity_map).get(A('id') == '9'), users[9])
+
+        with capture_statements(self.session) as statements:
+            self.unit_of_work.commit()
+        self.assertEqual(statements, [])
+
+    def test_rollback(self):
+        self.unit_of_work.register_new(User(id='new', name='new'), User(id='0', name='taken'))
+        with self.assertRaises(Exception):
+            self.unit_of_work.commit()
+        self.assertEqual(self.queryset.count(), 10)
+        self.assertEqual(self.unit_of_work.new, {})
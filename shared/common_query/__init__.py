@@ -1,3 +1,4 @@
+import copy
 import operator
 
 from functools import reduce
@@ -5,7 +6,22 @@ from itertools import groupby
 
 
 class LazyObject:
-    pass
+    def __reduce__(self):
+        # Pickle the attributes as they are, since calling the constructor
+        # again would re-run its flattening and precalculation, and lookups
+        # of missing attributes build nodes instead of raising.
+        state = dict(object.__getattribute__(self, '__dict__'))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                state[name] = object.__getattribute__(self, name)
+        return rebuild_node, (type(self), state)
+
+
+def rebuild_node(cls, state):
+    node = cls.__new__(cls)
+    for name, value in state.items():
+        object.__setattr__(node, name, value)
+    return node
 
 
 class Comparable(LazyObject):
@@ -33,6 +49,9 @@ class Comparable(LazyObject):
     def __or__(self, other):
         return Or(self, other)
 
+    def __invert__(self):
+        return Not(self)
+
 
 class ArithmeticOperable(LazyObject):
     def __add__(self, other):
@@ -181,7 +200,7 @@ class Lt(BooleanOperation, BinaryOperation):
 
 
 class Le(BooleanOperation, BinaryOperation):
-    op = '>='
+    op = '<='
     reducer = operator.le
 
 
@@ -293,14 +312,62 @@ class FilterableMixin:
         self.query = query
 
     def where(self, query):
-
-        return type(self)(
-            field=self.field,
-            query=query,
-        )
+        result = copy.copy(self)
+        result.query = query
+        return result
 
     def __repr__(self):
         s = self.__class__.__name__ + '(' + repr(self.field) + ')'
         if self.query is not None:
             s = s + '.where(' + repr(self.query) + ')'
         return s
+
+
+def fingerprint(node):
+    """
+    Return a hashable, structural representation of a query. Two queries
+    built the same way have equal fingerprints, which `==` cannot tell us
+    since it is overloaded to build `Eq` nodes. Constants are paired with
+    their type, so that e.g. `A('x') == 1` and `A('x') == True` differ.
+    """
+    if isinstance(node, BinaryOperation):
+        return (type(node), tuple(fingerprint(operand) for operand in node.operands))
+
+    elif isinstance(node, UnaryOperation):
+        return (type(node), fingerprint(node.operand))
+
+    elif isinstance(node, Call):
+        args, kwargs = node.arguments
+        return (
+            Call,
+            tuple(fingerprint(arg) for arg in args),
+            tuple((kw, fingerprint(arg)) for kw, arg in kwargs.items()),
+            fingerprint(node.parent),
+        )
+
+    elif isinstance(node, A):
+        return (type(node), fingerprint(node.arguments), fingerprint(node.parent))
+
+    elif isinstance(node, L):
+        return (L, fingerprint(node.value))
+
+    elif isinstance(node, FilterableMixin):
+        return (type(node),) + tuple(
+            (name, fingerprint(value))
+            for name, value
+            in sorted(vars(node).items())
+        )
+
+    elif isinstance(node, LazyObject):
+        raise TypeError('Cannot fingerprint {!r}'.format(node))
+
+    elif isinstance(node, (list, tuple)):
+        return (type(node), tuple(fingerprint(value) for value in node))
+
+    elif isinstance(node, (set, frozenset)):
+        return (type(node), frozenset(fingerprint(value) for value in node))
+
+    elif isinstance(node, dict):
+        return (dict, tuple((key, fingerprint(value)) for key, value in node.items()))
+
+    return (type(node), node)
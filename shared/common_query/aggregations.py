@@ -1,51 +1,315 @@
+from collections import deque
+from itertools import count, islice
+from operator import itemgetter
+
 from shared.common_query import FilterableMixin, ArithmeticOperable, Comparable
 
 
 class Aggregation:
-    pass
+    def accumulator(self, compiler):
+        return self.accumulator_class(self, compiler)
+
+
+def select(values, k):
+    """
+    Return the `k`-th smallest of `values` (0-based) without sorting them,
+    by quickselect: each round keeps only the partition holding it.
+    """
+    while True:
+        pivot = values[len(values) // 2]
+        lows = [value for value in values if value < pivot]
+        if k < len(lows):
+            values = lows
+            continue
+        highs = [value for value in values if pivot < value]
+        equal = len(values) - len(lows) - len(highs)
+        if k < len(lows) + equal:
+            return pivot
+        k -= len(lows) + equal
+        values = highs
+
+
+def median(values):
+    length = len(values)
+
+    if length == 0:
+        return None
+
+    right = select(values, length // 2)
+
+    if length % 2 == 0:
+        lows = [value for value in values if value < right]
+        left = max(lows) if len(lows) == length // 2 else right
+        return sum([right, left]) / 2
+
+    return right
+
+
+def chunks(objects, size=1024):
+    objects = iter(objects)
+    return iter(lambda: list(islice(objects, size)), [])
+
+
+class Accumulator:
+    """
+    Computes an aggregation incrementally: feed it the objects in batches
+    with `update`, then read the `result`. Several accumulators can share a
+    single pass over a queryset, and batching lets each one reduce a batch
+    with builtins instead of a method call per object. Only the objects
+    matching the aggregation's `where` query, compiled with `compiler`, are
+    added.
+    """
+
+    def __init__(self, aggregation, compiler):
+        self.aggregation = aggregation
+        self.get_value = compiler.get_value
+        self.predicate = compiler.compile(aggregation.query) if aggregation.query is not None else None
+
+    def __getstate__(self):
+        # Partial results come back from worker processes pickled, and the
+        # compiled predicate, a closure, is not needed to merge them.
+        return dict(self.__dict__, predicate=None)
+
+    def values(self, objects):
+        get_value, field = self.get_value, self.aggregation.field
+        return [get_value(object, field) for object in objects]
+
+    def update(self, objects):
+        if self.predicate is not None:
+            objects = list(filter(self.predicate, objects))
+        self.add(objects)
+
+    def add(self, objects):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def merge(self, other):
+        """
+        Add the state of `other`, an accumulator of the same aggregation
+        fed the objects following those fed to this one, e.g. by another
+        process scanning the next partition.
+        """
+        raise NotImplementedError
+
+    def accumulate(self, objects):
+        for chunk in chunks(objects):
+            self.update(chunk)
+        return self.result()
+
+
+class CountAccumulator(Accumulator):
+    def __init__(self, aggregation, compiler):
+        super().__init__(aggregation, compiler)
+        self.length = 0
+
+    def add(self, objects):
+        self.length += len(objects)
+
+    def merge(self, other):
+        self.length += other.length
+
+    def result(self):
+        return self.length
+
+
+class HasAccumulator(Accumulator):
+    def __init__(self, aggregation, compiler):
+        super().__init__(aggregation, compiler)
+        self.found = False
+
+    def add(self, objects):
+        self.found = self.found or any(objects)
+
+    def merge(self, other):
+        self.found = self.found or other.found
+
+    def result(self):
+        return self.found
+
+
+class SumAccumulator(Accumulator):
+    def __init__(self, aggregation, compiler):
+        super().__init__(aggregation, compiler)
+        self.total = 0
+
+    def add(self, objects):
+        # Starting from the running total keeps the additions in the same
+        # order as one `sum` over all the values.
+        self.total = sum(self.values(objects), self.total)
+
+    def merge(self, other):
+        self.total += other.total
+
+    def result(self):
+        return self.total
+
+
+class MeanAccumulator(SumAccumulator):
+    def __init__(self, aggregation, compiler):
+        super().__init__(aggregation, compiler)
+        self.length = 0
+
+    def add(self, objects):
+        super().add(objects)
+        self.length += len(objects)
+
+    def merge(self, other):
+        super().merge(other)
+        self.length += other.length
+
+    def result(self):
+        if self.length == 0:
+            return None
+        return self.total / self.length
+
+
+class MomentsAccumulator(Accumulator):
+    """
+    Tracks the count, mean and sum of squared deviations of a field with
+    Welford's method, updating the mean incrementally so that it stays
+    accurate when the values are large compared to their spread.
+    """
+
+    def __init__(self, aggregation, compiler):
+        super().__init__(aggregation, compiler)
+        self.length, self.mean, self.deviations = 0, 0, 0
+
+    def add(self, objects):
+        length, mean, deviations = self.length, self.mean, self.deviations
+        for value in self.values(objects):
+            length += 1
+            delta = value - mean
+            mean += delta / length
+            deviations += delta * (value - mean)
+        self.length, self.mean, self.deviations = length, mean, deviations
+
+    def merge(self, other):
+        # Chan et al.'s pairwise combination of the moments of two samples.
+        if other.length == 0:
+            return
+        length = self.length + other.length
+        delta = other.mean - self.mean
+        self.mean += delta * other.length / length
+        self.deviations += other.deviations + delta * delta * self.length * other.length / length
+        self.length = length
+
+
+class StableMeanAccumulator(MomentsAccumulator):
+    def result(self):
+        if self.length == 0:
+            return None
+        return self.mean
+
+
+class VarianceAccumulator(MomentsAccumulator):
+    def result(self):
+        length = self.length - (1 if self.aggregation.sample else 0)
+
+        if length <= 0:
+            return None
+
+        return self.deviations / length
+
+
+class CollectAccumulator(Accumulator):
+    def __init__(self, aggregation, compiler):
+        super().__init__(aggregation, compiler)
+        self.collected = []
+
+    def add(self, objects):
+        self.collected.extend(self.values(objects))
+
+    def merge(self, other):
+        self.collected.extend(other.collected)
+
+    def result(self):
+        return self.collected
+
+
+class MedianAccumulator(CollectAccumulator):
+    def result(self):
+        return median(self.collected)
 
 
 class Count(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    accumulator_class = CountAccumulator
+
     def reducer(self, queryset):
-        return len(list(queryset))
+        # Step a counter alongside the objects without keeping them around.
+        counter = count()
+        deque(zip(queryset, counter), maxlen=0)
+        return next(counter)
 
 
 class Sum(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    accumulator_class = SumAccumulator
+
     def reducer(self, queryset):
         return sum(queryset.compiler.get_value(object, self.field) for object in queryset)
 
 
 class Has(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    accumulator_class = HasAccumulator
+
     def reducer(self, queryset):
-        return any(list(queryset))
+        # `any` stops pulling objects at the first truthy one.
+        return any(queryset)
 
 
 class Mean(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    """
+    The arithmetic mean, or None when there are no values, as in SQL. With
+    `stable`, it is accumulated incrementally (Welford's method) instead of
+    as one large sum divided at the end.
+    """
+
+    def __init__(self, field, query=None, stable=False):
+        super().__init__(field, query)
+        self.stable = stable
+
+    @property
+    def accumulator_class(self):
+        return StableMeanAccumulator if self.stable else MeanAccumulator
+
     def reducer(self, queryset):
-        result = Sum(self.field).where(self.query).reducer(queryset)
-        result /= Count(self.field).where(self.query).reducer(queryset)
-        return result
+        if self.stable:
+            return self.where(None).accumulator(queryset.compiler).accumulate(queryset)
 
+        values = (queryset.compiler.get_value(object, self.field) for object in queryset)
+        counter = count()
+        total = sum(map(itemgetter(0), zip(values, counter)))
+        length = next(counter)
+        return total / length if length else None
+
+
+class Variance(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    """
+    The population variance, or the sample variance with `sample`, computed
+    in one numerically stable pass (Welford's method). None when there are
+    too few values.
+    """
+    accumulator_class = VarianceAccumulator
+
+    def __init__(self, field, query=None, sample=False):
+        super().__init__(field, query)
+        self.sample = sample
 
-class Median(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
     def reducer(self, queryset):
-        values = list(sorted(queryset.compiler.get_value(object, self.field) for object in queryset))
-        length = len(values)
+        return self.where(None).accumulator(queryset.compiler).accumulate(queryset)
 
-        if length == 0:
-            return None
 
-        if length % 2 == 0:
-            right = length // 2
-            left = right - 1
-            right = values[right]
-            left = values[left]
-            return sum([right, left]) / 2
+class Median(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    accumulator_class = MedianAccumulator
 
-        return values[length // 2]
+    def reducer(self, queryset):
+        return median([queryset.compiler.get_value(object, self.field) for object in queryset])
 
 
 class Collect(FilterableMixin, ArithmeticOperable, Comparable, Aggregation):
+    accumulator_class = CollectAccumulator
+
     def reducer(self, queryset):
         result = []
 
@@ -0,0 +1,193 @@
+from functools import reduce
+from operator import itemgetter
+
+from shared.common_query import (
+    A,
+    And,
+    BinaryOperation,
+    BooleanOperation,
+    Call,
+    Eq,
+    FilterableMixin,
+    FloorDiv,
+    Ge,
+    GetItem,
+    Gt,
+    L,
+    LazyObject,
+    Le,
+    Lt,
+    Mod,
+    Ne,
+    Not,
+    Or,
+    TrueDiv,
+    UnaryOperation,
+)
+
+INVERSES = {
+    Eq: Ne,
+    Ne: Eq,
+    Gt: Le,
+    Ge: Lt,
+    Lt: Ge,
+    Le: Gt,
+}
+
+ATTRIBUTE_COST = 1
+CALL_COST = 10
+AGGREGATION_COST = 100
+
+
+def optimize(node):
+    """
+    Rewrite a query into an equivalent one that is cheaper to evaluate:
+    constant subexpressions are folded, double negations removed, negations
+    pushed into `And`/`Or` (De Morgan) and comparisons, and the operands of
+    `And`/`Or` ordered so that cheap ones are evaluated, and can
+    short-circuit, before expensive ones such as aggregations. Operands
+    that can raise are never moved ahead of those written before them,
+    which may guard them, as in `Has('giftcards') & (A('giftcards')[0].value > 1)`.
+    """
+    if isinstance(node, Not):
+        return negate(optimize(node.operand))
+
+    elif isinstance(node, (And, Or)):
+        return optimize_junction(type(node), [optimize(operand) for operand in node.operands])
+
+    elif isinstance(node, BinaryOperation):
+        operands = [optimize(operand) for operand in node.operands]
+        if not any(isinstance(operand, LazyObject) for operand in operands):
+            try:
+                return evaluate(type(node), operands)
+            except Exception:
+                pass
+        return rebuild(type(node), operands)
+
+    elif isinstance(node, UnaryOperation):
+        operand = optimize(node.operand)
+        if not isinstance(operand, LazyObject):
+            try:
+                return node.reducer(operand)
+            except Exception:
+                pass
+        return type(node)(operand)
+
+    elif isinstance(node, FilterableMixin) and node.query is not None:
+        return node.where(optimize(node.query))
+
+    elif isinstance(node, L):
+        return node.value
+
+    return node
+
+
+def evaluate(operation, operands):
+    if issubclass(operation, BooleanOperation):
+        return all(operation.reducer(a, b) for a, b in zip(operands, operands[1:]))
+    return reduce(operation.reducer, operands)
+
+
+def rebuild(operation, operands):
+    node = BinaryOperation.__new__(operation)
+    node.operands = operands
+    return node
+
+
+def negate(node):
+    """
+    Return the optimized negation of an already optimized `node`.
+    """
+    if not isinstance(node, LazyObject):
+        return not node
+
+    elif isinstance(node, Not):
+        return node.operand
+
+    elif isinstance(node, (And, Or)):
+        junction = Or if isinstance(node, And) else And
+        return optimize_junction(junction, [negate(operand) for operand in node.operands])
+
+    elif type(node) in INVERSES and len(node.operands) == 2:
+        return rebuild(INVERSES[type(node)], node.operands)
+
+    return Not(node)
+
+
+def optimize_junction(junction, operands):
+    """
+    Build an `And` or `Or` of optimized `operands`, dropping constants that
+    cannot change the result and collapsing to a constant when one decides
+    it, with the cheapest operands first, except that an operand that
+    can raise stays behind the operands preceding it.
+    """
+    absorbing = junction is Or
+    flattened = []
+    for operand in operands:
+        if isinstance(operand, junction):
+            flattened.extend(operand.operands)
+        elif isinstance(operand, LazyObject):
+            flattened.append(operand)
+        elif bool(operand) is absorbing:
+            return absorbing
+
+    if not flattened:
+        return not absorbing
+    elif len(flattened) == 1:
+        return flattened[0]
+
+    # Sorting is stable, so raising no earlier than the cost of every
+    # preceding operand keeps an operand that can raise behind them.
+    keys = []
+    for operand in flattened:
+        key = cost(operand)
+        if keys and can_raise(operand):
+            key = max(key, max(keys))
+        keys.append(key)
+    return rebuild(junction, [operand for _, operand in sorted(zip(keys, flattened), key=itemgetter(0))])
+
+
+def can_raise(node):
+    """
+    Whether evaluating `node` can raise for some objects, e.g. an item
+    lookup on an empty list, a call or a division by zero.
+    """
+    if isinstance(node, (Call, GetItem, TrueDiv, FloorDiv, Mod)):
+        return True
+
+    elif isinstance(node, A):
+        return can_raise(node.parent) or can_raise(node.arguments)
+
+    elif isinstance(node, BinaryOperation):
+        return any(map(can_raise, node.operands))
+
+    elif isinstance(node, UnaryOperation):
+        return can_raise(node.operand)
+
+    elif isinstance(node, FilterableMixin):
+        return can_raise(node.query)
+
+    return False
+
+
+def cost(node):
+    """
+    Estimate the relative cost of evaluating `node` once.
+    """
+    if isinstance(node, Call):
+        args, kwargs = node.arguments
+        return CALL_COST + cost(node.parent) + sum(map(cost, args)) + sum(map(cost, kwargs.values()))
+
+    elif isinstance(node, A):
+        return ATTRIBUTE_COST + cost(node.parent) + cost(node.arguments)
+
+    elif isinstance(node, BinaryOperation):
+        return 1 + sum(map(cost, node.operands))
+
+    elif isinstance(node, UnaryOperation):
+        return 1 + cost(node.operand)
+
+    elif isinstance(node, FilterableMixin):
+        return AGGREGATION_COST + cost(node.query)
+
+    return 0
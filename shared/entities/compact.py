@@ -0,0 +1,49 @@
+import sys
+
+from dataclasses import dataclass
+from typing import Tuple
+from uuid import UUID
+
+
+@dataclass(slots=True, weakref_slot=True)
+class CompactEntity:
+    """
+    An `Entity` without a per-instance `__dict__`. It keeps a `__weakref__`
+    slot for the identity map, which needs Python 3.11.
+    """
+    id: UUID
+
+
+@dataclass(frozen=True, slots=True)
+class CompactGiftcard:
+    value: int
+    reason: str
+
+    def __post_init__(self):
+        # Reasons come from a handful of values, so share one string for
+        # each instead of a copy per giftcard.
+        object.__setattr__(self, 'reason', sys.intern(self.reason))
+
+    def subtract(self, value):
+        if value > self.value:
+            raise ValueError('{} > {}'.format(value, self.value))
+        return type(self)(value=self.value - value, reason=self.reason)
+
+
+# The giftcards of every `CompactUser` without any.
+NO_GIFTCARDS: Tuple[CompactGiftcard, ...] = ()
+
+
+@dataclass(slots=True)
+class CompactUser(CompactEntity):
+    """
+    A `User` for holding millions in memory: giftcards are kept in a tuple,
+    shared by all users without any, instead of a list per user. Grant a
+    giftcard by replacing the tuple, e.g. `user.giftcards += (giftcard,)`.
+    """
+    name: str
+    points: int = 0
+    giftcards: Tuple[CompactGiftcard, ...] = NO_GIFTCARDS
+
+    def __post_init__(self):
+        self.giftcards = tuple(self.giftcards) or NO_GIFTCARDS
@@ -12,7 +12,7 @@ class Giftcard:
     def subtract(self, value):
         if value > self.value:
             raise ValueError('{} > {}'.format(value, self.value))
-        return type(self)(value=self.value - value)
+        return type(self)(value=self.value - value, reason=self.reason)
 
 
 @dataclass
@@ -0,0 +1,103 @@
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, Type
+from weakref import WeakValueDictionary
+
+
+class IdentityMap:
+    """
+    The domain entities mapped within a unit of work, by type and id, so
+    that a row loaded again maps to the entity already in use instead of
+    a copy of it. Entities are held weakly: one no longer referenced
+    anywhere else is dropped, so streaming a large result through the map
+    keeps memory bounded.
+
+    Like any identity map, it returns the entity as first mapped, ignoring
+    changes to the row loaded since. Use a fresh map for fresh state.
+    """
+
+    def __init__(self):
+        self._entities = WeakValueDictionary()
+
+    def get(self, type: Type, id, default=None):
+        return self._entities.get((type, id), default)
+
+    def add(self, type: Type, id, entity):
+        self._entities[(type, id)] = entity
+
+    def discard(self, type: Type, id):
+        self._entities.pop((type, id), None)
+
+    def clear(self):
+        self._entities.clear()
+
+    def __contains__(self, key):
+        return key in self._entities
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __repr__(self):
+        return '<{} ({} entities)>'.format(self.__class__.__name__, len(self))
+
+
+class DataEntityMapper:
+    """
+    Maps data entities, e.g. ORM rows, to domain entities of `entity_type`,
+    and back with `unmap` for writes. Subclasses implement `map`, and
+    `identify` when the domain id is not the row's `id`. Overriding
+    `map_batch` lets a mapper share work across a batch, e.g. one lookup
+    for all of its rows.
+    """
+
+    entity_type: Type = object
+
+    def identify(self, data_entity) -> Any:
+        return data_entity.id
+
+    def map(self, data_entity):
+        raise NotImplementedError
+
+    def unmap(self, entity) -> Any:
+        """
+        Return what to write for `entity`: a data entity, or a dict of its
+        column values including the primary key.
+        """
+        raise NotImplementedError
+
+    def map_batch(self, data_entities: List[Any]) -> List:
+        map = self.map
+        return [map(data_entity) for data_entity in data_entities]
+
+    def map_all(
+        self,
+        data_entities: Iterable,
+        identity_map: Optional[IdentityMap] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator:
+        """
+        Map `data_entities` lazily, `chunk_size` at a time, reusing the
+        entities already in `identity_map` and adding the others to it.
+        """
+        data_entities = iter(data_entities)
+        while True:
+            batch = list(islice(data_entities, chunk_size))
+            if not batch:
+                return
+            if identity_map is None:
+                yield from self.map_batch(batch)
+                continue
+
+            ids = [self.identify(data_entity) for data_entity in batch]
+            entities = [identity_map.get(self.entity_type, id) for id in ids]
+            # The first row of each id missing from the map, so that rows
+            # repeated within the batch map to a single entity.
+            missing = {}
+            for index, entity in enumerate(entities):
+                if entity is None:
+                    missing.setdefault(ids[index], index)
+            if missing:
+                mapped = dict(zip(missing, self.map_batch([batch[index] for index in missing.values()])))
+                for id, entity in mapped.items():
+                    identity_map.add(self.entity_type, id, entity)
+                entities = [mapped[id] if entity is None else entity for id, entity in zip(ids, entities)]
+            yield from entities
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+
+from concurrent.futures import CancelledError, Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from functools import partial
+from itertools import islice
+from typing import Any, Optional
+from weakref import WeakKeyDictionary
+
+from shared.querysets.memory import MemoryQuerySet
+
+_executor = None
+_session_locks = WeakKeyDictionary()
+
+
+def default_executor() -> Executor:
+    """
+    Return the thread pool shared by async querysets not given their own,
+    bounded so that a burst of queries cannot start a thread each.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='queryset')
+    return _executor
+
+
+class AsyncQuerySet:
+    """
+    Runs a synchronous queryset on a bounded executor, so that evaluating
+    it does not block the event loop. Building querysets is cheap and stays
+    synchronous, while evaluating them is awaited:
+
+        async for user in AsyncQuerySet(users).filter(A('points') > 100):
+            ...
+        count, first = await asyncio.gather(users.count(), users.first())
+
+    Iteration fetches `chunk_size` objects per executor call, streaming
+    SQL results with `iterator()`. Querysets sharing a SQLAlchemy session
+    run their executor calls one at a time, since sessions are not thread
+    safe. The session is free between chunks, so the body of an `async for`
+    can await other queries on it. Give querysets their own sessions to
+    evaluate them concurrently. SQLite connections must then allow use
+    from several threads.
+
+    Cancelling a task awaiting an evaluation stops it midway: a memory
+    scan stops within 1024 objects, and an iteration before its next chunk.
+    A single SQL statement, e.g. for `count()`, runs to completion.
+    """
+
+    def __init__(self, queryset, executor: Optional[Executor] = None, chunk_size: int = 1000):
+        self.queryset = queryset
+        self.executor = executor
+        self.chunk_size = chunk_size
+
+    def chain(self, queryset) -> 'AsyncQuerySet':
+        return type(self)(queryset, executor=self.executor, chunk_size=self.chunk_size)
+
+    def all(self):
+        return self
+
+    def filter(self, *queries):
+        return self.chain(self.queryset.filter(*queries))
+
+    def exclude(self, *queries):
+        return self.chain(self.queryset.exclude(*queries))
+
+    def order_by(self, *fields):
+        return self.chain(self.queryset.order_by(*fields))
+
+    def annotate(self, **annotations):
+        return self.chain(self.queryset.annotate(**annotations))
+
+    def values(self, *fields: str):
+        return self.chain(self.queryset.values(*fields))
+
+    def group_by(self, *fields: str, **aggregations):
+        return self.chain(self.queryset.group_by(*fields, **aggregations))
+
+    def limit(self, count):
+        return self[:count]
+
+    def offset(self, count):
+        return self[count:]
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self.run(lambda queryset: queryset[key])
+        return self.chain(self.queryset[key])
+
+    async def get(self, *queries):
+        return await self.run(lambda queryset: queryset.get(*queries))
+
+    async def first(self):
+        return await self.run(lambda queryset: queryset.first())
+
+    async def last(self):
+        return await self.run(lambda queryset: queryset.last())
+
+    async def exists(self):
+        return await self.run(lambda queryset: queryset.exists())
+
+    async def count(self):
+        return await self.run(lambda queryset: queryset.count())
+
+    async def aggregate(self, *aggregations, **named):
+        return await self.run(lambda queryset: queryset.aggregate(*aggregations, **named))
+
+    async def to_list(self):
+        return [object async for object in self]
+
+    async def run(self, function):
+        """
+        Call `function` with the queryset on the executor, and return its
+        result.
+        """
+        cancelled = threading.Event()
+        return await self.call(partial(function, self.checkpointed(cancelled)), cancelled)
+
+    async def __aiter__(self):
+        # The session is only locked during each executor call, so that the
+        # loop body can await other queries on the same session.
+        cancelled = threading.Event()
+        queryset = self.checkpointed(cancelled)
+        if hasattr(type(queryset), 'iterator'):
+            objects = await self.call(partial(queryset.iterator, chunk_size=self.chunk_size), cancelled)
+        else:
+            objects = await self.call(partial(iter, queryset), cancelled)
+        try:
+            while True:
+                chunk = await self.call(lambda: list(islice(objects, self.chunk_size)), cancelled)
+                if not chunk:
+                    return
+                for object in chunk:
+                    yield object
+        finally:
+            cancelled.set()
+            close = getattr(objects, 'close', None)
+            if close is not None:
+                await self.call(close, threading.Event())
+
+    def checkpointed(self, cancelled: threading.Event):
+        if not isinstance(self.queryset, MemoryQuerySet):
+            return self.queryset
+
+        def checkpoint():
+            if cancelled.is_set():
+                raise CancelledError
+        return replace(self.queryset, checkpoint=checkpoint)
+
+    async def call(self, function, cancelled: threading.Event) -> Any:
+        async with self.session_lock():
+            future = asyncio.get_running_loop().run_in_executor(self.executor or default_executor(), function)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Stop the call at its next checkpoint, and keep the session
+                # locked until it has.
+                cancelled.set()
+                await asyncio.wait([future])
+                raise
+
+    @asynccontextmanager
+    async def session_lock(self):
+        session = getattr(self.queryset, 'session', None)
+        if session is None:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        locks = _session_locks.setdefault(session, WeakKeyDictionary())
+        lock = locks.get(loop)
+        if lock is None:
+            lock = locks[loop] = asyncio.Lock()
+        async with lock:
+            yield
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.queryset)
@@ -1,2 +1,99 @@
 class QuerySet:
     pass
+
+
+class Annotated:
+    """
+    Wraps an object returned by an annotated queryset, exposing the
+    annotations as extra attributes (and items) alongside its own. Setting
+    an attribute other than an annotation sets it on the object, and the
+    wrapper passes for the object in `isinstance` checks and hashing.
+    """
+    __slots__ = ('_object', '_annotations')
+
+    def __init__(self, object, annotations):
+        super().__setattr__('_object', object)
+        super().__setattr__('_annotations', annotations)
+
+    @property
+    def __class__(self):
+        return type(self._object)
+
+    def __getattr__(self, name):
+        try:
+            return self._annotations[name]
+        except KeyError:
+            return getattr(self._object, name)
+
+    def __setattr__(self, name, value):
+        if name in self._annotations:
+            self._annotations[name] = value
+        else:
+            setattr(self._object, name, value)
+
+    def __delattr__(self, name):
+        if name in self._annotations:
+            del self._annotations[name]
+        else:
+            delattr(self._object, name)
+
+    def __getitem__(self, key):
+        try:
+            return self._annotations[key]
+        except (KeyError, TypeError):
+            return self._object[key]
+
+    def __eq__(self, other):
+        if isinstance(other, Annotated):
+            return self._object == other._object and self._annotations == other._annotations
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._object)
+
+    def __repr__(self):
+        return '{!r} + {!r}'.format(self._object, self._annotations)
+
+
+def single_aggregation(aggregations, named):
+    """
+    Validate the arguments of `aggregate`: either one aggregation, which is
+    returned so its result can be returned as is, or any number of named
+    aggregations, in which case None is returned.
+    """
+    if len(aggregations) == 1 and not named:
+        return aggregations[0]
+    elif aggregations or not named:
+        raise TypeError('aggregate() takes a single aggregation or named aggregations.')
+    return None
+
+
+def slice_bounds(key: slice):
+    """
+    Validate `key` and return it as a (start, stop) window, where `stop` is
+    None for an open-ended slice.
+    """
+    if key.step is not None:
+        raise ValueError('Slice steps are not supported.')
+    start = 0 if key.start is None else key.start
+    stop = key.stop
+    if start < 0 or (stop is not None and stop < 0):
+        raise ValueError('Negative indexing is not supported.')
+    if stop is not None:
+        stop = max(start, stop)
+    return start, stop
+
+
+def compose_slices(outer, inner):
+    """
+    Return the (start, stop) window equivalent to taking the `inner` window
+    of the result of taking the `outer` window.
+    """
+    start, stop = outer
+    inner_start, inner_stop = inner
+    new_start = start + inner_start
+    new_stop = None if inner_stop is None else start + inner_stop
+    if stop is not None:
+        new_start = min(new_start, stop)
+        new_stop = stop if new_stop is None else min(new_stop, stop)
+    return new_start, new_stop
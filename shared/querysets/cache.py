@@ -0,0 +1,135 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from shared.common_query import fingerprint
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'evictions', 'maxsize', 'currsize'))
+ResultCacheInfo = namedtuple('ResultCacheInfo', CacheInfo._fields + ('invalidations',))
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entry once it
+    holds more than `maxsize` entries, and counts hits, misses and evictions.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __reduce__(self):
+        # Compiled functions are closures, which cannot be pickled, so a
+        # copy sent to another process starts empty.
+        return type(self), (self.maxsize,)
+
+    def get_or_set(self, key, factory):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        return CacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            maxsize=self.maxsize,
+            currsize=len(self._entries),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+def cached_compile(cache, node, compile_node, context=()):
+    """
+    Look `node` up in `cache` by its fingerprint and `context`, whatever
+    else the compiled function depends on, e.g. the compiler's class and
+    `get_value`, since copies of a compiler share its cache. Queries
+    holding unhashable constants are compiled without being cached.
+    """
+    try:
+        key = (context, fingerprint(node))
+        hash(key)
+    except TypeError:
+        return compile_node(node)
+    return cache.get_or_set(key, lambda: compile_node(node))
+
+
+class ResultCache:
+    """
+    Caches evaluated results in an `LRUCache`, each entry stamped with the
+    version of the source it was computed from. An entry is recomputed,
+    and counted as an invalidation, once the source's version has moved on.
+    """
+
+    def __init__(self, maxsize=128):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = LRUCache(maxsize)
+        self._lock = Lock()
+
+    def get_or_set(self, key, version, factory):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            self.misses += 1
+            if entry is not None:
+                self.invalidations += 1
+        value = factory()
+        self._entries.set(key, (version, value))
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self):
+        entries = self._entries.info()
+        return ResultCacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=entries.evictions,
+            maxsize=entries.maxsize,
+            currsize=entries.currsize,
+            invalidations=self.invalidations,
+        )
+
+    def __len__(self):
+        return len(self._entries)
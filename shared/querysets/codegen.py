@@ -0,0 +1,135 @@
+import keyword
+import linecache
+
+from dataclasses import dataclass
+from itertools import count
+from weakref import finalize
+
+from shared.common_query import (
+    A,
+    And,
+    ArithmeticOperation,
+    BinaryOperation,
+    Eq,
+    Ge,
+    GetAttr,
+    GetItem,
+    Gt,
+    L,
+    LazyObject,
+    Le,
+    Lt,
+    Ne,
+    Neg,
+    Not,
+    Or,
+)
+from shared.querysets.memory import LambdaCompiler
+
+COMPARISON_OPERATORS = {
+    Eq: '==',
+    Ne: '!=',
+    Gt: '>',
+    Ge: '>=',
+    Lt: '<',
+    Le: '<=',
+}
+
+BOOLEAN_OPERATORS = {
+    And: 'and',
+    Or: 'or',
+}
+
+INLINE_CONSTANT_TYPES = (bool, int, str, type(None))
+
+_filenames = count()
+
+
+@dataclass(frozen=True)
+class CodegenCompiler(LambdaCompiler):
+    """
+    Compiles a query into the source of a single Python function, so that
+    e.g. `(A('points') >= 1000) & ~Has('giftcards')` evaluates as the
+    straight-line expression `o.points >= 1000 and not _f0(o)`. Nodes that
+    cannot be inlined, such as calls and aggregations, are compiled by
+    `LambdaCompiler` and called from the generated code.
+
+    The source is registered with `linecache` for tracebacks, for as long
+    as the compiled function lives, e.g. until the compile cache evicts it.
+    """
+
+    def compile_node(self, node):
+        namespace = {'_get_value': self.get_value}
+        source = 'def compiled(o):\n    return {}\n'.format(self.generate(node, namespace))
+        filename = '<common_query-{}>'.format(next(_filenames))
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        exec(compile(source, filename, 'exec'), namespace)
+        # Popped, since the function referring to itself through its globals
+        # would keep it alive until the next garbage collection.
+        compiled = namespace.pop('compiled')
+        compiled.source = source
+        finalize(compiled, linecache.cache.pop, filename, None)
+        return compiled
+
+    def generate(self, node, namespace):
+        """
+        Return a Python expression evaluating `node` against the item `o`,
+        binding any values it refers to into `namespace`.
+        """
+        if not isinstance(node, LazyObject):
+            return self.generate_constant(node, namespace)
+
+        elif isinstance(node, L):
+            return self.generate_constant(node.value, namespace)
+
+        elif isinstance(node, GetAttr):
+            parent = self.generate(node.parent, namespace)
+            if self.is_identifier(node.arguments):
+                return '{}.{}'.format(parent, node.arguments)
+            return 'getattr({}, {})'.format(parent, self.generate(node.arguments, namespace))
+
+        elif isinstance(node, GetItem):
+            return '{}[{}]'.format(
+                self.generate(node.parent, namespace),
+                self.generate(node.arguments, namespace),
+            )
+
+        elif type(node) is A:
+            if self.get_value is getattr and self.is_identifier(node.arguments):
+                return 'o.{}'.format(node.arguments)
+            return '_get_value(o, {})'.format(self.generate(node.arguments, namespace))
+
+        elif type(node) in COMPARISON_OPERATORS:
+            operator = ' {} '.format(COMPARISON_OPERATORS[type(node)])
+            return '({})'.format(operator.join(self.generate(operand, namespace) for operand in node.operands))
+
+        elif type(node) in BOOLEAN_OPERATORS:
+            operator = ' {} '.format(BOOLEAN_OPERATORS[type(node)])
+            return '({})'.format(operator.join(self.generate(operand, namespace) for operand in node.operands))
+
+        elif isinstance(node, ArithmeticOperation) and isinstance(node, BinaryOperation):
+            first, *rest = [self.generate(operand, namespace) for operand in node.operands]
+            for operand in rest:
+                first = '({} {} {})'.format(first, node.op, operand)
+            return first
+
+        elif type(node) is Not:
+            return '(not {})'.format(self.generate(node.operand, namespace))
+
+        elif type(node) is Neg:
+            return '(-{})'.format(self.generate(node.operand, namespace))
+
+        name = '_f{}'.format(len(namespace))
+        namespace[name] = super().compile_node(node)
+        return '{}(o)'.format(name)
+
+    def generate_constant(self, value, namespace):
+        if type(value) in INLINE_CONSTANT_TYPES:
+            return repr(value)
+        name = '_c{}'.format(len(namespace))
+        namespace[name] = value
+        return name
+
+    @staticmethod
+    def is_identifier(name):
+        return isinstance(name, str) and name.isidentifier() and not keyword.iskeyword(name)
@@ -0,0 +1,498 @@
+import operator
+
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from shared.common_query import A, And, BinaryOperation, BooleanOperation, L, LazyObject, Neg, Not, Or
+from shared.common_query.aggregations import Aggregation, Count, Has, Mean, Median, Sum
+from shared.common_query.optimizer import optimize
+from shared.querysets.base import QuerySet, compose_slices, single_aggregation, slice_bounds
+from shared.querysets.cache import LRUCache, cached_compile
+from shared.querysets.memory import LambdaCompiler, MemoryQuerySet
+from shared.querysets.stores import field_name
+
+
+def as_column(values):
+    """
+    Store numbers, booleans and strings as native NumPy arrays and anything
+    else, e.g. decimals, None, mixed types or integers beyond 64 bits, as
+    an object array holding the original Python values, so that comparisons
+    behave exactly as they do on rows.
+    """
+    values = list(values)
+    types = set(map(type, values))
+    if types <= {bool, int} or types == {float} or types == {str}:
+        column = np.array(values)
+        if column.dtype.kind in 'bifU':
+            return column
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def as_mask(values, size):
+    """
+    Return the truthiness of `values` as a boolean array, as `bool` would
+    judge each of them.
+    """
+    if np.ndim(values) == 0:
+        return np.full(size, bool(values))
+    values = np.asarray(values)
+    if values.dtype.kind == 'U':
+        return values != ''
+    elif values.dtype == object:
+        return np.fromiter(map(bool, values), dtype=bool, count=len(values))
+    return values.astype(bool)
+
+
+def short_circuit(operands, table, conjunction):
+    """
+    Return the mask of the rows of `table` passing all `operands` if
+    `conjunction`, or any of them otherwise. Like `and` and `or`, each
+    operand is only evaluated over the rows the previous ones left
+    undecided, so that e.g. `(A('stock') > 0) & (A('id') // A('stock') > 1)`
+    does not divide by zero.
+    """
+    mask = np.full(len(table), conjunction)
+    undecided = np.arange(len(table))
+    for operand in operands:
+        if not len(undecided):
+            break
+        subtable = table if len(undecided) == len(table) else Table(table.queryset, table.indices[undecided])
+        decided = as_mask(operand(subtable), len(subtable)) != conjunction
+        mask[undecided[decided]] = not conjunction
+        undecided = undecided[~decided]
+    return mask
+
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def integer_magnitude(value):
+    """
+    Return the largest absolute value in an integer array or scalar, or
+    None for any other value.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind != 'i':
+            return None
+        return max(-int(value.min()), int(value.max())) if len(value) else 0
+    elif isinstance(value, (int, np.integer)):
+        return abs(int(value))
+    return None
+
+
+def overflows(reducer, values):
+    """
+    Tell whether applying `reducer` to integer `values` with NumPy could
+    leave the 64-bit range, judging by their largest magnitudes, or, for a
+    true division, round differently from Python's exact one.
+    """
+    magnitudes = [integer_magnitude(value) for value in values]
+    if None in magnitudes:
+        return False
+    elif reducer is operator.truediv:
+        return max(magnitudes) > 2 ** 53
+    bound, *rest = magnitudes
+    for magnitude in rest:
+        if reducer in (operator.add, operator.sub):
+            bound += magnitude
+        elif reducer is operator.mul:
+            bound *= magnitude
+        elif reducer is operator.mod:
+            bound = magnitude
+        elif reducer is operator.pow:
+            bound = bound ** magnitude if bound <= 1 or magnitude < 64 else INT64_MAX + 1
+        elif reducer is not operator.floordiv:
+            return True
+    return bound > INT64_MAX
+
+
+class Table:
+    """
+    The rows of a `ColumnarQuerySet` selected by `indices`, gathering each
+    column the first time an expression reads it.
+    """
+
+    def __init__(self, queryset, indices):
+        self.queryset = queryset
+        self.indices = indices
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def column(self, name):
+        try:
+            return self._columns[name]
+        except KeyError:
+            column = self._columns[name] = self.queryset.columns[name][self.indices]
+            return column
+
+    def objects(self):
+        return [self.queryset.get_object(index) for index in self.indices]
+
+
+@dataclass(frozen=True)
+class VectorCompiler:
+    """
+    Compiles a query into a callable evaluating it over a whole `Table` at
+    once, as NumPy array operations. Nodes that cannot be vectorized, such
+    as attribute chains, calls and aggregations, or operations NumPy would
+    evaluate differently from Python (e.g. integer division by zero), are
+    evaluated row by row with `LambdaCompiler` instead. So is integer
+    arithmetic that could overflow 64 bits, where Python's integers would
+    not. `&` and `|` short-circuit row by row like the row engine.
+    """
+    get_value: Callable[[Any, str], Any] = field(default=getattr)
+    cache: LRUCache = field(default_factory=LRUCache, compare=False, repr=False)
+
+    def compile(self, node):
+        return cached_compile(
+            self.cache,
+            node,
+            lambda node: self.compile_node(optimize(node)),
+            (type(self), self.get_value),
+        )
+
+    def compile_node(self, node):
+        if not isinstance(node, LazyObject):
+            return lambda table: node
+
+        elif isinstance(node, L):
+            value = node.value
+            return lambda table: value
+
+        elif type(node) is A and field_name(node) is not None:
+            name = field_name(node)
+            fallback = self.fallback(node)
+            return lambda table: table.column(name) if name in table.queryset.columns else fallback(table)
+
+        elif isinstance(node, (And, Or)):
+            operands = [self.compile_node(operand) for operand in node.operands]
+            conjunction = isinstance(node, And)
+            return lambda table: short_circuit(operands, table, conjunction)
+
+        elif isinstance(node, Not):
+            operand = self.compile_node(node.operand)
+            return lambda table: ~as_mask(operand(table), len(table))
+
+        elif isinstance(node, (BinaryOperation, Neg)):
+            fallback = self.fallback(node)
+            if isinstance(node, Neg):
+                operands = [self.compile_node(node.operand)]
+            else:
+                operands = [self.compile_node(operand) for operand in node.operands]
+            reducer = node.reducer
+            boolean = isinstance(node, BooleanOperation)
+
+            def compiled_Operation(table):
+                values = [operand(table) for operand in operands]
+                if not boolean:
+                    # NumPy adds booleans as a logical or, Python as integers.
+                    values = [
+                        value.astype(int) if isinstance(value, np.ndarray) and value.dtype.kind == 'b' else value
+                        for value
+                        in values
+                    ]
+                    if overflows(reducer, values):
+                        return fallback(table)
+                try:
+                    with np.errstate(all='raise'):
+                        if len(values) == 1:
+                            return reducer(values[0])
+                        elif boolean:
+                            return np.logical_and.reduce([
+                                as_mask(reducer(left, right), len(table))
+                                for left, right
+                                in zip(values, values[1:])
+                            ])
+                        result = values[0]
+                        for value in values[1:]:
+                            result = reducer(result, value)
+                        return result
+                except (ArithmeticError, FloatingPointError, TypeError, ValueError):
+                    return fallback(table)
+            return compiled_Operation
+
+        return self.fallback(node)
+
+    def fallback(self, node):
+        compiled = LambdaCompiler(get_value=self.get_value).compile(node)
+
+        def compiled_Fallback(table):
+            return as_column([compiled(object) for object in table.objects()])
+        return compiled_Fallback
+
+
+@dataclass(frozen=True)
+class FilterPipe:
+    predicates: Sequence[Callable]
+
+    def __call__(self, table):
+        indices = table.indices
+        for predicate in self.predicates:
+            indices = indices[as_mask(predicate(table), len(table))]
+            table = Table(table.queryset, indices)
+        return indices
+
+
+@dataclass(frozen=True)
+class ExcludePipe:
+    predicates: Sequence[Callable]
+
+    def __call__(self, table):
+        if not self.predicates:
+            return table.indices[:0]
+        return table.indices[~short_circuit(self.predicates, table, True)]
+
+
+@dataclass(frozen=True)
+class OrderByPipe:
+    """
+    Sorts stably like `MemoryQuerySet.order_by`, with one `np.lexsort` over
+    all keys. Descending keys are negated, except those that cannot be,
+    e.g. strings, which are replaced by their negated dense ranks first.
+    With a `limit`, only the rows whose first key can rank within the first
+    `limit` rows, found with `np.partition`, are sorted.
+    """
+    keys: Sequence[Tuple[Callable, bool]]
+    limit: Optional[int] = None
+
+    def __call__(self, table):
+        indices = table.indices
+        columns = []
+        for key, reverse in self.keys:
+            values = key(table)
+            if np.ndim(values) == 0:
+                continue
+            if reverse and (values.dtype.kind == 'f' or values.dtype.kind == 'i' and -INT64_MAX <= values.min(initial=0)):
+                values = -values
+            elif reverse or values.dtype == object:
+                _, ranks = np.unique(values, return_inverse=True)
+                values = -ranks if reverse else ranks
+            columns.append(values)
+        if not columns:
+            return indices
+
+        if self.limit is not None and self.limit < len(indices):
+            if self.limit == 0:
+                return indices[:0]
+            first = columns[0]
+            candidates = first <= np.partition(first, self.limit - 1)[self.limit - 1]
+            indices = indices[candidates]
+            columns = [values[candidates] for values in columns]
+        return indices[np.lexsort(columns[::-1])]
+
+
+@dataclass(frozen=True)
+class SlicePipe:
+    start: int = 0
+    stop: Optional[int] = None
+
+    def __call__(self, table):
+        return table.indices[self.start:self.stop]
+
+
+@dataclass(frozen=True)
+class ColumnarQuerySet(QuerySet):
+    """
+    A queryset over entity fields stored as NumPy arrays, exposing the same
+    API as `MemoryQuerySet`. Build one with `from_objects`, which keeps the
+    objects around so that iterating yields them and fields without a
+    column can still be read row by row.
+    """
+    columns: Dict[str, np.ndarray]
+    objects: Optional[Sequence] = field(default=None)
+    compiler: VectorCompiler = field(default_factory=VectorCompiler)
+    pipeline: List[Callable] = field(default_factory=list)
+
+    class MultipleObjectsReturned(Exception):
+        message = 'Multiple objects returned'
+
+    class ObjectDoesNotExist(Exception):
+        message = 'Object does not exist'
+
+    @classmethod
+    def from_objects(cls, objects: Iterable, fields: Iterable[str], **kwargs):
+        objects = list(objects)
+        compiler = kwargs.get('compiler') or VectorCompiler()
+        columns = {
+            name: as_column(compiler.get_value(object, name) for object in objects)
+            for name
+            in fields
+        }
+        return cls(columns=columns, objects=objects, **kwargs)
+
+    def __len__(self):
+        return self.count()
+
+    def all(self):
+        return self
+
+    def filter(self, *queries):
+        queries = [query for query in queries if query is not None]
+        return self.pipe(FilterPipe([self.compiler.compile(query) for query in queries]))
+
+    def exclude(self, *queries):
+        queries = [query for query in queries if query is not None]
+        return self.pipe(ExcludePipe([self.compiler.compile(query) for query in queries]))
+
+    def order_by(self, *fields):
+        return self.pipe(OrderByPipe([
+            (self.compiler.compile(field.operand), True)
+            if isinstance(field, Neg)
+            else (self.compiler.compile(field), False)
+            for field
+            in fields
+        ]))
+
+    def pipe(self, pipe):
+        return replace(self, pipeline=self.pipeline + [pipe])
+
+    def limit(self, count):
+        return self[:count]
+
+    def offset(self, count):
+        return self[count:]
+
+    def get_object(self, index):
+        if self.objects is not None:
+            return self.objects[index]
+        return {name: python_value(column[index]) for name, column in self.columns.items()}
+
+    def get_indices(self):
+        size = len(next(iter(self.columns.values()))) if self.columns else len(self.objects or ())
+        indices = np.arange(size)
+        for pipe in self.pipeline:
+            indices = pipe(Table(self, indices))
+        return indices
+
+    def get(self, *queries):
+        objects = list(self.filter(*queries)[:2])
+        if len(objects) > 1:
+            raise self.MultipleObjectsReturned
+        elif not objects:
+            raise self.ObjectDoesNotExist
+        return objects[0]
+
+    def first(self):
+        return next(iter(self[:1]), None)
+
+    def last(self):
+        objects = deque(self, maxlen=1)
+        return objects[0] if objects else None
+
+    def exists(self):
+        return self.count() > 0
+
+    def count(self):
+        return len(self.get_indices())
+
+    def aggregate(self, *aggregations: Aggregation, **named: Aggregation):
+        """
+        Return the result of a single aggregation, or a dict of the results
+        of named aggregations, all over one evaluation of the pipeline.
+        """
+        aggregation = single_aggregation(aggregations, named)
+        indices = self.get_indices()
+        if aggregation is not None:
+            return self.reduce(aggregation, indices)
+        return {name: self.reduce(aggregation, indices) for name, aggregation in named.items()}
+
+    def reduce(self, aggregation: Aggregation, indices):
+        """
+        Reduce the rows at `indices` with `aggregation`. `Count`, `Has`,
+        `Sum`, `Mean` and `Median` over a column are computed as array
+        reductions giving the same results as the row engine; anything
+        else, e.g. a stable `Mean`, falls back to the aggregation's own
+        reducer over the objects. A `where` query narrows the rows first.
+        """
+        if aggregation.query is not None:
+            indices = FilterPipe([self.compiler.compile(aggregation.query)])(Table(self, indices))
+        if isinstance(aggregation, Count):
+            return len(indices)
+        elif isinstance(aggregation, Has):
+            return any(self.get_object(index) for index in indices.tolist())
+        elif (
+            aggregation.field not in self.columns
+            or not isinstance(aggregation, (Sum, Mean, Median))
+            or isinstance(aggregation, Mean) and aggregation.stable
+        ):
+            objects = [self.get_object(index) for index in indices.tolist()]
+            return aggregation.reducer(MemoryQuerySet(
+                get_objects=lambda: objects,
+                compiler=LambdaCompiler(get_value=self.compiler.get_value),
+            ))
+
+        values = self.columns[aggregation.field][indices]
+        if isinstance(aggregation, Sum):
+            return column_sum(values)
+        elif isinstance(aggregation, Mean):
+            return column_sum(values) / len(values) if len(values) else None
+        return column_median(values)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                raise ValueError('Negative indexing is not supported.')
+            for object in self[key:key + 1]:
+                return object
+            raise IndexError('{} index out of range'.format(self.__class__.__name__))
+
+        window = slice_bounds(key)
+        pipeline = list(self.pipeline)
+        if pipeline and isinstance(pipeline[-1], SlicePipe):
+            previous = pipeline.pop()
+            window = compose_slices((previous.start, previous.stop), window)
+        if pipeline and isinstance(pipeline[-1], OrderByPipe) and window[1] is not None:
+            pipeline[-1] = replace(pipeline[-1], limit=window[1])
+        return replace(self, pipeline=pipeline + [SlicePipe(*window)])
+
+    def __iter__(self):
+        return (self.get_object(index) for index in self.get_indices().tolist())
+
+    def __repr__(self):
+        objects = list(self[:4])
+        return '<{} [{}]>'.format(
+            self.__class__.__name__,
+            ', '.join(
+                repr(object)
+                for object
+                in objects[0:3]
+            ) + (', ...' if len(objects) > 3 else '')
+        )
+
+
+def python_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def column_sum(values):
+    """
+    Sum `values` to the same result as the builtin `sum` over the rows:
+    integers natively unless the total could overflow 64 bits, anything
+    else, floats included, with `sum` itself, since its rounding differs
+    from NumPy's pairwise summation.
+    """
+    if values.dtype.kind == 'b' or values.dtype.kind == 'i' and integer_magnitude(values) * len(values) <= INT64_MAX:
+        return python_value(values.sum())
+    return sum(values.tolist())
+
+
+def column_median(values):
+    length = len(values)
+    if length == 0:
+        return None
+    middle = length // 2
+    if values.dtype == object:
+        values = np.array(sorted(values.tolist()), dtype=object)
+    else:
+        values = np.partition(values, [middle - 1, middle] if length % 2 == 0 else [middle])
+    if length % 2 == 0:
+        right, left = python_value(values[middle]), python_value(values[middle - 1])
+        return sum([right, left]) / 2
+    return python_value(values[middle])
@@ -1,10 +1,17 @@
-from dataclasses import dataclass, field
-from functools import reduce
-from itertools import islice, tee
-from typing import Callable, Any, Iterable, List
+import heapq
+
+from collections import deque
+from concurrent.futures import Executor
+from copy import copy
+from dataclasses import dataclass, field, fields, replace
+from functools import partial
+from itertools import filterfalse, islice, repeat, takewhile
+from operator import attrgetter, getitem
+from typing import Callable, Any, Dict, Iterable, List, Optional, Tuple
 
 from shared.common_query import (
     A,
+    And,
     BinaryOperation,
     BooleanOperation,
     Call,
@@ -13,7 +20,9 @@ from shared.common_query import (
     L,
     LazyObject,
     Neg,
+    Or,
     UnaryOperation,
+    fingerprint,
 )
 from shared.common_query.aggregations import (
     Aggregation,
@@ -22,12 +31,13 @@ from shared.common_query.aggregations import (
     Has,
     Mean,
     Collect,
+    chunks,
 )
-from shared.querysets.base import QuerySet
-
-
-def nwise(xs, n=2):
-    return zip(*(islice(xs, idx, None) for idx, xs in enumerate(tee(xs, n))))
+from shared.common_query.optimizer import optimize
+from shared.querysets.base import Annotated, QuerySet, compose_slices, single_aggregation, slice_bounds
+from shared.querysets.cache import LRUCache, ResultCache, cached_compile
+from shared.querysets.parallel import aggregate_partition, match_partition, ordered_map, partitions
+from shared.querysets.stores import MemoryStore, field_name
 
 
 def isiterable(obj):
@@ -41,76 +51,364 @@ def isiterable(obj):
 @dataclass(frozen=True)
 class LambdaCompiler:
     get_value: Callable[[Any, str], Any] = field(default=getattr)
+    cache: LRUCache = field(default_factory=LRUCache, compare=False, repr=False)
 
     def compile(self, node):
+        return cached_compile(
+            self.cache,
+            node,
+            lambda node: self.compile_node(optimize(node)),
+            (type(self), self.get_value),
+        )
+
+    def compile_node(self, node):
+        """
+        Compile `node` into a callable taking a single item. Children are
+        compiled exactly once, up front, so evaluating the returned callable
+        does no compilation work of its own.
+        """
         if isinstance(node, A):
             if isinstance(node, GetAttr):
-                return lambda item: getattr(
-                    self.compile(node.parent)(item),
-                    self.compile(node.arguments)(item)
-                )
+                parent = self.compile_node(node.parent)
+                if not isinstance(node.arguments, LazyObject):
+                    name = node.arguments
+                    return lambda item: getattr(parent(item), name)
+                arguments = self.compile_node(node.arguments)
+                return lambda item: getattr(parent(item), arguments(item))
 
             elif isinstance(node, Call):
+                parent = self.compile_node(node.parent)
                 args, kwargs = node.arguments
-                return lambda item: self.compile(node.parent)(item)(
-                    *[(self.compile(arg)(item)) for arg in args],
-                    **{
-                        kw: (self.compile(arg)(item))
-                        for kw, arg
-                        in kwargs.items()
-                    }
+                args = [self.compile_node(arg) for arg in args]
+                kwargs = [(kw, self.compile_node(arg)) for kw, arg in kwargs.items()]
+                return lambda item: parent(item)(
+                    *[arg(item) for arg in args],
+                    **{kw: arg(item) for kw, arg in kwargs}
                 )
 
             elif isinstance(node, GetItem):
-                return lambda item: self.compile(node.parent)(item)[
-                    self.compile(node.arguments)(item)
-                ]
-
-            elif isinstance(node, L):
-                return lambda item: node.value
-
-            return lambda item: self.get_value(
-                item,
-                self.compile(node.arguments)(item)
-            )
+                parent = self.compile_node(node.parent)
+                if not isinstance(node.arguments, LazyObject):
+                    key = node.arguments
+                    return lambda item: parent(item)[key]
+                arguments = self.compile_node(node.arguments)
+                return lambda item: parent(item)[arguments(item)]
+
+            if not isinstance(node.arguments, LazyObject):
+                name = node.arguments
+                if self.get_value is getattr and isinstance(name, str) and '.' not in name:
+                    return attrgetter(name)
+                get_value = self.get_value
+                return lambda item: get_value(item, name)
+            arguments = self.compile_node(node.arguments)
+            get_value = self.get_value
+            return lambda item: get_value(item, arguments(item))
+
+        elif isinstance(node, L):
+            value = node.value
+            return lambda item: value
+
+        elif isinstance(node, (And, Or)):
+            operands = [self.compile_node(operand) for operand in node.operands]
+            if len(operands) == 2:
+                left, right = operands
+                if isinstance(node, And):
+                    return lambda item: left(item) and right(item)
+                return lambda item: left(item) or right(item)
+
+            if isinstance(node, And):
+                return lambda item: all(operand(item) for operand in operands)
+            return lambda item: any(operand(item) for operand in operands)
 
         elif isinstance(node, BinaryOperation):
-            if isinstance(node, BooleanOperation):
-                return lambda item: all(
-                    node.reducer(
-                        (self.compile(a)(item)),
-                        (self.compile(b)(item))
-                    )
-                    for a, b
-                    in nwise(node.operands)
-                )
+            reducer = node.reducer
+            operands = node.operands
+
+            if len(operands) == 2:
+                left, right = operands
+                if not isinstance(right, LazyObject):
+                    left = self.compile_node(left)
+                    return lambda item: reducer(left(item), right)
+                elif not isinstance(left, LazyObject):
+                    right = self.compile_node(right)
+                    return lambda item: reducer(left, right(item))
+                left, right = self.compile_node(left), self.compile_node(right)
+                return lambda item: reducer(left(item), right(item))
+
+            first, *rest = [self.compile_node(operand) for operand in operands]
 
-            return lambda item: reduce(
-                node.reducer,
-                [
-                    (self.compile(operand)(item))
-                    for operand
-                    in node.operands
-                ]
-            )
+            if isinstance(node, BooleanOperation):
+                def compiled_BooleanOperation(item):
+                    left = first(item)
+                    for operand in rest:
+                        right = operand(item)
+                        if not reducer(left, right):
+                            return False
+                        left = right
+                    return True
+                return compiled_BooleanOperation
+
+            def compiled_BinaryOperation(item):
+                result = first(item)
+                for operand in rest:
+                    result = reducer(result, operand(item))
+                return result
+            return compiled_BinaryOperation
 
         elif isinstance(node, UnaryOperation):
-            return lambda item: node.reducer(self.compile(node.operand)(item))
+            reducer = node.reducer
+            operand = self.compile_node(node.operand)
+            return lambda item: reducer(operand(item))
 
         elif isinstance(node, Aggregation):
+            reducer = node.reducer
+            name = node.field
+            if isinstance(name, str) and '.' in name:
+                # Aggregate a field of the objects in a collection, e.g.
+                # Sum('items.quantity').
+                name, _, nested = name.partition('.')
+                reducer = copy(node)
+                reducer.field = nested
+                reducer = reducer.reducer
+            get_value = self.get_value
+            queryset = MemoryQuerySet(compiler=self).filter(node.query)
+
             def compiled_Aggregation(context):
                 if isinstance(context, MemoryQuerySet):
-                    return node.reducer(context)
-                return node.reducer(
-                    MemoryQuerySet(
-                        get_objects=lambda: self.get_value(context, node.field),
+                    return reducer(context if node.query is None else context.filter(node.query))
+                return reducer(
+                    type(queryset)(
+                        get_objects=lambda: get_value(context, name),
                         compiler=self,
-                    ).filter(node.query)
+                        pipeline=queryset.pipeline,
+                    )
                 )
             return compiled_Aggregation
 
+        elif isinstance(node, LazyObject):
+            raise TypeError('Cannot compile {!r}'.format(node))
+
+        return lambda item: node
+
+
+def conjunction(queries):
+    """
+    Combine `queries` into the single query that matches when all of them
+    do, or None if there are none.
+    """
+    if not queries:
+        return None
+    elif len(queries) == 1:
+        return queries[0]
+    return And(*queries)
+
+
+@dataclass(frozen=True)
+class FilterPipe:
+    """
+    Lazily keeps the objects matching every one of `queries`.
+    """
+    queries: Tuple[Any, ...]
+    predicate: Optional[Callable[[Any], Any]] = field(default=None, compare=False, repr=False)
+    # The compiler the predicate was built with, for workers to rebuild it.
+    compiler: Optional[LambdaCompiler] = field(default=None, compare=False, repr=False)
+
+    def __call__(self, objects):
+        if self.predicate is None:
+            return iter(objects)
+        return filter(self.predicate, objects)
+
+
+@dataclass(frozen=True)
+class ExcludePipe:
+    """
+    Lazily drops the objects matching every one of `queries`.
+    """
+    queries: Tuple[Any, ...]
+    predicate: Optional[Callable[[Any], Any]] = field(default=None, compare=False, repr=False)
+    # The compiler the predicate was built with, for workers to rebuild it.
+    compiler: Optional[LambdaCompiler] = field(default=None, compare=False, repr=False)
+
+    def __call__(self, objects):
+        if self.predicate is None:
+            return iter(())
+        return filterfalse(self.predicate, objects)
+
+
+class Descending:
+    """
+    Wraps a sort key so that it orders in reverse, for any comparable type.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def composite_key(keys):
+    """
+    Combine (key, reverse) pairs into a single key function and a reverse
+    flag, suitable for one call to `sorted` or `heapq.nsmallest`.
+    """
+    if len(keys) == 1:
+        return keys[0]
+
+    functions = tuple(key for key, _ in keys)
+    directions = {reverse for _, reverse in keys}
+    if len(directions) == 1:
+        return (lambda object: tuple(key(object) for key in functions)), directions.pop()
+
+    def key(object):
+        return tuple(
+            Descending(function(object)) if reverse else function(object)
+            for function, reverse
+            in keys
+        )
+    return key, False
+
+
+@dataclass(frozen=True)
+class OrderByPipe:
+    """
+    Sorts the objects by `fields`, wrapping a field in `Neg` to sort it in
+    descending order. This is the only blocking pipe: it has to buffer every
+    object before it can yield the first one. When only the first `limit`
+    objects are needed, they are selected with a bounded heap instead.
+    """
+    fields: Tuple[Any, ...]
+    keys: Tuple[Tuple[Callable[[Any], Any], bool], ...] = field(compare=False, repr=False)
+    limit: Optional[int] = None
+
+    def __call__(self, objects):
+        if self.limit is not None:
+            key, reverse = composite_key(self.keys)
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            return iter(select(self.limit, objects, key=key))
+
+        # Each key was compiled once, in order_by. One stable sort per key,
+        # least significant first, beats a single sort on a composite tuple
+        # key here: sorting plain values lets list.sort use its specialised
+        # comparisons and reuse the runs left by the previous pass.
+        objects = list(objects)
+        for key, reverse in reversed(self.keys):
+            objects.sort(key=key, reverse=reverse)
+        return iter(objects)
+
+
+@dataclass(frozen=True)
+class SlicePipe:
+    start: int = 0
+    stop: Optional[int] = None
+
+    def __call__(self, objects):
+        return islice(objects, self.start, self.stop)
+
+
+@dataclass(frozen=True)
+class AnnotatePipe:
+    annotations: Dict[str, Any]
+    functions: Dict[str, Callable[[Any], Any]] = field(compare=False, repr=False)
+
+    def __call__(self, objects):
+        functions = list(self.functions.items())
+        return (
+            Annotated(object, {name: function(object) for name, function in functions})
+            for object
+            in objects
+        )
+
+
+@dataclass(frozen=True)
+class ValuesPipe:
+    fields: Tuple[str, ...]
+    get_value: Callable[[Any, str], Any] = field(default=getattr, repr=False)
+
+    def __call__(self, objects):
+        fields, get_value = self.fields, self.get_value
+        return ({name: get_value(object, name) for name in fields} for object in objects)
+
+
+@dataclass(frozen=True)
+class GroupByPipe:
+    """
+    Hash aggregation: streams the objects once, keeping one accumulator per
+    aggregation and group, and yields a dict per group, in order of first
+    appearance, with the group's fields and the aggregation results. Memory
+    use grows with the number of groups rather than of objects, except for
+    aggregations that must keep their values, like `Median`.
+    """
+    fields: Tuple[str, ...]
+    aggregations: Dict[str, Aggregation]
+    compiler: LambdaCompiler = field(default_factory=LambdaCompiler, repr=False)
+    # Objects are bucketed by group a chunk at a time, so that each
+    # accumulator is updated once per group and chunk. Large chunks keep
+    # that overhead low when there are many groups.
+    chunk_size: int = 8192
+
+    def __call__(self, objects):
+        fields, get_value = self.fields, self.compiler.get_value
+        if get_value is getattr and len(fields) > 1:
+            key = attrgetter(*fields)
         else:
-            return lambda item: node if not isinstance(node, LazyObject) else self.compile(node)(item)
+            def key(object):
+                return tuple(get_value(object, name) for name in fields)
+
+        groups = {}
+        for chunk in chunks(objects, self.chunk_size):
+            buckets = {}
+            for object in chunk:
+                values = key(object)
+                try:
+                    buckets[values].append(object)
+                except KeyError:
+                    buckets[values] = [object]
+
+            for values, bucket in buckets.items():
+                try:
+                    accumulators = groups[values]
+                except KeyError:
+                    accumulators = groups[values] = [
+                        (name, aggregation.accumulator(self.compiler))
+                        for name, aggregation
+                        in self.aggregations.items()
+                    ]
+                for _, accumulator in accumulators:
+                    accumulator.update(bucket)
+
+        for values, accumulators in groups.items():
+            row = dict(zip(fields, values))
+            row.update((name, accumulator.result()) for name, accumulator in accumulators)
+            yield row
+
+
+def checkpointed(objects, checkpoint, size=1024):
+    """
+    Call `checkpoint` before every `size` objects, so that it can stop a
+    scan midway by raising.
+    """
+    for chunk in chunks(objects, size):
+        checkpoint()
+        yield from chunk
+
+
+def pipe_key(pipe):
+    """
+    Return a hashable key for a pipe, built from the fields it compares
+    on, i.e. the queries it was created from rather than their compiled
+    functions.
+    """
+    return (type(pipe),) + tuple(
+        fingerprint(getattr(pipe, attribute.name))
+        for attribute
+        in fields(pipe)
+        if attribute.compare
+    )
 
 
 @dataclass(frozen=True)
@@ -118,6 +416,10 @@ class MemoryQuerySet(QuerySet):
     get_objects: Callable[[Any], Iterable] = field(default=lambda: [])
     compiler: LambdaCompiler = field(default_factory=LambdaCompiler)
     pipeline: List[Callable[[Any], Iterable]] = field(default_factory=list)
+    result_cache: Optional[ResultCache] = field(default=None, compare=False, repr=False)
+    checkpoint: Optional[Callable[[], None]] = field(default=None, compare=False, repr=False)
+    executor: Optional[Executor] = field(default=None, compare=False, repr=False)
+    partition_size: int = field(default=50000, compare=False, repr=False)
 
     class MultipleObjectsReturned(Exception):
         message = 'Multiple objects returned'
@@ -129,57 +431,58 @@ class MemoryQuerySet(QuerySet):
         return self
 
     def filter(self, *queries):
-        callbacks = [self.compiler.compile(query) for query in queries if query is not None]
-
-        def _filter(objects):
-            return [
-                object
-                for object
-                in objects
-                if all(callback(object) for callback in callbacks)
-            ]
-
-        return type(self)(
-            get_objects=self.get_objects,
-            compiler=self.compiler,
-            pipeline=self.pipeline + [_filter]
-        )
+        queries = tuple(query for query in queries if query is not None)
+        predicate = self.compiler.compile(conjunction(queries)) if queries else None
+        return self.pipe(FilterPipe(queries=queries, predicate=predicate, compiler=self.compiler))
 
     def exclude(self, *queries):
-        callbacks = [self.compiler.compile(query) for query in queries if query is not None]
-
-        def _exclude(objects):
-            return [
-                object
-                for object
-                in objects
-                if any(not callback(object) for callback in callbacks)
-            ]
-
-        return type(self)(
-            get_objects=self.get_objects,
-            compiler=self.compiler,
-            pipeline=self.pipeline + [_exclude],
-        )
+        queries = tuple(query for query in queries if query is not None)
+        predicate = self.compiler.compile(conjunction(queries)) if queries else None
+        return self.pipe(ExcludePipe(queries=queries, predicate=predicate, compiler=self.compiler))
 
     def order_by(self, *fields):
-        def _order_by(objects):
-            objects = objects.copy()
-            for field in reversed(fields):
-                if isinstance(field, Neg):
-                    objects.sort(key=lambda object: self.compiler.compile(field.operand)(object), reverse=True)
-                else:
-                    objects.sort(key=lambda object: self.compiler.compile(field)(object))
-            return objects
-
-        return type(self)(
-            get_objects=self.get_objects,
-            compiler=self.compiler,
-            pipeline=self.pipeline + [_order_by]
-        )
+        return self.pipe(OrderByPipe(
+            fields=fields,
+            keys=tuple(
+                (self.compiler.compile(field.operand), True)
+                if isinstance(field, Neg)
+                else (self.compiler.compile(field), False)
+                for field
+                in fields
+            ),
+        ))
+
+    def pipe(self, pipe):
+        return replace(self, pipeline=self.pipeline + [pipe])
+
+    def limit(self, count):
+        return self[:count]
+
+    def offset(self, count):
+        return self[count:]
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                raise ValueError('Negative indexing is not supported.')
+            for object in self[key:key + 1]:
+                return object
+            raise IndexError('{} index out of range'.format(self.__class__.__name__))
+
+        window = slice_bounds(key)
+        pipeline = list(self.pipeline)
+        if pipeline and isinstance(pipeline[-1], SlicePipe):
+            window = compose_slices((pipeline[-1].start, pipeline[-1].stop), window)
+            pipeline.pop()
+
+        start, stop = window
+        if stop is not None and pipeline and isinstance(pipeline[-1], OrderByPipe):
+            pipeline[-1] = replace(pipeline[-1], limit=stop)
+
+        return replace(self, pipeline=pipeline + [SlicePipe(start=start, stop=stop)])
 
     def get(self, *queries):
-        objects = list(self.filter(*queries))
+        objects = list(islice(self.filter(*queries), 2))
         if len(objects) > 1:
             raise self.MultipleObjectsReturned
         elif not objects:
@@ -187,24 +490,280 @@ class MemoryQuerySet(QuerySet):
         return objects[0]
 
     def first(self):
-        objects = list(self)
-        return objects[0] if objects else None
+        return next(iter(self), None)
 
     def last(self):
-        objects = list(self)
-        return objects[-1] if objects else None
+        objects = deque(self, maxlen=1)
+        return objects[0] if objects else None
 
-    def aggregate(self, aggregation: Aggregation):
-        return aggregation.reducer(self)
+    def exists(self):
+        for _ in self:
+            return True
+        return False
 
-    def __iter__(self):
-        objects = self.get_objects()
+    def count(self):
+        return Count(None).reducer(self)
+
+    def annotate(self, **annotations):
+        """
+        Attach the result of each annotation, e.g. `Count('giftcards')`, to
+        every object, computed once per object. The objects are wrapped in
+        `Annotated` and later filters and orderings can use the names.
+        """
+        return self.pipe(AnnotatePipe(
+            annotations=annotations,
+            functions={
+                name: self.compiler.compile(annotation)
+                for name, annotation
+                in annotations.items()
+            },
+        ))
+
+    def values(self, *fields: str):
+        """
+        Map every object to a dict of its `fields`. Later filters, orderings
+        and aggregations apply to the dicts.
+        """
+        return self.pipe(ValuesPipe(fields=fields, get_value=self.compiler.get_value)).as_rows()
+
+    def group_by(self, *fields: str, **aggregations: Aggregation):
+        """
+        Group the objects by the values of `fields`, yielding one dict per
+        group with those values and the result of each named aggregation
+        over the group, e.g. `group_by('reason', total=Sum('value'))`.
+        Later filters and orderings apply to these dicts.
+        """
+        return self.pipe(GroupByPipe(
+            fields=fields,
+            aggregations=aggregations,
+            compiler=self.compiler,
+        )).as_rows()
+
+    def as_rows(self):
+        """
+        Switch to a compiler reading fields as dict items, for the pipes
+        following one that maps the objects to dicts.
+        """
+        return replace(self, compiler=replace(self.compiler, get_value=getitem))
+
+    def aggregate(self, *aggregations: Aggregation, **named: Aggregation):
+        """
+        Return the result of a single aggregation, or a dict of the results
+        of named aggregations, all computed in one pass over the objects.
+        """
+        aggregation = single_aggregation(aggregations, named)
+        if self.executor is not None and all(isinstance(pipe, (FilterPipe, ExcludePipe)) for pipe in self.pipeline):
+            results = self.aggregate_in_parallel(named if aggregation is None else {None: aggregation})
+            if results is not None:
+                return results if aggregation is None else results[None]
+        if aggregation is not None:
+            return aggregation.reducer(self if aggregation.query is None else self.filter(aggregation.query))
+
+        accumulators = {
+            name: aggregation.accumulator(self.compiler)
+            for name, aggregation
+            in named.items()
+        }
+        updates = [accumulator.update for accumulator in accumulators.values()]
+        for chunk in chunks(self):
+            for update in updates:
+                update(chunk)
+        return {name: accumulator.result() for name, accumulator in accumulators.items()}
+
+    def parallel(self, executor: Executor, partition_size: int = 50000):
+        """
+        Evaluate leading filters and excludes, and aggregations following
+        only those, on `executor`, typically a `ProcessPoolExecutor`, one
+        partition of `partition_size` objects per task. Workers receive the
+        queries rather than compiled functions, so queries, objects and
+        `get_value` must be picklable. Matches come back in order, and
+        partial aggregates are merged, so results equal a serial run's up
+        to float rounding. Sources smaller than a partition run serially.
+        The source is materialized to be partitioned, but partitions are
+        only scanned a few ahead of the matches read, so `first()` and
+        `exists()` stop early.
+        """
+        return replace(self, executor=executor, partition_size=partition_size)
+
+    def stages(self, pipes):
+        return [(isinstance(pipe, ExcludePipe), conjunction(pipe.queries), pipe.compiler) for pipe in pipes]
+
+    def filter_in_parallel(self, objects, pipeline):
+        leading = list(takewhile(lambda pipe: isinstance(pipe, (FilterPipe, ExcludePipe)), pipeline))
+        if not leading:
+            return objects, pipeline
+        objects = objects if isinstance(objects, list) else list(objects)
+        parts = partitions(objects, self.partition_size)
+        if len(parts) < 2:
+            return objects, pipeline
+
+        return self.matches_in_parallel(self.stages(leading), parts), pipeline[len(leading):]
+
+    def matches_in_parallel(self, stages, parts):
+        """
+        Yield the matches of each partition in order, scanning only a few
+        partitions ahead of the consumer, so that `first()`, `exists()` and
+        slices stop submitting partitions once they have their objects.
+        """
+        results = ordered_map(self.executor, partial(match_partition, stages), parts)
+        try:
+            for part, positions in zip(parts, results):
+                for position in positions:
+                    yield part[position]
+        finally:
+            results.close()
+
+    def aggregate_in_parallel(self, aggregations):
+        """
+        Merge the partial aggregates of each partition, or return None if
+        the source fits in one partition.
+        """
+        objects, pipeline = self.plan()
+        parts = partitions(list(objects), self.partition_size)
+        if len(parts) < 2:
+            return None
+
+        stages = self.stages(pipeline)
+        results = self.executor.map(aggregate_partition, repeat(self.compiler), repeat(stages), repeat(aggregations), parts)
+        accumulators = next(results)
+        for partial in results:
+            for name, accumulator in accumulators.items():
+                accumulator.merge(partial[name])
+        return {name: accumulator.result() for name, accumulator in accumulators.items()}
+
+    def store(self) -> MemoryStore:
+        if not isinstance(self.get_objects, MemoryStore):
+            raise TypeError('Writing needs a queryset over a MemoryStore.')
+        return self.get_objects
+
+    def bulk_create(self, objects: Iterable) -> int:
+        """
+        Insert `objects` into the store in one batch, indexing them once per
+        index, and return how many were inserted.
+        """
+        return self.store().insert_many(objects)
+
+    def bulk_update(self, objects: Iterable, fields: Optional[Iterable[str]] = None) -> int:
+        """
+        Re-index `objects`, changed in place or replacing the stored objects
+        with the same primary key, in one batch. `fields` is accepted for
+        parity with the SQL backend: whole objects are stored either way.
+        """
+        return self.store().update_many(objects)
+
+    def bulk_delete(self, objects: Iterable) -> int:
+        return self.store().delete_many(objects)
+
+    def update(self, **values) -> int:
+        """
+        Set each field to its value, a constant or a query such as
+        `A('points') - 1000`, on every matching object, and return how many
+        were updated. Objects are changed in place, then re-indexed as one
+        batch when they come from a `MemoryStore`, whose primary key cannot
+        be set. If a value cannot be computed, or an index rejects one,
+        every object keeps its previous values.
+        """
         for pipe in self.pipeline:
+            if isinstance(pipe, (AnnotatePipe, ValuesPipe, GroupByPipe)):
+                raise TypeError('Cannot update a query once annotate(), values() or group_by() has been called.')
+        store = self.get_objects
+        if isinstance(store, MemoryStore) and store.primary_key in values:
+            raise ValueError('Cannot update the primary key {!r} of stored objects.'.format(store.primary_key))
+
+        functions = [
+            (name, self.compiler.compile(value) if isinstance(value, LazyObject) else (lambda object, value=value: value))
+            for name, value
+            in values.items()
+        ]
+        objects = list(self.evaluate())
+        changes = [[(name, function(object)) for name, function in functions] for object in objects]
+        previous = [[(name, getattr(object, name)) for name, _ in functions] for object in objects]
+        try:
+            for object, values in zip(objects, changes):
+                for name, value in values:
+                    setattr(object, name, value)
+            if isinstance(store, MemoryStore):
+                store.update_many(objects)
+        except BaseException:
+            # The store keeps its entries when re-indexing fails, so put
+            # back the values they were built from.
+            for object, values in zip(objects, previous):
+                for name, value in values:
+                    setattr(object, name, value)
+            raise
+        return len(objects)
+
+    def plan(self):
+        """
+        Return the objects to feed into the pipeline and the pipes to run
+        on them. When the objects come from a `MemoryStore`, the leading
+        filters are answered by probing the store's indexes if possible, and
+        an ordering on a field with a sorted index walks the index instead
+        of sorting.
+        """
+        store = self.get_objects
+        if not isinstance(store, MemoryStore) or self.compiler.get_value is not store.get_value:
+            return self.get_objects(), self.pipeline
+
+        leading = list(takewhile(lambda pipe: isinstance(pipe, (FilterPipe, ExcludePipe)), self.pipeline))
+        rest = self.pipeline[len(leading):]
+        queries = [query for pipe in leading if isinstance(pipe, FilterPipe) for query in pipe.queries]
+        objects = store.lookup(queries) if queries else None
+
+        if rest and isinstance(rest[0], OrderByPipe) and len(rest[0].fields) == 1:
+            field, = rest[0].fields
+            reverse = isinstance(field, Neg)
+            walk = store.walk(field_name(field.operand if reverse else field), queries, reverse)
+            if walk is not None and (objects is None or len(objects) >= walk[0]):
+                return walk[1], leading + rest[1:]
+
+        if objects is None:
+            return store(), self.pipeline
+        return objects, self.pipeline
+
+    def cache(self, result_cache: Optional[ResultCache] = None):
+        """
+        Opt into caching evaluated results in `result_cache`, shared by the
+        querysets derived from this one. Results are only cached when the
+        objects come from a versioned source, such as a `MemoryStore`, and
+        are recomputed after it changes. Cached evaluations materialize the
+        whole result, so `first()` and friends no longer stop early.
+        """
+        return replace(self, result_cache=result_cache if result_cache is not None else ResultCache())
+
+    def cache_key(self):
+        """
+        Return a hashable key identifying the results of this queryset for a
+        given version of its source, or None if it cannot be built, e.g.
+        because a query holds an unhashable constant.
+        """
+        try:
+            key = (self.get_objects, self.compiler.get_value, tuple(pipe_key(pipe) for pipe in self.pipeline))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def evaluate(self):
+        objects, pipeline = self.plan()
+        if self.executor is not None:
+            objects, pipeline = self.filter_in_parallel(objects, pipeline)
+        if self.checkpoint is not None:
+            objects = checkpointed(objects, self.checkpoint)
+        for pipe in pipeline:
             objects = pipe(objects)
         return iter(objects)
 
+    def __iter__(self):
+        version = getattr(self.get_objects, 'version', None)
+        if self.result_cache is not None and version is not None:
+            key = self.cache_key()
+            if key is not None:
+                return iter(self.result_cache.get_or_set(key, version, lambda: tuple(self.evaluate())))
+        return self.evaluate()
+
     def __repr__(self):
-        objects = list(self)
+        objects = list(islice(self, 4))
         return '<{} [{}]>'.format(
             self.__class__.__name__,
             ', '.join(
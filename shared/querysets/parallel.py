@@ -0,0 +1,95 @@
+import os
+
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from shared.common_query.aggregations import Aggregation, chunks
+
+# A filter or exclude pipe shipped to a worker: whether it excludes, the
+# conjunction of the queries it was created from, if any, and the compiler
+# it was created with, e.g. one reading dict items after values().
+Stage = Tuple[bool, Optional[Any], Any]
+
+
+# How many tasks `ordered_map` keeps submitted ahead of the results read.
+WINDOW = 2 * (os.cpu_count() or 1)
+
+
+def partitions(objects: Sequence, size: int) -> List[Sequence]:
+    return [objects[start:start + size] for start in range(0, len(objects), size)]
+
+
+def ordered_map(executor, function: Callable, items: Iterable, window: int = WINDOW) -> Iterator:
+    """
+    Like `executor.map(function, items)`, but submitting at most `window`
+    tasks ahead of the results read, so that a reader stopping early, e.g.
+    `first()`, does not pay for the rest. Closing the iterator cancels the
+    tasks not yet started.
+    """
+    items = iter(items)
+    futures = deque(executor.submit(function, item) for item in islice(items, window))
+    try:
+        while futures:
+            future = futures.popleft()
+            for item in islice(items, 1):
+                futures.append(executor.submit(function, item))
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def compile_stages(stages: Sequence[Stage]):
+    """
+    Compile the stages in the worker, since the compiled functions are
+    closures that cannot be pickled, unlike the queries. Returns None when
+    a stage drops every object, i.e. an exclude without queries.
+    """
+    predicates = []
+    for exclude, query, compiler in stages:
+        if query is None:
+            if exclude:
+                return None
+            continue
+        predicates.append((compiler.compile(query), exclude))
+    return predicates
+
+
+def matching(predicates, objects):
+    for predicate, exclude in predicates:
+        objects = [object for object in objects if bool(predicate(object)) != exclude]
+    return objects
+
+
+def match_partition(stages: Sequence[Stage], objects: Sequence) -> List[int]:
+    """
+    Return the positions in `objects` of those passing every stage. Only
+    positions are sent back, so that the caller keeps its own objects
+    rather than copies, in their order.
+    """
+    predicates = compile_stages(stages)
+    if predicates is None:
+        return []
+    positions = range(len(objects))
+    for predicate, exclude in predicates:
+        positions = [position for position in positions if bool(predicate(objects[position])) != exclude]
+    return list(positions)
+
+
+def aggregate_partition(compiler, stages: Sequence[Stage], aggregations: Dict[str, Aggregation], objects: Sequence):
+    """
+    Return an accumulator per aggregation, fed the objects of the partition
+    passing every stage, to be merged with those of the other partitions.
+    """
+    accumulators = {
+        name: aggregation.accumulator(compiler)
+        for name, aggregation
+        in aggregations.items()
+    }
+    predicates = compile_stages(stages)
+    if predicates is not None:
+        for chunk in chunks(matching(predicates, objects)):
+            for accumulator in accumulators.values():
+                accumulator.update(chunk)
+    return accumulators
@@ -1,24 +1,36 @@
-from dataclasses import dataclass, field
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from functools import reduce
 from itertools import islice, tee
-from typing import Callable, Any, Iterable, List, Optional, Type
+from types import SimpleNamespace
+from typing import Callable, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 
 from shared.common_query import (
     A,
+    And,
     BinaryOperation,
     BooleanOperation,
     Call,
+    FloorDiv,
     GetAttr,
     GetItem,
     L,
     LazyObject,
     Neg,
+    Not,
+    Or,
+    Pow,
+    TrueDiv,
     UnaryOperation,
 )
-from shared.common_query.aggregations import Aggregation, Has
-from shared.querysets.base import QuerySet
+from shared.common_query.aggregations import Aggregation, Collect, Count, Has, Mean, Median, Sum, chunks
+from shared.common_query.optimizer import optimize, rebuild
+from shared.mappers import DataEntityMapper, IdentityMap
+from shared.querysets.base import Annotated, QuerySet, compose_slices, single_aggregation, slice_bounds
+from shared.querysets.cache import LRUCache, cached_compile
 
 import sqlalchemy as sa
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.query import Query
 
@@ -27,37 +39,266 @@ class SQLAlchemyDataEntity:
     pass
 
 
+# String methods that can be called in queries, by name.
+METHODS = {
+    'lower': lambda value: sa.func.lower(value),
+    'upper': lambda value: sa.func.upper(value),
+    'strip': lambda value: sa.func.trim(value),
+    'startswith': lambda value, prefix: value.startswith(prefix),
+    'endswith': lambda value, suffix: value.endswith(suffix),
+}
+
+
+def as_expression(value):
+    if hasattr(value, '__clause_element__'):
+        return value.__clause_element__()
+    elif isinstance(value, sa.sql.ClauseElement):
+        return value
+    return sa.literal(value)
+
+
+def true_divide(left, right):
+    """
+    Divide like Python's `/`, which never truncates, whereas SQL divides
+    integers by integers as integers.
+    """
+    left, right = as_expression(left), as_expression(right)
+    if isinstance(left.type, sa.Integer) and isinstance(right.type, sa.Integer):
+        left = sa.cast(left, sa.Float)
+    return left / right
+
+
+OPERATIONS = {
+    And: lambda operands: sa.and_(*operands),
+    Or: lambda operands: sa.or_(*operands),
+    TrueDiv: lambda operands: reduce(true_divide, operands),
+    FloorDiv: lambda operands: reduce(lambda left, right: sa.func.floor(true_divide(left, right)), operands),
+    Pow: lambda operands: reduce(sa.func.power, operands),
+}
+
+
 @dataclass(frozen=True)
 class SQLAlchemyCompiler:
+    """
+    Compiles queries into functions building SQLAlchemy expressions for a
+    model. Aggregations over a relationship, e.g. `Count('items') > 3`,
+    become correlated subqueries; `Sum` and `Mean` name the column to
+    aggregate after the relationship, as in `Sum('items.line_total')`.
+    Nodes without a portable SQL equivalent raise NotImplementedError:
+    calls other than a few string methods, attribute chains, and `Median`,
+    `Collect` and `Variance` inside a query or `group_by`, which only
+    `SQLAlchemyQuerySet.aggregate` supports. Note that `%` follows SQL,
+    not Python, for negative operands, and `**` needs a database with
+    `power()`.
+    """
+    cache: LRUCache = field(default_factory=LRUCache, compare=False, repr=False)
+
     def compile(self, node):
+        return cached_compile(self.cache, node, lambda node: self.compile_node(optimize(node)), (type(self),))
+
+    def compile_node(self, node):
         if isinstance(node, A):
-            if isinstance(node, GetAttr):
-                return lambda model: getattr(
-                    self.compile(node.parent)(model),
-                    self.compile(node.arguments)(model),
-                )
+            if isinstance(node, Call):
+                if not isinstance(node.parent, GetAttr) or node.parent.arguments not in METHODS:
+                    raise NotImplementedError('Cannot compile the call {!r} to SQL.'.format(node))
+                method = METHODS[node.parent.arguments]
+                parent = self.compile_node(node.parent.parent)
+                args, kwargs = node.arguments
+                if kwargs:
+                    raise NotImplementedError('Cannot compile the call {!r} to SQL.'.format(node))
+                args = [self.compile_node(arg) for arg in args]
+                return lambda model: method(parent(model), *[arg(model) for arg in args])
+
+            elif isinstance(node, GetItem):
+                parent = self.compile_node(node.parent)
+                key = self.compile_node(node.arguments)
+                return lambda model: parent(model)[key(model)]
+
+            elif isinstance(node, GetAttr):
+                parent = self.compile_node(node.parent)
+                name = self.compile_node(node.arguments)
+
+                def compiled_GetAttr(model):
+                    value = parent(model)
+                    try:
+                        return getattr(value, name(model))
+                    except AttributeError:
+                        raise NotImplementedError(
+                            'Cannot compile {!r} to SQL; use Has() to query related rows.'.format(node)
+                        ) from None
+                return compiled_GetAttr
 
-            return lambda model: getattr(model, node.arguments)
+            name = self.compile_node(node.arguments)
+            return lambda model: getattr(model, name(model))
+
+        elif isinstance(node, L):
+            value = node.value
+            return lambda model: sa.literal(value)
 
         elif isinstance(node, BinaryOperation):
-            return lambda model: reduce(
-                node.reducer,
-                [
-                    self.compile(operand)(model)
-                    for operand
-                    in node.operands
-                ],
-            )
+            operands = [self.compile_node(operand) for operand in node.operands]
+
+            if type(node) in OPERATIONS:
+                operation = OPERATIONS[type(node)]
+                return lambda model: operation([operand(model) for operand in operands])
+
+            reducer = node.reducer
+            if isinstance(node, BooleanOperation) and len(operands) > 2:
+                # a < b < c means a < b and b < c, as in Python.
+                def compiled_Chain(model):
+                    values = [operand(model) for operand in operands]
+                    return sa.and_(*[reducer(left, right) for left, right in zip(values, values[1:])])
+                return compiled_Chain
+
+            return lambda model: reduce(reducer, [operand(model) for operand in operands])
+
+        elif isinstance(node, Not):
+            operand = self.compile_node(node.operand)
+            return lambda model: sa.not_(operand(model))
+
+        elif isinstance(node, Neg):
+            operand = self.compile_node(node.operand)
+            return lambda model: -operand(model)
 
         elif isinstance(node, Aggregation):
+            return self.compile_subquery(node)
+
+        elif isinstance(node, LazyObject):
+            raise NotImplementedError('Cannot compile {!r} to SQL.'.format(node))
+
+        elif isinstance(node, bool):
+            return lambda model: sa.true() if node else sa.false()
+
+        return lambda model: node
+
+    def compile_subquery(self, node):
+        """
+        Compile an aggregation over the rows related to a model through a
+        relationship into an `EXISTS`, or a scalar subquery correlated to
+        the model.
+        """
+        relationship_name, _, column = node.field.partition('.')
+        if not isinstance(node, (Count, Has, Sum, Mean)) or isinstance(node, (Sum, Mean)) and not column:
+            raise NotImplementedError('Cannot compile {!r} to SQL.'.format(node))
+        query = self.compile_node(node.query) if node.query is not None else None
+
+        def compiled_Aggregation(model):
+            relationship = sa.inspect(model).relationships[relationship_name]
+            target = relationship.mapper.class_
+            clauses = [query(target)] if query is not None else []
+
             if isinstance(node, Has):
-                return lambda model: getattr(
-                    model,
-                    node.field,
-                ).any(self.compile(node.query)(sa.inspect(model).relationships[node.field].mapper.class_))
+                return getattr(model, relationship_name).any(sa.and_(*clauses) if clauses else None)
+
+            clauses.append(relationship.primaryjoin)
+            if relationship.secondary is not None:
+                clauses.append(relationship.secondaryjoin)
+            if isinstance(node, Count):
+                aggregate = sa.func.count()
+            elif isinstance(node, Sum):
+                aggregate = sa.func.coalesce(sa.func.sum(getattr(target, column)), 0)
+            else:
+                aggregate = sa.func.avg(getattr(target, column))
+            return sa.select([aggregate]).where(sa.and_(*clauses)).correlate(model).as_scalar()
+        return compiled_Aggregation
+
+    def compile_aggregation(self, aggregation):
+        """
+        Compile an aggregation over the rows of a query into a column
+        expression and a function converting its value, so that several
+        can be selected together. A `where` query is applied with
+        `CASE WHEN`, since aggregates skip the NULL it gives other rows.
+        """
+        if not isinstance(aggregation, (Count, Has, Sum, Mean)):
+            raise NotImplementedError('{} is only supported by aggregate() in SQL.'.format(type(aggregation).__name__))
+        query = self.compile_node(aggregation.query) if aggregation.query is not None else None
+
+        def operand(model, value):
+            if query is None:
+                return value
+            return sa.case([(query(model), value)])
+
+        if isinstance(aggregation, (Count, Has)):
+            def compiled_Aggregation(model):
+                return sa.func.count() if query is None else sa.func.count(operand(model, 1))
+            return compiled_Aggregation, int if isinstance(aggregation, Count) else bool
+        elif isinstance(aggregation, Sum):
+            return lambda model: sa.func.coalesce(sa.func.sum(operand(model, getattr(model, aggregation.field))), 0), identity
+        return lambda model: sa.func.avg(operand(model, getattr(model, aggregation.field))), identity
+
+
+def identity(value):
+    return value
+
+
+def resolve_annotations(node, annotations: Dict[str, Any]):
+    """
+    Replace the names of `annotations` in `node`, e.g. `A('lines')` after
+    `annotate(lines=Count('items'))`, with the annotations themselves,
+    since `WHERE` cannot refer to a selected column by its label.
+    """
+    if type(node) is A and node.parent is None and isinstance(node.arguments, str) and node.arguments in annotations:
+        return annotations[node.arguments]
+    elif isinstance(node, BinaryOperation):
+        return rebuild(type(node), [resolve_annotations(operand, annotations) for operand in node.operands])
+    elif isinstance(node, UnaryOperation):
+        return type(node)(resolve_annotations(node.operand, annotations))
+    return node
+
+
+def relationship_path(path) -> List[str]:
+    """
+    Return the attribute names along a path like `A('items').product`, or
+    the dotted string `'items.product'`.
+    """
+    if isinstance(path, str):
+        return path.split('.')
+
+    names = []
+    while isinstance(path, GetAttr):
+        names.insert(0, path.arguments)
+        path = path.parent
+    if type(path) is not A:
+        raise ValueError('{!r} is not a path of relationships.'.format(path))
+    return [path.arguments] + names
 
-        else:
-            return lambda model: node if not isinstance(node, LazyObject) else self.compile(node)(model)
+
+def eager_load(model, path, strategy):
+    """
+    Build a loader option applying `strategy`, e.g. `selectinload`, to
+    each relationship along `path` from `model`.
+    """
+    option = None
+    for name in relationship_path(path):
+        attribute = getattr(model, name, None)
+        if not isinstance(getattr(attribute, 'property', None), sa.orm.RelationshipProperty):
+            raise ValueError('{}.{} is not a relationship.'.format(model.__name__, name))
+        option = strategy(attribute) if option is None else getattr(option, strategy.__name__)(attribute)
+        model = attribute.property.mapper.class_
+    return option
+
+
+@contextmanager
+def capture_statements(session: Session) -> Iterator[List[str]]:
+    """
+    Collect the SQL statements executed through `session` while the block
+    runs, e.g. to assert how many a queryset evaluation issues:
+
+        with capture_statements(session) as statements:
+            orders = [mapper.map(order) for order in queryset]
+        assert len(statements) == 2
+    """
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    sa.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', record)
 
 
 @dataclass(frozen=True)
@@ -66,27 +307,477 @@ class SQLAlchemyQuerySet(QuerySet):
     model: Type[SQLAlchemyDataEntity]
     compiler: SQLAlchemyCompiler = field(default_factory=lambda: SQLAlchemyCompiler())
     query: Optional[Query] = field(default=None)
+    window: Tuple[int, Optional[int]] = field(default=(0, None))
+    annotations: Tuple[Tuple[str, Any], ...] = field(default=())
+    projection: Optional[Tuple[str, ...]] = field(default=None)
+    grouping: Optional[Tuple[Tuple[str, Aggregation], ...]] = field(default=None)
+    having: Tuple[Any, ...] = field(default=())
+    ordering: Tuple[Tuple[Any, bool], ...] = field(default=())
+    loads: Tuple[Any, ...] = field(default=())
+    mapper: Optional[DataEntityMapper] = field(default=None)
+    identity_map: Optional[IdentityMap] = field(default=None)
+
+    class MultipleObjectsReturned(Exception):
+        message = 'Multiple objects returned'
+
+    class ObjectDoesNotExist(Exception):
+        message = 'Object does not exist'
 
     def all(self):
         return self
 
+    def compile_clauses(self, queries):
+        """
+        Compile `queries` against the model, or against the columns selected
+        by `values` or `group_by`, by name. The names of annotations stand
+        for the annotations.
+        """
+        if self.projection is not None:
+            target = SimpleNamespace(**{name: expression for name, (expression, _) in self.row_columns().items()})
+        else:
+            target = self.model
+            if self.annotations:
+                annotations = dict(self.annotations)
+                queries = [resolve_annotations(query, annotations) for query in queries]
+        return [self.compiler.compile(query)(target) for query in queries]
+
     def filter(self, *queries):
-        clauses = [
-            self.compiler.compile(query)(self.model)
-            for query
-            in queries
+        if self.window != (0, None):
+            raise TypeError('Cannot filter a query once a slice has been taken.')
+
+        clauses = self.compile_clauses(queries)
+        if self.grouping is not None:
+            return replace(self, having=self.having + tuple(clauses))
+        return replace(self, query=self.base_query().filter(*clauses))
+
+    def exclude(self, *queries):
+        """
+        Drop the rows matching every one of `queries`, as
+        `WHERE NOT coalesce(..., false)`. Rows for which the queries are
+        NULL, e.g. because a column is, are kept, as they are in memory.
+        """
+        if self.window != (0, None):
+            raise TypeError('Cannot filter a query once a slice has been taken.')
+
+        clauses = self.compile_clauses(queries)
+        clause = sa.not_(sa.func.coalesce(sa.and_(*clauses), sa.false())) if clauses else sa.false()
+        if self.grouping is not None:
+            return replace(self, having=self.having + (clause,))
+        return replace(self, query=self.base_query().filter(clause))
+
+    def order_by(self, *fields):
+        """
+        Order by `fields`, wrapping a field in `Neg` for `DESC`. Like a
+        repeated stable sort in memory, a later `order_by` takes precedence
+        and earlier ones only break its ties.
+        """
+        if self.window != (0, None):
+            raise TypeError('Cannot reorder a query once a slice has been taken.')
+
+        ordering = tuple(
+            (self.compile_clauses([field.operand])[0], True)
+            if isinstance(field, Neg)
+            else (self.compile_clauses([field])[0], False)
+            for field
+            in fields
+        )
+        return replace(self, ordering=ordering + self.ordering)
+
+    def annotate(self, **annotations):
+        """
+        Select the result of each annotation, e.g. `Count('items')`, along
+        with every row, as a correlated subquery. The objects are wrapped in
+        `Annotated`. Later filters and orderings can refer to an annotation
+        by name, repeating its subquery.
+        """
+        return replace(self, annotations=self.annotations + tuple(annotations.items()))
+
+    def prefetch(self, *paths):
+        """
+        Load the relationships along each of `paths`, e.g. `A('items')`,
+        with one extra `SELECT ... WHERE ... IN` per relationship for the
+        whole result, or per chunk with `iterator()`, instead of one per
+        object when first accessed.
+        """
+        return replace(self, loads=self.loads + tuple(eager_load(self.model, path, selectinload) for path in paths))
+
+    def select_related(self, *paths):
+        """
+        Load the relationships along each of `paths` in the same query with
+        a `LEFT OUTER JOIN`. Best for many-to-one relationships, since
+        collections repeat each row once per related object, and can only
+        be streamed with `iterator(keyset=True)`.
+        """
+        return replace(self, loads=self.loads + tuple(eager_load(self.model, path, joinedload) for path in paths))
+
+    def mapped(self, mapper: DataEntityMapper, identity_map: Optional[IdentityMap] = None):
+        """
+        Yield the domain entities `mapper` maps the rows to, in batches,
+        reusing those already in `identity_map`. Querysets derived from this
+        one share the identity map, a new one unless given. Rows selected by
+        `values` or `group_by` are not mapped.
+        """
+        return replace(self, mapper=mapper, identity_map=IdentityMap() if identity_map is None else identity_map)
+
+    def values(self, *fields: str):
+        """
+        Select only `fields`, yielding a dict per row. Later filters apply
+        to these columns.
+        """
+        return replace(self, projection=fields)
+
+    def group_by(self, *fields: str, **aggregations: Aggregation):
+        """
+        Translate to `GROUP BY fields`, yielding a dict per group with those
+        fields and the result of each named aggregation. Later filters
+        become a `HAVING` clause.
+        """
+        return replace(self, projection=fields, grouping=tuple(aggregations.items()))
+
+    def row_columns(self):
+        """
+        Return the column expressions selected by `values` or `group_by`,
+        with the functions converting their values, by name.
+        """
+        columns = {name: (getattr(self.model, name), identity) for name in self.projection}
+        for name, aggregation in self.grouping or ():
+            expression, convert = self.compiler.compile_aggregation(aggregation)
+            columns[name] = (expression(self.model), convert)
+        return columns
+
+    def get(self, *queries):
+        objects = list(self.filter(*queries)[:2])
+        if len(objects) > 1:
+            raise self.MultipleObjectsReturned
+        elif not objects:
+            raise self.ObjectDoesNotExist
+        return objects[0]
+
+    def first(self):
+        return next(iter(self[:1]), None)
+
+    def last(self):
+        """
+        Fetch the last row with the ordering reversed, falling back to
+        the primary key when the query is unordered, and `LIMIT 1`.
+        """
+        if self.window != (0, None):
+            count = self.count()
+            return self[count - 1] if count else None
+
+        ordering = self.ordering or tuple(
+            (column, False)
+            for column
+            in sa.inspect(self.model).primary_key
+        )
+        return replace(self, ordering=tuple((clause, not descending) for clause, descending in ordering)).first()
+
+    def exists(self):
+        return self.session.query(self.get_query().exists()).scalar()
+
+    def count(self):
+        if self.window != (0, None) or self.projection is not None:
+            return self.session.query(sa.func.count()).select_from(self.get_query().subquery()).scalar()
+        return self.select(sa.func.count()).scalar()
+
+    def aggregate(self, *aggregations: Aggregation, **named: Aggregation):
+        """
+        Return the result of a single aggregation, or a dict of the results
+        of named aggregations, computed by a single SELECT. `Median` and
+        `Collect` each need their own: `Collect` selects the column in the
+        order of the query, and `Median` selects the middle one or two
+        values in the column's order, after counting them. Their `where`
+        queries filter those SELECTs, which a sliced query cannot take.
+        """
+        if self.projection is not None:
+            raise TypeError('Cannot aggregate a query once values() or group_by() has been called.')
+
+        aggregation = single_aggregation(aggregations, named)
+        items = list(named.items() if aggregation is None else [(None, aggregation)])
+        results = {}
+        for name, item in items:
+            if isinstance(item, (Collect, Median)):
+                queryset = self if item.query is None else self.filter(item.query)
+                results[name] = (queryset.collect if isinstance(item, Collect) else queryset.median)(item.field)
+        compiled = [
+            (name, self.compiler.compile_aggregation(aggregation))
+            for name, aggregation
+            in items
+            if name not in results
+        ]
+
+        if not compiled:
+            row = ()
+        elif self.window != (0, None):
+            model = aliased(self.model, self.get_query().subquery())
+            row = self.session.query(*[expression(model) for _, (expression, _) in compiled]).select_from(model).one()
+        else:
+            row = self.select(*[expression(self.model) for _, (expression, _) in compiled]).one()
+
+        results.update((name, convert(value)) for (name, (_, convert)), value in zip(compiled, row))
+        return {name: results[name] for name, _ in items} if aggregation is None else results[None]
+
+    def column_query(self, field: str):
+        """
+        Return a query selecting the `field` column of the rows, in order.
+        """
+        return replace(self, annotations=(), loads=()).get_query().with_entities(getattr(self.model, field))
+
+    def collect(self, field: str) -> list:
+        return [value for value, in self.column_query(field)]
+
+    def median(self, field: str):
+        """
+        Return the median of the non-null values of the `field` column,
+        averaging the middle two like `Median` does in memory.
+        """
+        values = self.column_query(field).subquery()
+        value = list(values.c)[0]
+        length = self.session.query(sa.func.count(value)).scalar()
+        if length == 0:
+            return None
+        middle = [
+            middle
+            for middle,
+            in self.session.query(value).filter(value.isnot(None)).order_by(value).offset((length - 1) // 2).limit(2 - length % 2)
         ]
+        if length % 2 == 0:
+            left, right = middle
+            return sum([right, left]) / 2
+        return middle[0]
 
-        return type(self)(
-            session=self.session,
-            model=self.model,
-            compiler=self.compiler,
-            query=self.query.filter(*clauses) if self.query is not None else self.session.query(self.model).filter(*clauses),
+    def bulk_create(self, objects: Iterable, batch_size: int = 1000) -> int:
+        """
+        Insert `objects`, model instances or dicts of attribute values,
+        with one executemany `INSERT` per `batch_size` of them, and return
+        how many were inserted. Instances are not added to the session and
+        do not get their generated primary keys.
+        """
+        count = 0
+        for batch in chunks(objects, batch_size):
+            instances = [object for object in batch if not isinstance(object, dict)]
+            if instances:
+                self.session.bulk_save_objects(instances)
+            mappings = [object for object in batch if isinstance(object, dict)]
+            if mappings:
+                self.session.bulk_insert_mappings(self.model, mappings)
+            count += len(batch)
+        return count
+
+    def bulk_update(self, objects: Iterable, fields: Optional[Iterable[str]] = None, batch_size: int = 1000) -> int:
+        """
+        Write `fields` of `objects`, model instances or dicts which include
+        the primary key, with one executemany `UPDATE ... WHERE` per
+        `batch_size` of them, and return how many were written. Every
+        column, or every key of a dict, is written when `fields` is None.
+        """
+        mapper = sa.inspect(self.model)
+        keys = [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+        names = keys + (
+            [name for name in mapper.column_attrs.keys() if name not in keys]
+            if fields is None
+            else list(fields)
         )
 
-    def __iter__(self):
-        if self.query is None:
-            result_set = self.session.query(self.model).all()
+        count = 0
+        for batch in chunks(objects, batch_size):
+            self.session.bulk_update_mappings(self.model, [
+                (object if fields is None else {name: object[name] for name in names})
+                if isinstance(object, dict)
+                else {name: getattr(object, name) for name in names}
+                for object
+                in batch
+            ])
+            count += len(batch)
+        return count
+
+    def bulk_delete(self, objects: Iterable, batch_size: int = 1000) -> int:
+        """
+        Delete `objects`, model instances, dicts including the primary key
+        or primary key values, with one `DELETE ... WHERE key IN (...)` per
+        `batch_size` of them, and return how many rows were deleted.
+        """
+        mapper = sa.inspect(self.model)
+        names = [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+        columns = [getattr(self.model, name) for name in names]
+        key = sa.tuple_(*columns) if len(columns) > 1 else columns[0]
+
+        count = 0
+        for batch in chunks(objects, batch_size):
+            values = [
+                (sa.inspect(object).identity or tuple(mapper.primary_key_from_instance(object)))
+                if isinstance(object, self.model)
+                else tuple(object[name] for name in names)
+                if isinstance(object, dict)
+                else object
+                for object
+                in batch
+            ]
+            if len(columns) == 1:
+                values = [value[0] if isinstance(value, tuple) else value for value in values]
+            count += self.session.query(self.model).filter(key.in_(values)).delete(synchronize_session=False)
+            for object in batch:
+                if isinstance(object, self.model) and object in self.session:
+                    self.session.expunge(object)
+        return count
+
+    def update(self, **values) -> int:
+        """
+        Set each field to its value, a constant or a query such as
+        `A('points') - 1000`, on every matching row with a single
+        `UPDATE ... WHERE`, without loading the rows, and return how many
+        were updated. Instances of the model in the session have the
+        fields expired, to be reloaded when next read.
+        """
+        if self.window != (0, None) or self.projection is not None or self.annotations:
+            raise TypeError('Cannot update a sliced, annotated or projected query.')
+
+        query = self.session.query(self.model)
+        base = self.base_query()
+        mapper = sa.inspect(self.model)
+        if list(base.statement.froms) == [mapper.local_table]:
+            if base.whereclause is not None:
+                query = query.filter(base.whereclause)
         else:
-            result_set = self.query.all()
-        return iter(result_set)
+            # UPDATE cannot join, so match the rows of a joined query by
+            # primary key instead.
+            key = sa.tuple_(*mapper.primary_key) if len(mapper.primary_key) > 1 else mapper.primary_key[0]
+            query = query.filter(key.in_(base.with_entities(*mapper.primary_key).subquery()))
+        count = query.update(
+            {
+                name: self.compiler.compile(value)(self.model) if isinstance(value, LazyObject) else value
+                for name, value
+                in values.items()
+            },
+            synchronize_session=False,
+        )
+        for object in list(self.session.identity_map.values()):
+            if isinstance(object, self.model):
+                self.session.expire(object, list(values))
+        return count
+
+    def limit(self, count):
+        return self[:count]
+
+    def offset(self, count):
+        return self[count:]
+
+    def base_query(self):
+        return self.query if self.query is not None else self.session.query(self.model)
+
+    def select(self, *columns):
+        """
+        Return a query selecting `columns` from the filtered rows of the
+        model, keeping any joins of the query, even when the model does not
+        appear in `columns`, e.g. for `count(*)`.
+        """
+        query = self.base_query().with_entities(*columns)
+        if not query.statement.froms:
+            query = query.select_from(self.model)
+        return query
+
+    def get_query(self):
+        query = self.base_query()
+        if self.loads and self.projection is None:
+            query = query.options(*self.loads)
+        if self.annotations:
+            query = query.add_columns(*[
+                self.compiler.compile(annotation)(self.model).label(name)
+                for name, annotation
+                in self.annotations
+            ])
+        if self.projection is not None:
+            query = query.with_entities(*[
+                expression.label(name)
+                for name, (expression, _)
+                in self.row_columns().items()
+            ])
+        if self.grouping is not None:
+            query = query.group_by(*[getattr(self.model, name) for name in self.projection])
+        if self.having:
+            query = query.having(sa.and_(*self.having))
+        if self.ordering:
+            query = query.order_by(*[
+                clause.desc() if descending else clause.asc()
+                for clause, descending
+                in self.ordering
+            ])
+        if self.window != (0, None):
+            query = query.slice(*self.window)
+        return query
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                raise ValueError('Negative indexing is not supported.')
+            for object in self[key:key + 1]:
+                return object
+            raise IndexError('{} index out of range'.format(self.__class__.__name__))
+
+        return replace(self, window=compose_slices(self.window, slice_bounds(key)))
+
+    def iterator(self, chunk_size: int = 1000, keyset: bool = False):
+        """
+        Stream the results `chunk_size` rows at a time instead of loading
+        them all before yielding the first, so memory stays bounded by the
+        chunk size. By default a single query is read with `yield_per`,
+        from a server-side cursor where the driver supports one.
+
+        With `keyset`, each chunk is a separate query for the rows after
+        the last primary key seen, in primary key order. No connection is
+        held between chunks, and rows inserted or deleted while iterating
+        never shift the remaining chunks, so long-running jobs neither skip
+        nor repeat rows.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive.')
+        if keyset:
+            if self.window != (0, None) or self.ordering or self.projection is not None:
+                raise TypeError('Keyset iteration needs an unsliced, unordered query of model objects.')
+            return self.map_rows(self.keyset_chunks(chunk_size), chunk_size)
+        return self.map_rows(self.wrap_rows(self.get_query().yield_per(chunk_size)), chunk_size)
+
+    def keyset_chunks(self, chunk_size: int):
+        mapper = sa.inspect(self.model)
+        columns = [getattr(self.model, mapper.get_property_by_column(column).key) for column in mapper.primary_key]
+        key = sa.tuple_(*columns) if len(columns) > 1 else columns[0]
+        chunks = replace(self, ordering=tuple((column, False) for column in columns), window=(0, chunk_size))
+
+        chunk = chunks
+        while True:
+            objects = list(chunk.wrap_rows(chunk.get_query()))
+            yield from objects
+            if len(objects) < chunk_size:
+                return
+            values = [getattr(objects[-1], column.key) for column in columns]
+            after = sa.tuple_(*values) if len(values) > 1 else values[0]
+            chunk = replace(chunks, query=self.base_query().filter(key > after))
+
+    def wrap_rows(self, rows: Iterable):
+        """
+        Turn the rows of `get_query` into dicts for `values` and `group_by`,
+        or `Annotated` objects for `annotate`.
+        """
+        if self.projection is not None:
+            converters = [(name, convert) for name, (_, convert) in self.row_columns().items()]
+            return (
+                {name: convert(value) for (name, convert), value in zip(converters, row)}
+                for row
+                in rows
+            )
+        elif self.annotations:
+            names = [name for name, _ in self.annotations]
+            return (Annotated(row[0], dict(zip(names, row[1:]))) for row in rows)
+        return iter(rows)
+
+    def map_rows(self, rows: Iterable, chunk_size: int = 1000):
+        if self.mapper is None or self.projection is not None:
+            return rows
+        return self.mapper.map_all(rows, self.identity_map, chunk_size)
+
+    def __iter__(self):
+        """
+        Iterate over the results, which SQLAlchemy fetches all at once
+        before the first is yielded. Use `iterator()` to stream them.
+        """
+        return self.map_rows(self.wrap_rows(self.get_query()))
@@ -0,0 +1,475 @@
+from bisect import bisect_left, insort
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from shared.common_query import A, And, Eq, Ge, Gt, LazyObject, Le, Lt
+
+INFINITY = float('inf')
+
+
+def sort_key(value):
+    # None cannot be compared with other values, so it is ordered after
+    # all of them instead.
+    return (value is None, value)
+
+
+# Sorts before the entry of any object whose value is None.
+FIRST_NONE = ((True,),)
+
+
+class HashIndex:
+    """
+    Maps each value of `field` to the objects holding it, keyed by primary
+    key. Answers equality lookups in constant time. Values must be hashable.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self._buckets: Dict[Any, Dict[Any, Tuple[int, Any]]] = {}
+
+    def add(self, key, value, position, object):
+        self._buckets.setdefault(value, {})[key] = (position, object)
+
+    def remove(self, key, value, position):
+        bucket = self._buckets.get(value)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[value]
+
+    def add_many(self, entries):
+        # Hash every value first, so that an unhashable one adds nothing.
+        for _, value, _, _ in entries:
+            hash(value)
+        for entry in entries:
+            self.add(*entry)
+
+    def remove_many(self, entries):
+        for entry in entries:
+            self.remove(*entry)
+
+    def lookup(self, lower, upper):
+        """
+        Return (position, object) pairs for the objects whose value lies
+        between the (value, inclusive) bounds `lower` and `upper`, or None if
+        this index cannot answer the range.
+        """
+        if lower is None or upper is None or lower != upper or not lower[1]:
+            return None
+        return list(self._buckets.get(lower[0], {}).values())
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.field)
+
+
+class SortedIndex:
+    """
+    Keeps (value, position, object) entries of `field` sorted, so that range
+    comparisons become two binary searches and ordering by the field becomes
+    a walk over the entries. Values must be mutually comparable, except
+    None: objects without a value sort after all the others, never match
+    a range comparison, and only match `== None`.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self._entries = []
+
+    def add(self, key, value, position, object):
+        insort(self._entries, (sort_key(value), position, object))
+
+    def remove(self, key, value, position):
+        del self._entries[bisect_left(self._entries, (sort_key(value), position))]
+
+    def add_many(self, entries):
+        """
+        Add (key, value, position, object) entries with a single sort,
+        rather than shifting the entries once per insertion. Nothing is
+        added if a value cannot be compared with the others.
+        """
+        sorted_entries = self._entries + [(sort_key(value), position, object) for _, value, position, object in entries]
+        sorted_entries.sort()
+        self._entries = sorted_entries
+
+    def remove_many(self, entries):
+        positions = {position for _, _, position in entries}
+        self._entries = [entry for entry in self._entries if entry[1] not in positions]
+
+    def span(self, lower, upper):
+        """
+        Return the slice of entries between the (value, inclusive) bounds
+        `lower` and `upper`, either of which may be None.
+        """
+        start, stop = 0, len(self._entries)
+        if lower is not None:
+            key, inclusive = sort_key(lower[0]), lower[1]
+            start = bisect_left(self._entries, (key,) if inclusive else (key, INFINITY))
+        if upper is not None:
+            key, inclusive = sort_key(upper[0]), upper[1]
+            stop = bisect_left(self._entries, (key, INFINITY) if inclusive else (key,))
+        elif lower is not None:
+            stop = bisect_left(self._entries, FIRST_NONE)
+        return start, max(start, stop)
+
+    def lookup(self, lower, upper):
+        start, stop = self.span(lower, upper)
+        return [(position, object) for _, position, object in self._entries[start:stop]]
+
+    def walk(self, lower=None, upper=None, reverse=False):
+        """
+        Return the objects between `lower` and `upper` ordered by value, the
+        way a stable sort would: objects with equal values stay in store
+        order, even when walking in reverse.
+        """
+        start, stop = self.span(lower, upper)
+        entries = self._entries
+        if not reverse:
+            return map(itemgetter(2), map(entries.__getitem__, range(start, stop)))
+        return self._walk_reversed(start, stop)
+
+    def _walk_reversed(self, start, stop):
+        entries = self._entries
+        index = stop - 1
+        while index >= start:
+            value = entries[index][0]
+            first = index
+            while first > start and entries[first - 1][0] == value:
+                first -= 1
+            for _, _, object in entries[first:index + 1]:
+                yield object
+            index = first - 1
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.field)
+
+
+def field_name(node):
+    """
+    Return the field name `node` reads from the item itself, e.g. 'points'
+    for `A('points')`, or None for anything else.
+    """
+    if type(node) is A and node.parent is None and isinstance(node.arguments, str):
+        return node.arguments
+    return None
+
+
+def conjuncts(queries):
+    for query in queries:
+        if type(query) is And:
+            yield from conjuncts(query.operands)
+        else:
+            yield query
+
+
+def tighter(bound, other, pick):
+    if bound is None:
+        return other
+    if bound[0] == other[0]:
+        return bound[0], bound[1] and other[1]
+    return bound if pick(bound[0], other[0]) == bound[0] else other
+
+
+def field_bounds(queries):
+    """
+    Collect the constant bounds that a conjunction of `queries` puts on each
+    field, as {field: (lower, upper)} with each bound a (value, inclusive)
+    pair or None. `Eq` bounds a field from both sides and chained
+    comparisons like `Lt(0, A('points'), 10)` contribute every pair.
+    """
+    bounds = {}
+    for query in conjuncts(queries):
+        if type(query) not in (Eq, Gt, Ge, Lt, Le):
+            continue
+        for left, right in zip(query.operands, query.operands[1:]):
+            operator = type(query)
+            if field_name(left) is not None and not isinstance(right, LazyObject):
+                field, value = field_name(left), right
+            elif field_name(right) is not None and not isinstance(left, LazyObject):
+                field, value = field_name(right), left
+                operator = {Gt: Lt, Ge: Le, Lt: Gt, Le: Ge}.get(operator, operator)
+            else:
+                continue
+
+            lower, upper = bounds.get(field, (None, None))
+            try:
+                if operator in (Eq, Gt, Ge):
+                    lower = tighter(lower, (value, operator is not Gt), max)
+                if operator in (Eq, Lt, Le):
+                    upper = tighter(upper, (value, operator is not Lt), min)
+            except TypeError:
+                continue
+            bounds[field] = (lower, upper)
+    return bounds
+
+
+class MemoryStore:
+    """
+    An in-memory collection of objects keyed by `primary_key`, with the
+    indexes listed in `indexes` kept in sync on every insert, update and
+    delete. A field name declares a `HashIndex`; pass a `SortedIndex` for
+    range comparisons and ordering. A write that an index rejects, e.g. an
+    unhashable value for a `HashIndex`, raises and leaves the store and
+    its indexes as they were. Calling the store returns its objects,
+    so it can be used as the `get_objects` of a `MemoryQuerySet`, which will
+    then answer filters and orderings on indexed fields from the indexes.
+    `version` is bumped on every change made through the store, so that
+    results computed from it can tell when they are stale, and listeners
+    added with `subscribe` are called with each change as it happens.
+    """
+
+    def __init__(
+        self,
+        objects: Iterable = (),
+        indexes: Iterable = (),
+        primary_key: str = 'id',
+        get_value: Callable[[Any, str], Any] = getattr,
+    ):
+        self.primary_key = primary_key
+        self.get_value = get_value
+        self.indexes = {}
+        self._objects = {}
+        self._values = {}
+        self._positions = {}
+        self._counter = 0
+        self.version = 0
+        self.listeners = []
+
+        for index in indexes:
+            self.create_index(index)
+        for object in objects:
+            self.insert(object)
+
+    def create_index(self, index):
+        if isinstance(index, str):
+            index = HashIndex(index)
+        entries = [
+            (key, self.get_value(object, index.field), self._positions[key], object)
+            for key, object
+            in self._objects.items()
+        ]
+        index.add_many(entries)
+        self.indexes[index.field] = index
+        for key, value, _, _ in entries:
+            self._values[key][index.field] = value
+        return index
+
+    def get(self, key, default=None):
+        return self._objects.get(key, default)
+
+    def insert(self, object):
+        key = self.get_value(object, self.primary_key)
+        if key in self._objects:
+            raise ValueError('An object with {} {!r} already exists'.format(self.primary_key, key))
+        self._index_many({key: object}, {key: self._counter})
+        self._objects[key] = object
+        self._positions[key] = self._counter
+        self._counter += 1
+        self._notify('insert', key, object)
+
+    def update(self, object):
+        """
+        Re-index `object`, either an object of the store mutated in place or
+        a replacement for the object with the same primary key.
+        """
+        key = self.get_value(object, self.primary_key)
+        if key not in self._objects:
+            raise KeyError(key)
+        self._reindex_many({key: object})
+        self._objects[key] = object
+        self._notify('update', key, object)
+
+    def delete(self, object):
+        key = self.get_value(object, self.primary_key)
+        if key not in self._objects:
+            raise KeyError(key)
+        self._unindex_many([key])
+        object = self._objects.pop(key)
+        del self._positions[key]
+        self._notify('delete', key, object)
+
+    def insert_many(self, objects: Iterable) -> int:
+        """
+        Insert `objects`, indexing them in one pass per index. Nothing is
+        inserted if any primary key is already taken, or repeated within
+        `objects`.
+        """
+        objects = self._by_key(objects)
+        for key in objects:
+            if key in self._objects:
+                raise ValueError('An object with {} {!r} already exists'.format(self.primary_key, key))
+        positions = {key: self._counter + offset for offset, key in enumerate(objects)}
+        self._index_many(objects, positions)
+        self._objects.update(objects)
+        self._positions.update(positions)
+        self._counter += len(objects)
+        for key, object in objects.items():
+            self._notify('insert', key, object)
+        return len(objects)
+
+    def update_many(self, objects: Iterable) -> int:
+        """
+        Re-index `objects` like `update`, in one pass per index. Nothing is
+        updated if any of them is not in the store.
+        """
+        objects = self._by_key(objects)
+        self._check_keys(objects)
+        self._reindex_many(objects)
+        self._objects.update(objects)
+        for key, object in objects.items():
+            self._notify('update', key, object)
+        return len(objects)
+
+    def delete_many(self, objects: Iterable) -> int:
+        """
+        Delete `objects`, in one pass per index. Nothing is deleted if any
+        of them is not in the store.
+        """
+        objects = self._by_key(objects)
+        self._check_keys(objects)
+        self._unindex_many(objects)
+        for key in objects:
+            objects[key] = self._objects.pop(key)
+            del self._positions[key]
+        for key, object in objects.items():
+            self._notify('delete', key, object)
+        return len(objects)
+
+    def subscribe(self, listener: Callable[[str, Any, Any], None]):
+        """
+        Call `listener` with `('insert' | 'update' | 'delete', key, object)`
+        after every change made through the store.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def lookup(self, queries) -> Optional[list]:
+        """
+        Return the objects that may match all of `queries`, found by probing
+        the most selective applicable index, in store order. Returns None if
+        no index applies, in which case every object has to be scanned.
+        """
+        best = None
+        for field, (lower, upper) in field_bounds(queries).items():
+            index = self.indexes.get(field)
+            try:
+                keys = index.lookup(lower, upper) if index is not None else None
+            except TypeError:
+                keys = None
+            if keys is not None and (best is None or len(keys) < len(best)):
+                best = keys
+
+        if best is None:
+            return None
+        if len(best) > 1:
+            best.sort(key=itemgetter(0))
+        return [object for _, object in best]
+
+    def walk(self, field, queries=(), reverse=False):
+        """
+        Order the objects by `field` using its `SortedIndex`, limited to the
+        range that `queries` put on the field. Returns the number of objects
+        in that range and an iterator over them, or None if the field has no
+        sorted index.
+        """
+        index = self.indexes.get(field)
+        if not isinstance(index, SortedIndex):
+            return None
+        lower, upper = field_bounds(queries).get(field, (None, None))
+        try:
+            start, stop = index.span(lower, upper)
+        except TypeError:
+            lower, upper = None, None
+            start, stop = index.span(lower, upper)
+        return stop - start, index.walk(lower, upper, reverse)
+
+    def _notify(self, change, key, object):
+        self.version += 1
+        for listener in self.listeners:
+            listener(change, key, object)
+
+
+    def _by_key(self, objects):
+        by_key = {}
+        for object in objects:
+            key = self.get_value(object, self.primary_key)
+            if key in by_key:
+                raise ValueError('Several objects with {} {!r} in the batch'.format(self.primary_key, key))
+            by_key[key] = object
+        return by_key
+
+    def _check_keys(self, objects):
+        for key in objects:
+            if key not in self._objects:
+                raise KeyError(key)
+
+    def _index_many(self, objects, positions, values=None):
+        """
+        Add `objects`, by key, to every index at `positions`, with the
+        field `values` given or read from them. Either every index gets
+        them, or, if one raises, the indexes already updated are reverted.
+        """
+        if values is None:
+            values = {
+                key: {field: self.get_value(object, field) for field in self.indexes}
+                for key, object
+                in objects.items()
+            }
+        updated = []
+        try:
+            for field, index in self.indexes.items():
+                entries = [(key, values[key][field], positions[key], object) for key, object in objects.items()]
+                if len(entries) == 1:
+                    index.add(*entries[0])
+                else:
+                    index.add_many(entries)
+                updated.append((field, index))
+        except BaseException:
+            for field, index in updated:
+                index.remove_many([(key, values[key][field], positions[key]) for key in objects])
+            raise
+        self._values.update(values)
+
+    def _unindex_many(self, keys):
+        values = {key: self._values.pop(key) for key in keys}
+        for field, index in self.indexes.items():
+            entries = [(key, fields[field], self._positions[key]) for key, fields in values.items()]
+            if len(entries) == 1:
+                index.remove(*entries[0])
+            else:
+                index.remove_many(entries)
+        return values
+
+    def _reindex_many(self, objects):
+        """
+        Move the index entries of the stored objects with the keys of
+        `objects` to `objects`, or leave them as they were if an index
+        rejects the new values.
+        """
+        positions = {key: self._positions[key] for key in objects}
+        values = self._unindex_many(objects)
+        try:
+            self._index_many(objects, positions)
+        except BaseException:
+            self._index_many({key: self._objects[key] for key in objects}, positions, values)
+            raise
+
+    def __call__(self):
+        return self._objects.values()
+
+    def __iter__(self):
+        return iter(self._objects.values())
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, object):
+        return self.get_value(object, self.primary_key) in self._objects
+
+    def __repr__(self):
+        return '<{} ({} objects, indexes={!r})>'.format(
+            self.__class__.__name__,
+            len(self),
+            list(self.indexes.values()),
+        )
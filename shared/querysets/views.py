@@ -0,0 +1,129 @@
+from typing import Any, Dict
+
+from shared.common_query.aggregations import Aggregation, Count, Has, Mean, Sum
+from shared.querysets.memory import ExcludePipe, FilterPipe, MemoryQuerySet
+from shared.querysets.stores import MemoryStore
+
+
+class MaterializedView:
+    """
+    The objects of a `MemoryStore` matching a filtered `MemoryQuerySet`, and
+    named `Count`, `Has`, `Sum` and `Mean` aggregations over them, kept up
+    to date from the changes the store reports. Each change costs one
+    evaluation of the filters on the changed object, and reading the view
+    costs only its size. Objects are kept in the order they joined the view.
+
+    Sums are adjusted by adding and subtracting values, so floating point
+    sums may drift slightly from a fresh `Sum` over the same objects. A
+    `Mean` is None while it has no objects. Aggregations with a `where`
+    query only count the members matching it.
+    """
+
+    def __init__(self, queryset: MemoryQuerySet, **aggregations: Aggregation):
+        if not isinstance(queryset.get_objects, MemoryStore):
+            raise TypeError('Materialized views need a queryset over a MemoryStore.')
+        for pipe in queryset.pipeline:
+            if not isinstance(pipe, (FilterPipe, ExcludePipe)):
+                raise ValueError('Only filters and excludes can be maintained incrementally, not {}.'.format(type(pipe).__name__))
+        for name, aggregation in aggregations.items():
+            if not isinstance(aggregation, (Count, Has, Sum, Mean)):
+                raise ValueError('{} cannot be maintained incrementally.'.format(type(aggregation).__name__))
+
+        self.queryset = queryset
+        self.store = queryset.get_objects
+        self.aggregations = aggregations
+        self.predicates = {
+            name: queryset.compiler.compile(aggregation.query)
+            for name, aggregation
+            in aggregations.items()
+            if aggregation.query is not None
+        }
+        # Per aggregation, how many members it counts and the sum of their
+        # values, for `Sum` and `Mean`.
+        self.counts = dict.fromkeys(aggregations, 0)
+        self.totals = dict.fromkeys(aggregations, 0)
+        self._members = {}
+        self._values = {}
+
+        for object in queryset:
+            self._add(self.store.get_value(object, self.store.primary_key), object)
+        self.store.subscribe(self.apply)
+
+    def matches(self, object):
+        objects = [object]
+        for pipe in self.queryset.pipeline:
+            objects = pipe(objects)
+        for _ in objects:
+            return True
+        return False
+
+    def apply(self, change: str, key, object):
+        """
+        Update the view with a change reported by the store.
+        """
+        member = change != 'delete' and self.matches(object)
+        if key in self._members:
+            self._subtract(key)
+            if not member:
+                del self._members[key]
+        if member:
+            self._add(key, object)
+
+    def close(self):
+        """
+        Stop following the store's changes.
+        """
+        self.store.unsubscribe(self.apply)
+
+    @property
+    def aggregates(self) -> Dict[str, Any]:
+        results = {}
+        for name, aggregation in self.aggregations.items():
+            if isinstance(aggregation, Count):
+                results[name] = self.counts[name]
+            elif isinstance(aggregation, Has):
+                results[name] = self.counts[name] > 0
+            elif isinstance(aggregation, Sum):
+                results[name] = self.totals[name]
+            else:
+                results[name] = self.totals[name] / self.counts[name] if self.counts[name] else None
+        return results
+
+    def all(self):
+        """
+        Return a `MemoryQuerySet` over the objects currently in the view.
+        """
+        return MemoryQuerySet(get_objects=lambda: list(self._members.values()), compiler=self.queryset.compiler)
+
+    def _add(self, key, object):
+        # Remember what the object added, since an object updated in place
+        # no longer holds those values when it is removed.
+        values = self._values[key] = []
+        for name, aggregation in self.aggregations.items():
+            predicate = self.predicates.get(name)
+            if predicate is not None and not predicate(object):
+                continue
+            if isinstance(aggregation, Has) and not object:
+                continue
+            value = self.store.get_value(object, aggregation.field) if isinstance(aggregation, (Sum, Mean)) else 0
+            self.counts[name] += 1
+            self.totals[name] += value
+            values.append((name, value))
+        self._members[key] = object
+
+    def _subtract(self, key):
+        for name, value in self._values.pop(key):
+            self.counts[name] -= 1
+            self.totals[name] -= value
+
+    def __iter__(self):
+        return iter(self._members.values())
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, object):
+        return self.store.get_value(object, self.store.primary_key) in self._members
+
+    def __repr__(self):
+        return '<{} ({} objects, {!r})>'.format(self.__class__.__name__, len(self._members), self.aggregates)
@@ -0,0 +1,174 @@
+from copy import deepcopy
+from dataclasses import fields, is_dataclass
+from typing import Any, Dict, Optional, Type
+
+from shared.mappers import DataEntityMapper, IdentityMap
+
+
+def snapshot(entity):
+    """
+    Return a copy of the state of `entity` to compare it with later.
+    """
+    if is_dataclass(entity):
+        return tuple(deepcopy(getattr(entity, field.name)) for field in fields(entity))
+    return deepcopy(vars(entity))
+
+
+class UnitOfWork:
+    """
+    Collects the entities created, changed and deleted during a business
+    transaction and writes them all at `commit`, each entity type to the
+    writable queryset given for it in `querysets`, e.g. a `MemoryQuerySet`
+    over a `MemoryStore` or a `SQLAlchemyQuerySet`. A type with an entry in
+    `mappers` is converted with the mapper's `unmap` before it is written.
+
+    Writes are grouped by type and operation, and each group is written
+    with one bulk call: inserts and updates in the order of `querysets`,
+    deletes in reverse, so that parent types are listed first. Entities
+    registered clean are compared with a snapshot taken at registration,
+    and only those that changed are written, as are those registered
+    dirty. SQLAlchemy sessions used by the querysets are committed after
+    the writes, and rolled back if a write fails. Writes already made to a
+    `MemoryStore` cannot be rolled back.
+
+    Used as a context manager, the unit of work commits when the block
+    exits normally and rolls back when it raises.
+    """
+
+    def __init__(
+        self,
+        querysets: Dict[Type, Any],
+        mappers: Optional[Dict[Type, DataEntityMapper]] = None,
+        identity_map: Optional[IdentityMap] = None,
+    ):
+        self.querysets = querysets
+        self.mappers = mappers or {}
+        self.identity_map = IdentityMap() if identity_map is None else identity_map
+        self.new = {}
+        self.dirty = {}
+        self.deleted = {}
+        self.snapshots = {}
+
+    def key(self, entity):
+        type_ = type(entity)
+        if type_ not in self.querysets:
+            raise TypeError('No queryset to write {} entities to.'.format(type_.__name__))
+        return type_, entity.id
+
+    def register_clean(self, *entities):
+        """
+        Track loaded entities, to be written at commit only if changed.
+        """
+        for entity in entities:
+            key = self.key(entity)
+            self.snapshots[key] = (entity, snapshot(entity))
+            self.identity_map.add(*key, entity)
+
+    def register_new(self, *entities):
+        for entity in entities:
+            key = self.key(entity)
+            if key in self.deleted:
+                del self.deleted[key]
+                self.dirty[key] = entity
+            else:
+                self.new[key] = entity
+            self.identity_map.add(*key, entity)
+
+    def register_dirty(self, *entities):
+        """
+        Mark entities to be written at commit, unless they are new or match
+        their snapshot.
+        """
+        for entity in entities:
+            key = self.key(entity)
+            if key not in self.new and key not in self.deleted:
+                self.dirty[key] = entity
+
+    def register_deleted(self, *entities):
+        for entity in entities:
+            key = self.key(entity)
+            self.dirty.pop(key, None)
+            self.snapshots.pop(key, None)
+            self.identity_map.discard(*key)
+            if self.new.pop(key, None) is None:
+                self.deleted[key] = entity
+
+    def changes(self):
+        """
+        Return the entities to insert, update and delete, grouped by type
+        in the order of `querysets`.
+        """
+        def changed(key, entity):
+            return key not in self.snapshots or snapshot(entity) != self.snapshots[key][1]
+
+        dirty = {key: entity for key, entity in self.dirty.items() if changed(key, entity)}
+        for key, (entity, _) in self.snapshots.items():
+            if key not in dirty and key not in self.dirty and changed(key, entity):
+                dirty[key] = entity
+
+        def group(entities):
+            groups = {type_: [] for type_ in self.querysets}
+            for (type_, _), entity in entities.items():
+                groups[type_].append(entity)
+            return {type_: entities for type_, entities in groups.items() if entities}
+
+        return group(self.new), group(dirty), group(self.deleted)
+
+    def commit(self):
+        new, dirty, deleted = self.changes()
+        try:
+            for type_, entities in new.items():
+                self.querysets[type_].bulk_create(self.unmap(type_, entities))
+            for type_, entities in dirty.items():
+                self.querysets[type_].bulk_update(self.unmap(type_, entities))
+            for type_, entities in reversed(list(deleted.items())):
+                self.querysets[type_].bulk_delete(self.unmap(type_, entities))
+            for session in self.sessions():
+                session.commit()
+        except BaseException:
+            self.rollback()
+            raise
+
+        for entities in (new, dirty):
+            for entities_of_type in entities.values():
+                self.register_clean(*entities_of_type)
+        self.new, self.dirty, self.deleted = {}, {}, {}
+
+    def rollback(self):
+        """
+        Forget the registered changes and roll back the SQLAlchemy sessions.
+        """
+        for session in self.sessions():
+            session.rollback()
+        self.new, self.dirty, self.deleted = {}, {}, {}
+
+    def unmap(self, type_, entities):
+        mapper = self.mappers.get(type_)
+        if mapper is None:
+            return entities
+        return [mapper.unmap(entity) for entity in entities]
+
+    def sessions(self):
+        sessions = []
+        for queryset in self.querysets.values():
+            session = getattr(queryset, 'session', None)
+            if session is not None and session not in sessions:
+                sessions.append(session)
+        return sessions
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def __repr__(self):
+        return '<{} ({} new, {} dirty, {} deleted)>'.format(
+            self.__class__.__name__,
+            len(self.new),
+            len(self.dirty),
+            len(self.deleted),
+        )